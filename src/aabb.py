@@ -1,105 +1,117 @@
 import sys
+from math import inf
 
 from utils import Interval, Ray, Point, min_max
 
 class AABB:
     """
-    Docstring for AABB class.
+    Axis-aligned bounding box. The bounds are stored as six plain floats,
+    `bounds = (x_min, x_max, y_min, y_max, z_min, z_max)`, so that `hit` can pick the near and far slab
+    planes by indexing with the ray's per-axis sign.
     """
 
+    __slots__ = ("bounds",)
+
     def __init__(self, ix: Interval = Interval(), iy: Interval = Interval(), iz: Interval = Interval()):
-        self.slab_x = ix
-        self.slab_y = iy
-        self.slab_z = iz
-    
+        self.bounds: tuple[float, ...] = (ix.lower_b, ix.upper_b, iy.lower_b, iy.upper_b, iz.lower_b, iz.upper_b)
+
+    @classmethod
+    def from_bounds(cls, x0: float, x1: float, y0: float, y1: float, z0: float, z1: float) -> 'AABB':
+        """Alternate constructor for AABB which takes the six bounds directly, without allocating intervals."""
+
+        box = cls.__new__(cls)
+        box.bounds = (x0, x1, y0, y1, z0, z1)
+        return box
+
     @classmethod
     def from_corners(cls, _a: Point, _b: Point):
         """Alternate constructor for AABB which constructs the bounding box using two corners"""
 
-        ix = Interval(min(_a.x, _b.x), max(_a.x, _b.x))
-        iy = Interval(min(_a.y, _b.y), max(_a.y, _b.y))
-        iz = Interval(min(_a.z, _b.z), max(_a.z, _b.z))
-        return cls(ix, iy, iz)
-    
+        return cls.from_bounds(min(_a.x, _b.x), max(_a.x, _b.x),
+                               min(_a.y, _b.y), max(_a.y, _b.y),
+                               min(_a.z, _b.z), max(_a.z, _b.z))
+
     @classmethod
     def merge(cls, _box0: 'AABB', _box1: 'AABB') -> 'AABB':
         """
         Constructors a bounding box from two bounding boxes.
         """
 
-        ix = Interval.merge(_box0.slab_x, _box1.slab_x)
-        iy = Interval.merge(_box0.slab_y, _box1.slab_y)
-        iz = Interval.merge(_box0.slab_z, _box1.slab_z)
-        return cls(ix, iy, iz)
-    
+        a = _box0.bounds
+        b = _box1.bounds
+        return cls.from_bounds(a[0] if a[0] < b[0] else b[0], a[1] if a[1] > b[1] else b[1],
+                               a[2] if a[2] < b[2] else b[2], a[3] if a[3] > b[3] else b[3],
+                               a[4] if a[4] < b[4] else b[4], a[5] if a[5] > b[5] else b[5])
+
+    @property
+    def slab_x(self) -> Interval:
+        return Interval(self.bounds[0], self.bounds[1])
+
+    @property
+    def slab_y(self) -> Interval:
+        return Interval(self.bounds[2], self.bounds[3])
+
+    @property
+    def slab_z(self) -> Interval:
+        return Interval(self.bounds[4], self.bounds[5])
+
     def axis(self, n: int) -> Interval:
         """TODO: remove late if restricting vector to 3 dimensions."""
-        
+
         if n == 1:
             return self.slab_y
         if n == 2:
             return self.slab_z
         return self.slab_x
-    
-    def hit(self, _r: Ray, ray_t: Interval) -> bool:
-        """Returns true if a ray intersects this `AABB` within `ray_t`."""
-
-        # sys.stderr.write(f"Determining if there is collision with AABB:\n\t{self.slab_x}\n\t{self.slab_y}\n\t{self.slab_z}\n")
-        # lower_b = ray_t.lower_b
-        # upper_b = ray_t.upper_b
-        # sys.stderr.write(f"Ray:\n\torigin = {_r.origin}\n\tdirection = {_r.dir}\n")
 
-        lower_b = ray_t.lower_b
-        upper_b = ray_t.upper_b
+    def lower(self, n: int) -> float:
+        """Returns the lower bound of the box along axis `n`."""
 
-        inv_ray_dir: float = 1.0 / _r.dir.x
-        t0: float = (self.slab_x.lower_b - _r.origin.x) * inv_ray_dir
-        t1: float = (self.slab_x.upper_b - _r.origin.x) * inv_ray_dir
+        return self.bounds[2 * n]
 
-        if inv_ray_dir < 0.0:
-            t0, t1 = t1, t0
+    def centroid(self, n: int) -> float:
+        """Returns the center of the box along axis `n`."""
 
-        if t0 > lower_b:
-            lower_b = t0
-        if t1 < upper_b:
-            upper_b = t1
-
-        if upper_b <= lower_b:
-            return False
-        
-        
-        inv_ray_dir: float = 1 / _r.dir.y
-        t0 = (self.slab_y.lower_b - _r.origin.y) * inv_ray_dir
-        t1 = (self.slab_y.upper_b - _r.origin.y) * inv_ray_dir
+        return 0.5 * (self.bounds[2 * n] + self.bounds[2 * n + 1])
 
-        if inv_ray_dir < 0:
-            t0, t1 = t1, t0
+    def hit(self, _r: Ray, t_min: float, t_max: float) -> bool:
+        """
+        Returns true if a ray intersects this `AABB` within (`t_min`, `t_max`).
 
-        if t0 > lower_b:
-            lower_b = t0
-        if t1 < upper_b:
-            upper_b = t1
+        Uses the reciprocal direction and per-axis signs cached on the ray, so the slab test performs no
+        divisions, branches on the sign or allocations.
+        """
 
-        if upper_b <= lower_b:
+        b = self.bounds
+        ox, oy, oz = _r.orig
+        ix, iy, iz = _r.inv_dir
+        sx, sy, sz = _r.sign
+
+        t0 = (b[sx] - ox) * ix
+        t1 = (b[sx ^ 1] - ox) * ix
+        if t0 > t_min:
+            t_min = t0
+        if t1 < t_max:
+            t_max = t1
+        if t_max <= t_min:
             return False
-        
-        
-        inv_ray_dir: float = 1 / _r.dir.z
-        t0 = (self.slab_z.lower_b - _r.origin.z) * inv_ray_dir
-        t1 = (self.slab_z.upper_b - _r.origin.z) * inv_ray_dir
 
-        if inv_ray_dir < 0:
-            t0, t1 = t1, t0
+        t0 = (b[2 + sy] - oy) * iy
+        t1 = (b[3 - sy] - oy) * iy
+        if t0 > t_min:
+            t_min = t0
+        if t1 < t_max:
+            t_max = t1
+        if t_max <= t_min:
+            return False
 
-        if t0 > lower_b:
-            lower_b = t0
-        if t1 < upper_b:
-            upper_b = t1
+        t0 = (b[4 + sz] - oz) * iz
+        t1 = (b[5 - sz] - oz) * iz
+        if t0 > t_min:
+            t_min = t0
+        if t1 < t_max:
+            t_max = t1
+        return t_min < t_max
 
-        if upper_b <= lower_b:
-            return False
-        
-        return True
-    
     def __str__(self) -> str:
-        return f"slab_x = {self.slab_x}\nslab_y = {self.slab_y}\nslab_z = {self.slab_z}"
\ No newline at end of file
+        return f"slab_x = {self.slab_x}\nslab_y = {self.slab_y}\nslab_z = {self.slab_z}"
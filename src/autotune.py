@@ -0,0 +1,190 @@
+"""
+Autotuner of the acceleration and scheduling parameters on this machine. Run from `src/`:
+
+    python autotune.py                                  # tune on the final render scene, save the profile
+    python autotune.py --scene my_scene.json --width 96 --spp 4
+    python autotune.py --dry-run                        # only print the best settings
+
+Renders a small, seeded calibration image of the scene with every candidate value of one parameter at a time
+(BVH split strategy and leaf size, packet size, worker count, scanlines per task and pool backend), keeping
+the fastest before moving on to the next, until a round changes nothing. A value must beat the current one by
+`--margin` to replace it. Each configuration is timed from an unbuilt scene to the last scanline, so that BVH
+build time counts as much as traversal time. The reported speedup comes from fresh, alternating renders of
+the defaults and the winner, not from the timings the search picked the winner by. The best configuration is
+saved as the tuning profile (see `tuning.py`), which `BVH_Tree` and `Camera` read whenever their parameters
+are left unset.
+
+The number of samples per task is not tuned: workers always trace all the samples of their scanlines,
+since splitting a pixel's samples between tasks would change the order its sums are added in, and with it
+the image. The work per task is tuned through the scanlines per task instead.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import statistics
+
+import settings
+import tuning
+from camera import Camera
+from bvh import BVH_Tree
+from hittable_list import HittableList
+from scene import DEFAULT_CAMERA, random_spheres, load_scene, camera_kwargs
+
+
+def candidates(cpus: int) -> dict[str, tuple]:
+    """Returns the values tried for each parameter, in the order the parameters are tuned."""
+
+    workers = sorted({1 << k for k in range(cpus.bit_length()) if 1 << k <= cpus} | {cpus})
+    return {
+        "split": BVH_Tree.SPLITS,
+        "leaf_size": (2, 4, 8),
+        "packet_size": (0, 4, 8),
+        "workers": tuple(workers),
+        "rows_per_task": (1, 2, 4, 8),
+        "backend": Camera.BACKENDS,
+    }
+
+
+def apply(config: dict) -> None:
+    """Sets the parameters of `config` on `BVH_Tree` and `Camera`, overriding any profile."""
+
+    BVH_Tree.split = config["split"]
+    BVH_Tree.leaf_size = config["leaf_size"]
+    Camera.packet_size = config["packet_size"]
+    Camera.rows_per_task = config["rows_per_task"]
+    Camera.backend = config["backend"]
+
+
+def measure(world: HittableList, cam: Camera, config: dict, seed: int, repeats: int) -> tuple[float, list]:
+    """
+    Returns the fastest of `repeats` times to build the world's BVH and render the calibration image with
+    `config`, and the rendered image.
+    """
+
+    apply(config)
+    best = float("inf")
+    image = None
+    for _ in range(repeats):
+        world.accel = None
+        # the random split draws its axes from the global generator
+        random.seed(seed)
+        start = time.perf_counter()
+        rows = list(cam.render_rows(world, range(cam.image_height), config["workers"]))
+        best = min(best, time.perf_counter() - start)
+        image = [[(c.x, c.y, c.z) for c in row] for row in rows]
+    return best, image
+
+
+def tune(world: HittableList, cam: Camera, seed: int = 0, repeats: int = 2, rounds: int = 2,
+         margin: float = 0.1) -> dict:
+    """
+    Searches the parameters one at a time, starting from the defaults, and returns the fastest configuration
+    found. A value only replaces the current one if it is faster by more than the fraction `margin`, so that
+    run-to-run noise does not pick the winners.
+    """
+
+    options = candidates(os.cpu_count() or 1)
+    config = dict(tuning.DEFAULTS)
+    # an untimed render first, so that the defaults are not charged for warming up
+    measure(world, cam, config, seed, 1)
+    best_seconds, reference = measure(world, cam, config, seed, repeats)
+    print(f"{'defaults':>24}: {best_seconds:7.3f}s")
+    tried = {tuple(config.items())}
+
+    for _ in range(rounds):
+        changed = False
+        for name, values in options.items():
+            # the way rows are handed out does not matter to a single worker
+            if name in ("rows_per_task", "backend") and config["workers"] == 1:
+                continue
+            for value in values:
+                trial = dict(config, **{name: value})
+                key = tuple(trial.items())
+                if key in tried:
+                    continue
+                tried.add(key)
+                seconds, image = measure(world, cam, trial, seed, repeats)
+                if image != reference:
+                    print(f"{f'{name}={value}':>24}: {seconds:7.3f}s, image differs from the defaults, skipped")
+                    continue
+                print(f"{f'{name}={value}':>24}: {seconds:7.3f}s")
+                if seconds < best_seconds * (1.0 - margin):
+                    config, best_seconds, changed = trial, seconds, True
+        if not changed:
+            break
+    return config
+
+
+def confirm(world: HittableList, cam: Camera, config: dict, seed: int, repeats: int = 5) -> dict:
+    """
+    Times the defaults and `config` alternately `repeats` times each, with fresh timings rather than those
+    the search chose `config` by (which favor it), and returns the median times and the speedup.
+    """
+
+    defaults = dict(tuning.DEFAULTS)
+    times: dict[str, list[float]] = {"default": [], "tuned": []}
+    for k in range(repeats):
+        # alternate which goes first, so that neither always follows the other's warm caches
+        order = (("default", defaults), ("tuned", config)) if k % 2 == 0 else (("tuned", config), ("default", defaults))
+        for label, trial in order:
+            times[label].append(measure(world, cam, trial, seed, 1)[0])
+    default_seconds, tuned_seconds = (statistics.median(times[label]) for label in ("default", "tuned"))
+    return {"default_seconds": round(default_seconds, 4), "tuned_seconds": round(tuned_seconds, 4),
+            "speedup": round(default_seconds / tuned_seconds, 3), "confirm_repeats": repeats,
+            "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Finds the fastest acceleration and scheduling parameters for "
+                                                 "this machine and saves them as the tuning profile.")
+    parser.add_argument("--scene", help="JSON scene file (defaults to the random spheres scene)")
+    parser.add_argument("--width", type=int, default=64, help="width of the calibration image")
+    parser.add_argument("--spp", type=int, default=2, help="samples per pixel of the calibration image")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the scene generation and of the renders")
+    parser.add_argument("--repeats", type=int, default=2, help="renders per configuration, the fastest counting")
+    parser.add_argument("--rounds", type=int, default=2, help="most passes over the parameters")
+    parser.add_argument("--margin", type=float, default=0.1,
+                        help="fraction by which a value must be faster to replace the current one")
+    parser.add_argument("--confirm", type=int, default=5,
+                        help="alternating renders of the defaults and the winner timed for the reported speedup")
+    parser.add_argument("-o", "--output", default=tuning.PROFILE_PATH, help="profile file to write")
+    parser.add_argument("--dry-run", action="store_true", help="print the best settings without saving them")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    if args.scene:
+        world, cam_settings = load_scene(args.scene)
+    else:
+        world, cam_settings = random_spheres(), dict(DEFAULT_CAMERA)
+    cam_settings.update(image_width=args.width, samples_per_pixel=args.spp)
+    cam = Camera(**camera_kwargs(cam_settings), seed=args.seed)
+    # the profile tunes the BVH, whatever accelerator the scene would otherwise use
+    HittableList.accelerator = "bvh"
+
+    host = tuning.host()
+    print(f"Tuning on {host['node']} ({host['cpus']} CPUs, Python {host['python']}), "
+          f"{cam.image_width}x{cam.image_height} at {cam.samples_per_pixel} spp, {len(world)} objects")
+    settings.init()
+    config = tune(world, cam, args.seed, args.repeats, args.rounds, args.margin)
+    report = confirm(world, cam, config, args.seed, args.confirm)
+    if config != tuning.DEFAULTS and report["speedup"] <= 1.0:
+        print(f"The winner is not faster when timed again ({report['speedup']:.2f}x), keeping the defaults")
+        config = dict(tuning.DEFAULTS)
+
+    print()
+    for name, value in config.items():
+        default = tuning.DEFAULTS[name]
+        print(f"{name:>14}: {value}" + ("" if value == default else f" (default {default})"))
+    print(f"default {report['default_seconds']:.3f}s, tuned {report['tuned_seconds']:.3f}s (medians of "
+          f"{args.confirm} alternating renders), {report['speedup']:.2f}x speedup")
+    if not args.dry_run:
+        report.update(scene=args.scene or "random_spheres", width=cam.image_width, spp=cam.samples_per_pixel)
+        print(f"Saved profile to {tuning.save(config, args.output, report)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
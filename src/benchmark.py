@@ -0,0 +1,558 @@
+"""
+Microbenchmarks for the ray tracer's hot paths. Run from `src/`:
+
+    python benchmark.py node_visit traversal_order
+"""
+import os
+import sys
+import math
+import pickle
+import tempfile
+import time
+import random
+import argparse
+
+import settings
+import tuning
+from utils import Point, Vector, Ray, RGB, sample_stream, use_stream
+from hittable import HitRecord
+from hittable_list import HittableList
+from camera import Camera, packet_root
+from packet import RayPacket
+from scene import random_spheres, light_box, camera_kwargs, LIGHT_BOX_CAMERA
+from sphere import Sphere
+from material import Lambertian
+from bvh import BVH_Node, BVH_Tree
+from lbvh import LBVH
+from lazy_bvh import LazyBVH
+import texture
+from texture import TiledTexture, ImageTexture, convert_texture
+from irradiance_cache import IrradianceCache
+from compiled_scene import compile_scene, load_or_compile
+from guiding import GuidingField
+from image import Accumulator
+from incremental import Footprints, FootprintRecorder, footprint_tree, render_tiles
+
+
+def primary_rays(count: int, width: int = 160, seed: int = 7) -> list[Ray]:
+    """Returns `count` camera rays through random pixels of the final render's camera."""
+
+    random.seed(seed)
+    cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, vfov=20, lookfrom=Point(13, 2, 3),
+                 lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+    return [cam.rand_pixel_ray(random.randrange(cam.image_width), random.randrange(cam.image_height))
+            for _ in range(count)]
+
+
+def bench_node_visit(rays: int = 20000) -> None:
+    """
+    Measures the cost of a single `AABB` slab test and of BVH traversal per visited node for primary rays
+    into the final render scene.
+    """
+
+    random.seed(7)
+    world = random_spheres()
+    world.build()
+    sample = primary_rays(rays)
+
+    box = world.accel.root.bbox
+    start = time.perf_counter()
+    for r in sample:
+        box.hit(r, 0.001, math.inf)
+    aabb_seconds = (time.perf_counter() - start) / len(sample)
+
+    settings.init()
+    start = time.perf_counter()
+    for r in sample:
+        world.hit(r, 0.001, math.inf)
+    elapsed = time.perf_counter() - start
+
+    print(f"AABB.hit:  {aabb_seconds * 1e9:.0f} ns")
+    print(f"traversal: {elapsed / len(sample) * 1e6:.1f} us/ray, {settings.stats.count / len(sample):.1f} nodes/ray, "
+          f"{elapsed / settings.stats.count * 1e9:.0f} ns/node")
+
+
+def bench_traversal_order(rays: int = 20000, paths: int = 2000) -> None:
+    """
+    Compares BVH nodes visited per ray with left-first and front-to-back ordered traversal, for primary
+    rays and for all rays of full paths into the final render scene.
+    """
+
+    random.seed(7)
+    world = random_spheres()
+    world.build()
+    sample = primary_rays(rays)
+    cam = Camera(aspect_ratio=16.0 / 9.0, image_width=160, max_depth=50, vfov=20, lookfrom=Point(13, 2, 3),
+                 lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+
+    for ordered in (False, True):
+        BVH_Node.ordered = ordered
+        label = "ordered" if ordered else "left-first"
+
+        settings.init()
+        start = time.perf_counter()
+        for r in sample:
+            world.hit(r, 0.001, math.inf)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>10} primary: {settings.stats.count / len(sample):.1f} nodes/ray, {elapsed / len(sample) * 1e6:.1f} us/ray")
+
+        # identical paths for both traversal orders
+        random.seed(11)
+        settings.init()
+        start = time.perf_counter()
+        for _ in range(paths):
+            cam.ray_color(cam.rand_pixel_ray(random.randrange(cam.image_width), random.randrange(cam.image_height)),
+                          cam.max_depth, world)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>10} paths:   {settings.stats.count / settings.stats.rays:.1f} nodes/ray, {elapsed / settings.stats.rays * 1e6:.1f} us/ray")
+
+    BVH_Node.ordered = True
+
+
+def bench_irradiance_cache(width: int = 128, spp: int = 32) -> None:
+    """
+    Compares rays traced and render time of the final render scene with and without the irradiance cache.
+    """
+
+    for cache in (None, IrradianceCache(accuracy=0.5, samples=32)):
+        random.seed(7)
+        world = random_spheres()
+        cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, samples_per_pixel=spp, max_depth=10, vfov=20,
+                     lookfrom=Point(13, 2, 3), lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0,
+                     irradiance_cache=cache)
+        settings.init()
+        start = time.perf_counter()
+        for _ in cam.render_rows(world, range(cam.image_height)):
+            pass
+        elapsed = time.perf_counter() - start
+        label = "cache" if cache else "no cache"
+        print(f"{label:>8}: {elapsed:.1f}s, {settings.stats.rays / (cam.image_width * cam.image_height):.0f} rays/pixel"
+              + (f", {cache.stats()}" if cache else ""))
+
+
+def count_inits(cls: type) -> list[int]:
+    """Wraps `cls.__init__` to count constructions; returns the one-element counter list."""
+
+    counter = [0]
+    init = cls.__init__
+
+    def counting_init(self, *args, **kwargs):
+        counter[0] += 1
+        init(self, *args, **kwargs)
+
+    cls.__init__ = counting_init
+    counter.append(init)
+    return counter
+
+
+def bench_hit_record(rays: int = 20000) -> None:
+    """
+    Measures closest-hit query time for primary and first-bounce rays into the final render scene, and the
+    number of `HitRecord` and `Vector` objects constructed per query.
+    """
+
+    random.seed(7)
+    world = random_spheres()
+    world.build()
+    sample = primary_rays(rays)
+    # add one diffuse bounce ray per primary hit, as most queries in a render are secondary rays
+    for r in list(sample):
+        rec = world.hit(r, 0.001, math.inf)
+        if rec is not None:
+            sample.append(Ray(rec.p, rec.normal + Vector.random(-1, 1)))
+
+    start = time.perf_counter()
+    for r in sample:
+        world.hit(r, 0.001, math.inf)
+    elapsed = time.perf_counter() - start
+
+    records, vectors = count_inits(HitRecord), count_inits(Vector)
+    try:
+        for r in sample:
+            world.hit(r, 0.001, math.inf)
+    finally:
+        HitRecord.__init__, Vector.__init__ = records[1], vectors[1]
+
+    print(f"{len(sample)} queries: {elapsed / len(sample) * 1e6:.1f} us/query, "
+          f"{records[0] / len(sample):.2f} HitRecords/query, {vectors[0] / len(sample):.2f} Vectors/query")
+
+
+def bench_compiled_scene(n: int = 30, rays: int = 20000) -> None:
+    """
+    Compares shipping a scene of about (2n)^2 spheres to a render process as a pickled object graph with
+    attaching to its compiled scene file: the BVH build, the cost per process of receiving the scene, and
+    traversal speed.
+    """
+
+    random.seed(7)
+    world = random_spheres(n)
+    start = time.perf_counter()
+    world.build()
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scene.pyrt")
+        start = time.perf_counter()
+        compile_scene(world, path)
+        compile_seconds = time.perf_counter() - start
+        # an unchanged scene only has its primitives hashed before attaching
+        start = time.perf_counter()
+        compiled = load_or_compile(world, path)
+        cached_seconds = time.perf_counter() - start
+
+        data = pickle.dumps(world)
+        start = time.perf_counter()
+        pickle.loads(data)
+        unpickle_seconds = time.perf_counter() - start
+        handle = pickle.dumps(compiled)
+        start = time.perf_counter()
+        pickle.loads(handle)
+        attach_seconds = time.perf_counter() - start
+
+        sample = primary_rays(rays)
+        timings = []
+        for scene in (world, compiled):
+            start = time.perf_counter()
+            for r in sample:
+                scene.intersect(r, 0.001, math.inf)
+            timings.append((time.perf_counter() - start) / len(sample))
+        file_size = os.path.getsize(path)
+
+    print(f"{len(world)} spheres: BVH build {build_seconds * 1e3:.1f} ms, compile {compile_seconds * 1e3:.1f} ms, "
+          f"cache hit {cached_seconds * 1e3:.1f} ms, file {file_size} bytes")
+    print(f"per process: pickled graph {len(data)} bytes, {unpickle_seconds * 1e3:.1f} ms to load; "
+          f"compiled {len(handle)} bytes, {attach_seconds * 1e3:.2f} ms to attach")
+    print(f"traversal: object graph {timings[0] * 1e6:.1f} us/ray, compiled {timings[1] * 1e6:.1f} us/ray")
+
+
+def clustered_spheres(clusters: int = 8, per_cluster: int = 60) -> HittableList:
+    """A ground sphere with `clusters` tight clumps of small spheres scattered over the final render's field."""
+
+    world = HittableList()
+    world.add(Sphere(Point(0, -1000, 0), 1000, Lambertian(RGB(0.5, 0.5, 0.5))))
+    for _ in range(clusters):
+        cx, cz = random.uniform(-11, 11), random.uniform(-11, 11)
+        world.extend(Sphere(Point(cx + random.gauss(0, 0.3), 0.3 + abs(random.gauss(0, 0.3)), cz + random.gauss(0, 0.3)),
+                            0.05, Lambertian(RGB.random())) for _ in range(per_cluster))
+    return world
+
+
+def bench_accelerators(rays: int = 5000, paths: int = 500) -> None:
+    """
+    Compares the BVH, uniform grid and two-level grid on the evenly spread final render scene and on a
+    clustered scene: build time, cost per primary ray and per ray of full paths.
+    """
+
+    cam = Camera(aspect_ratio=16.0 / 9.0, image_width=160, max_depth=50, vfov=20, lookfrom=Point(13, 2, 3),
+                 lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+    sample = primary_rays(rays)
+    for scene, build in (("uniform", random_spheres), ("clustered", clustered_spheres)):
+        for accelerator in HittableList.ACCELERATORS:
+            random.seed(7)
+            world = build()
+            world.accelerator = accelerator
+            start = time.perf_counter()
+            world.build()
+            build_seconds = time.perf_counter() - start
+
+            settings.init()
+            start = time.perf_counter()
+            for r in sample:
+                world.hit(r, 0.001, math.inf)
+            primary_seconds = time.perf_counter() - start
+            visits = settings.stats.count / len(sample)
+
+            random.seed(11)
+            settings.init()
+            start = time.perf_counter()
+            for _ in range(paths):
+                cam.ray_color(cam.rand_pixel_ray(random.randrange(cam.image_width), random.randrange(cam.image_height)),
+                              cam.max_depth, world)
+            path_seconds = time.perf_counter() - start
+            print(f"{scene:>9} {accelerator:>5}: build {build_seconds * 1e3:6.1f} ms, primary "
+                  f"{primary_seconds / len(sample) * 1e6:5.1f} us/ray ({visits:.1f} nodes or cells/ray), "
+                  f"paths {path_seconds / settings.stats.rays * 1e6:5.1f} us/ray")
+
+
+def bench_lbvh(sizes: tuple[int, ...] = (11, 40, 80), rays: int = 5000) -> None:
+    """
+    Compares build time and primary ray traversal cost of the median split `BVH_Tree` and the Morton code
+    `LBVH` (30-bit codes) on final render scenes of about (2n)^2 spheres.
+    """
+
+    sample = primary_rays(rays)
+    for n in sizes:
+        random.seed(7)
+        world = random_spheres(n, density=n / 11)
+        for name, builder in (("bvh", BVH_Tree), ("lbvh", LBVH)):
+            random.seed(7)
+            start = time.perf_counter()
+            tree = builder(world)
+            build_seconds = time.perf_counter() - start
+
+            settings.init()
+            start = time.perf_counter()
+            for r in sample:
+                tree.intersect(r, 0.001, math.inf)
+            elapsed = time.perf_counter() - start
+            print(f"{len(world):>6} spheres {name:>4}: build {build_seconds * 1e3:7.1f} ms, "
+                  f"{settings.stats.count / len(sample):5.1f} nodes/ray, {elapsed / len(sample) * 1e6:5.1f} us/ray")
+
+
+def bench_texture_cache(size: int = 1024, paths: int = 1500) -> None:
+    """
+    Renders paths into the final render scene with every sphere textured by one `size` x `size` / 2 image,
+    under tile cache budgets from a few tiles to the whole texture, and reports hit rates and path cost.
+    """
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "checker.ppm")
+        with open(src, "wb") as f:
+            f.write(f"P6\n{size} {size // 2}\n255\n".encode())
+            f.write(bytes(230 if ((i // 16) + (j // 16)) % 2 else 40 for j in range(size // 2) for i in range(size)
+                          for _ in range(3)))
+        convert_texture(src, src + ".tex")
+        image = TiledTexture(src + ".tex")
+
+        random.seed(7)
+        world = random_spheres()
+        for obj in world.objects:
+            if hasattr(obj.mat, "albedo"):
+                obj.mat.texture = ImageTexture(image, obj.mat.albedo)
+        world.build()
+        cam = Camera(aspect_ratio=16.0 / 9.0, image_width=160, max_depth=50, vfov=20, lookfrom=Point(13, 2, 3),
+                     lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+
+        for budget in (1 << 15, 1 << 17, 1 << 24):
+            texture.tile_cache = texture.TileCache(budget)
+            random.seed(11)
+            start = time.perf_counter()
+            for _ in range(paths):
+                cam.ray_color(cam.rand_pixel_ray(random.randrange(cam.image_width), random.randrange(cam.image_height)),
+                              cam.max_depth, world)
+            elapsed = time.perf_counter() - start
+            print(f"{budget / (1 << 20):6.2f} MB: {elapsed / paths * 1e6:6.0f} us/path; {texture.tile_cache.stats()}")
+        texture.tile_cache = texture.TileCache()
+
+
+def bench_packets(width: int = 160, repeats: int = 3) -> None:
+    """
+    Measures primary ray throughput (closest hits only) of the final render scene traced one ray at a time
+    and as packets of 4x4 and 8x8 pixel blocks, with a pinhole and with a defocused camera.
+    """
+
+    random.seed(7)
+    world = random_spheres()
+    world.build()
+    for defocus in (0.0, 0.6):
+        cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, vfov=20, lookfrom=Point(13, 2, 3),
+                     lookat=Point(0, 0, 0), defocus_angle=defocus, focus_dist=10.0)
+        for n in (1, 4, 8):
+            blocks = []
+            for j0 in range(0, cam.image_height, n):
+                for i0 in range(0, cam.image_width, n):
+                    rays = []
+                    for j in range(j0, min(j0 + n, cam.image_height)):
+                        for i in range(i0, min(i0 + n, cam.image_width)):
+                            use_stream(sample_stream(0, j * cam.image_width + i, 0))
+                            rays.append(cam.rand_pixel_ray(i, j))
+                    blocks.append(rays)
+            use_stream(None)
+            count = sum(len(rays) for rays in blocks)
+            root = packet_root(world) if n > 1 else None
+            coherent = sum(RayPacket(rays).coherent for rays in blocks) if n > 1 else 0
+
+            best = math.inf
+            for _ in range(repeats):
+                settings.init()
+                start = time.perf_counter()
+                for rays in blocks:
+                    cam.trace_primary(rays, root, world)
+                best = min(best, time.perf_counter() - start)
+            label = "single rays" if n == 1 else f"{n}x{n} packets ({coherent / len(blocks):.0%} coherent)"
+            print(f"defocus {defocus:.1f} {label:>29}: {count / best / 1e3:6.1f} k rays/s, "
+                  f"{settings.stats.count / count:5.2f} node tests/ray")
+
+
+def bench_incremental(width: int = 240, spp: int = 1, tile_size: int = 16) -> None:
+    """
+    Renders the final render scene with tile footprints, then makes small edits to it (recoloring and
+    moving two of the most visible small spheres, giving the ground another material) and compares the
+    time to update the image against rendering it again.
+    """
+
+    random.seed(7)
+    world = random_spheres()
+    cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, samples_per_pixel=spp, max_depth=50, vfov=20,
+                 lookfrom=Point(13, 2, 3), lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+    world.build()
+
+    start = time.perf_counter()
+    for j in range(cam.image_height):
+        cam.render_row(j, world)
+    plain_seconds = time.perf_counter() - start
+
+    tree, large = footprint_tree(world.objects)
+    footprints = Footprints(cam.image_width, cam.image_height, tile_size, b"", tree, world.objects, large)
+    accum = Accumulator(cam.image_width, cam.image_height, spp)
+    start = time.perf_counter()
+    render_tiles(cam, FootprintRecorder(tree, world.objects, large), footprints, list(range(len(footprints.tiles))),
+                 accum)
+    full_seconds = time.perf_counter() - start
+    sys.stderr.write("\n")
+    print(f"full render {plain_seconds:.2f}s, with footprints {full_seconds:.2f}s "
+          f"({full_seconds / plain_seconds - 1:+.0%}); {len(footprints.tiles)} tiles")
+
+    # the two small spheres hit by the most tiles
+    small = [k for k, obj in enumerate(world.objects) if obj.radius < 1]
+    first, second = sorted(small, key=lambda k: -sum(hits >> k & 1 for _, hits in footprints.tiles))[:2]
+
+    def recolor(objects):
+        objects[first].mat = Lambertian(RGB(0.9, 0.1, 0.1))
+
+    def move(objects):
+        obj = objects[second]
+        objects[second] = Sphere(obj.center + Vector(0.3, 0, 0), obj.radius, obj.mat)
+
+    def ground(objects):
+        objects[0].mat = Lambertian(RGB(0.3, 0.5, 0.3))
+
+    for name, edit in (("recolor sphere", recolor), ("move sphere", move), ("ground material", ground)):
+        edit(world.objects)
+        tiles, _ = footprints.affected_tiles(world.objects)
+        start = time.perf_counter()
+        tree = footprints.refit(world.objects)
+        render_tiles(cam, FootprintRecorder(tree, world.objects, large), footprints, tiles, accum)
+        seconds = time.perf_counter() - start
+        sys.stderr.write("\n")
+        print(f"{name:>16}: {len(tiles):4} of {len(footprints.tiles)} tiles, {seconds:6.2f}s, "
+              f"{plain_seconds / max(seconds, 1e-9):5.1f}x faster than a plain full render")
+
+
+def bench_lazy_bvh(n: int = 100, width: int = 48) -> None:
+    """
+    Compares build plus render time of the eager `BVH_Tree` and the on-demand `LazyBVH` on a final render
+    scene of about (2n)^2 spheres, seen whole, through a 3 degree field of view, and through a small crop
+    window, one sample per pixel.
+    """
+
+    random.seed(7)
+    world = random_spheres(n, density=n / 11)
+    views = (("whole view", 20, None), ("vfov 3", 3, None), ("crop 1/16", 20, (0, 0, width // 4, width // 4)))
+    for name, vfov, crop in views:
+        cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, samples_per_pixel=1, max_depth=50, vfov=vfov,
+                     lookfrom=Point(13, 2, 3), lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+        x0, y0, x1, y1 = crop or (0, 0, cam.image_width, cam.image_height)
+        for builder in (BVH_Tree, LazyBVH):
+            random.seed(7)
+            start = time.perf_counter()
+            tree = builder(world)
+            build_seconds = time.perf_counter() - start
+            for j in range(y0, y1):
+                cam.render_row(j, tree, range(x0, x1))
+            total_seconds = time.perf_counter() - start
+            built = len(tree.interior_nodes()) if builder is BVH_Tree else tree.built_nodes()[0]
+            print(f"{len(world)} spheres, {name:>10}, {builder.__name__:>8}: build {build_seconds * 1e3:6.1f} ms, "
+                  f"build + render {total_seconds:5.2f}s, {built} nodes split")
+
+
+def bench_guiding(width: int = 48, spp: int = 16, training_passes: int = 4) -> None:
+    """
+    Compares the noise of the light-in-a-box scene rendered with and without path guiding, at equal samples
+    per pixel and per unit time. The variance of the image is estimated from two renders with different
+    seeds (half the mean squared difference of their pixels); the time of a guided render includes its
+    training passes.
+    """
+
+    def render(seed: int, guiding: bool) -> tuple[list[float], float]:
+        cam = Camera(**camera_kwargs(dict(LIGHT_BOX_CAMERA, image_width=width, samples_per_pixel=spp)), seed=seed,
+                     guiding=GuidingField() if guiding else None)
+        world = light_box()
+        start = time.perf_counter()
+        if guiding:
+            cam.train_guiding(world, training_passes)
+        values = []
+        for j in range(cam.image_height):
+            for color in cam.render_row(j, world):
+                values.extend((color.x / spp, color.y / spp, color.z / spp))
+        return values, time.perf_counter() - start
+
+    baseline = None
+    for guiding in (False, True):
+        (a, seconds_a), (b, seconds_b) = render(1, guiding), render(2, guiding)
+        variance = sum((x - y) ** 2 for x, y in zip(a, b)) / (2 * len(a))
+        seconds = (seconds_a + seconds_b) / 2
+        efficiency = 1.0 / (variance * seconds)
+        baseline = baseline or efficiency
+        mean = sum(a + b) / (2 * len(a))
+        print(f"{'guided' if guiding else 'unguided':>9}: mean {mean:6.3f}, variance {variance:8.4f}, "
+              f"{seconds:6.2f}s per render, efficiency (1 / variance x time) {efficiency / baseline:5.2f}x")
+
+
+def bench_threads(width: int = 96, spp: int = 2, workers: tuple[int, ...] = (2, 4)) -> None:
+    """
+    Compares the render time of the final render scene with the process and thread backends at several
+    worker counts against a serial render, and checks that every render matches the serial one. Threads only
+    run in parallel on free-threaded CPython builds, so the interpreter and whether its GIL is enabled are
+    printed first.
+    """
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, {os.cpu_count()} CPUs")
+    random.seed(7)
+    world = random_spheres()
+    cam = Camera(aspect_ratio=16.0 / 9.0, image_width=width, samples_per_pixel=spp, max_depth=50, vfov=20,
+                 lookfrom=Point(13, 2, 3), lookat=Point(0, 0, 0), defocus_angle=0.6, focus_dist=10.0)
+    rows = range(cam.image_height)
+
+    def values(image: list[list[RGB]]) -> list[tuple[float, float, float]]:
+        return [(c.x, c.y, c.z) for row in image for c in row]
+
+    start = time.perf_counter()
+    reference = values(cam.render_rows(world, rows))
+    serial_seconds = time.perf_counter() - start
+    print(f"{'serial':>8}: {serial_seconds:6.2f}s")
+    try:
+        for backend in Camera.BACKENDS:
+            Camera.backend = backend
+            for n in workers:
+                start = time.perf_counter()
+                image = values(cam.render_rows(world, rows, workers=n))
+                seconds = time.perf_counter() - start
+                print(f"{backend:>8}: {n} workers {seconds:6.2f}s, {serial_seconds / seconds:4.2f}x serial"
+                      f"{'' if image == reference else ', IMAGE DIFFERS'}")
+    finally:
+        Camera.backend = None
+
+
+BENCHMARKS = {
+    "node_visit": bench_node_visit,
+    "traversal_order": bench_traversal_order,
+    "irradiance_cache": bench_irradiance_cache,
+    "hit_record": bench_hit_record,
+    "compiled_scene": bench_compiled_scene,
+    "accelerators": bench_accelerators,
+    "lbvh": bench_lbvh,
+    "texture_cache": bench_texture_cache,
+    "packets": bench_packets,
+    "incremental": bench_incremental,
+    "lazy_bvh": bench_lazy_bvh,
+    "guiding": bench_guiding,
+    "threads": bench_threads,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs microbenchmarks of the ray tracer.")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, any of {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    settings.init()
+    # comparisons are between the defaults and the variants each benchmark sets, never the host's profile
+    tuning.use_defaults()
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
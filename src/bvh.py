@@ -1,5 +1,7 @@
+import math
 import random, sys
 import settings
+import tuning
 from utils import Interval, Ray
 from hittable_list import HitRecord, Hittable, HittableList, AABB
 
@@ -7,8 +9,16 @@ from hittable_list import HitRecord, Hittable, HittableList, AABB
 class BVH_Node(Hittable):
     """
     Represents a node in a BVH tree.
+
+    Children are traversed front to back: `left` holds the objects with the smaller bounds along the split
+    `axis`, so a ray travelling in the negative direction of that axis visits `right` first. The farther
+    child is then only searched up to the closest hit found in the nearer one, which prunes it entirely
+    when its entry distance lies beyond that hit.
     """
 
+    # set to False to always descend `left` first (for comparing traversal cost)
+    ordered: bool = True
+
     def __init__(self, depth: int = 0) -> None:
         """Constructs a BVH node from a `HittableList`."""
 
@@ -17,6 +27,7 @@ class BVH_Node(Hittable):
         self.left: 'Hittable' = None
         self.right: 'Hittable' = None
         self.depth: int = depth
+        self.axis: int = 0  # axis along which the children were split
     
     def __str__(self) -> str:
         return f"bbox: \n{self.bbox}\n\nleft: \n{type(self.left)}\n\nright: \n{type(self.right)}\n"
@@ -25,45 +36,93 @@ class BVH_Node(Hittable):
     def bounding_box(self):
         return self.bbox
 
-    def hit(self, _r: Ray, ray_t: Interval) -> HitRecord | None:
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
         """
-        Returns whether the BVH node is hit by the incident ray (should not update the hit_record for AABB intersections).
+        Returns the distance to and primitive of the closest intersection of the ray within this node's subtree.
         """
-        settings.count += 1
+        settings.stats.count += 1
         # sys.stderr.write(f"BVH_Node depth: {self.depth}\n")
         # does the ray intersect the AABB of this BVH_Node?
-        if not self.bbox.hit(_r, ray_t):
+        if not self.bbox.hit(_r, t_min, t_max):
             # AABB.hit() returns False
             # sys.stderr.write(f"BVH search terminated at depth: {self.depth}\n")
-            settings.max_depth = max(settings.max_depth, self.depth)
+            settings.stats.max_depth = max(settings.stats.max_depth, self.depth)
             return None
 
         # recursively searches the binary tree for possible hit, with the smallest AABB being an individual object
-        rec_left: HitRecord | None = self.left.hit(_r, ray_t)
-        # if rec_left is not None:
-        #     sys.stderr.write(f"rec_left hit sphere at point {rec_left.p} at t = {rec_left.t}\n")
-        #     sys.stderr.write(f"rec_right will search along interval ({ray_t.lower_b}, {rec_left.t}\n")
-        # else:
-        #     sys.stderr.write(f"rec_left is None")
-        rec_right: HitRecord | None = self.right.hit(_r, Interval(ray_t.lower_b, rec_left.t if rec_left is not None else ray_t.upper_b))
-
-        # return rec_left or rec_right if the other is None
-        if rec_left is not None and rec_right is None:
-            return rec_left
-        elif rec_right is not None:
-            return rec_right
-        # if nothing is hit, return None
+        if self.ordered and _r.sign[self.axis]:
+            near, far = self.right, self.left
         else:
+            near, far = self.left, self.right
+
+        hit_near = near.intersect(_r, t_min, t_max)
+        # leaves holding a single object reference it from both sides
+        if far is near:
+            return hit_near
+        # the far child is only searched in front of the closest hit so far
+        hit_far = far.intersect(_r, t_min, hit_near[0] if hit_near is not None else t_max)
+
+        # a hit in the far child is necessarily closer than any hit in the near child
+        return hit_far if hit_far is not None else hit_near
+
+
+class BVH_Leaf(Hittable):
+    """
+    A leaf of a `BVH_Tree` built with `leaf_size` > 2: a few objects tested one after another once the ray
+    enters their common box, instead of a subtree of single-object nodes.
+    """
+
+    def __init__(self, objects: list[Hittable], depth: int = 0) -> None:
+        self.objects = objects
+        self.depth: int = depth
+        self.bbox: AABB = objects[0].bounding_box
+        for obj in objects[1:]:
+            self.bbox = AABB.merge(self.bbox, obj.bounding_box)
+
+    @property
+    def bounding_box(self):
+        return self.bbox
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        settings.stats.count += 1
+        # traversals always end at a leaf
+        settings.stats.max_depth = max(settings.stats.max_depth, self.depth)
+        if not self.bbox.hit(_r, t_min, t_max):
             return None
+        closest = None
+        for obj in self.objects:
+            found = obj.intersect(_r, t_min, t_max)
+            if found is not None:
+                t_max = found[0]
+                closest = found
+        return closest
 
 
 class BVH_Tree(Hittable):
+    """
+    Bounding volume hierarchy over the objects of a `HittableList`.
+
+    Each node splits its objects in two along one axis, chosen by `split`: "random" (a random axis, split at
+    the median), "longest" (the axis along which the objects spread the most, split at the median) or "sah"
+    (the axis and position of least surface area heuristic cost). Nodes over at most `leaf_size` objects
+    become a `BVH_Leaf` when `leaf_size` > 2; with the default of 2, every leaf is a node over one or two
+    objects. Both default to the tuning profile (see `tuning.py`) unless set on the class or passed in.
+    """
 
-    def __init__(self, hit_list: HittableList) -> None:
+    # split strategy and largest leaf; `None` takes them from the tuning profile
+    split: str | None = None
+    leaf_size: int | None = None
+    SPLITS: tuple[str, ...] = ("random", "longest", "sah")
+
+    def __init__(self, hit_list: HittableList, split: str = None, leaf_size: int = None) -> None:
         """
         Constructs the BVH tree from a `HittableList` by calling the recursive constructor.
         """
 
+        self.split: str = split or BVH_Tree.split or tuning.setting("split")
+        self.leaf_size: int = leaf_size or BVH_Tree.leaf_size or tuning.setting("leaf_size")
+        if self.split not in self.SPLITS:
+            raise ValueError(f"Unknown BVH split strategy: {self.split}")
         self.root: BVH_Node = BVH_Node(depth=1)  # even if `len(hit_list)` = 1, root will be a `BVH_Node`
         self.construct_bvh_tree(self.root, hit_list.objects[:], 0, len(hit_list.objects))
 
@@ -84,41 +143,87 @@ class BVH_Tree(Hittable):
                 queue.append(node.right)
         
 
-    def hit(self, _r: Ray, ray_t: Interval) -> HitRecord | None:
+    def interior_nodes(self) -> list[BVH_Node]:
+        """Returns the `BVH_Node`s of the tree in breadth-first order, the root first."""
+
+        nodes: list[BVH_Node] = [self.root]
+        seen = {id(self.root)}
+        k = 0
+        while k < len(nodes):
+            for child in (nodes[k].left, nodes[k].right):
+                if isinstance(child, BVH_Node) and id(child) not in seen:
+                    seen.add(id(child))
+                    nodes.append(child)
+            k += 1
+        return nodes
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
         """
-        Returns the hit record of the BVH tree by returning `root.hit()`.
+        Returns the closest intersection in the BVH tree by returning `root.intersect()`.
         If nothing is hit, returns `None`.
         """
-        rec: HitRecord = self.root.hit(_r, ray_t)
-        return rec
+        return self.root.intersect(_r, t_min, t_max)
 
     def box_compare(self, _a: Hittable, _b: Hittable, axis: int) -> bool:
-        match axis:
-            case 0:
-                return _a.bounding_box.slab_x.lower_b < _b.bounding_box.slab_x.lower_b
-            case 1:
-                return _a.bounding_box.slab_y.lower_b < _b.bounding_box.slab_y.lower_b
-            case 2:
-                return _a.bounding_box.slab_z.lower_b < _b.bounding_box.slab_z.lower_b
+        return _a.bounding_box.lower(axis) < _b.bounding_box.lower(axis)
 
     def x_axis_key(self, h: Hittable) -> float:
-        return h.bounding_box.slab_x.lower_b
+        return h.bounding_box.bounds[0]
 
     def y_axis_key(self, h: Hittable) -> float:
-        return h.bounding_box.slab_y.lower_b
+        return h.bounding_box.bounds[2]
 
     def z_axis_key(self, h: Hittable) -> float:
-        return h.bounding_box.slab_z.lower_b
+        return h.bounding_box.bounds[4]
 
-    def construct_bvh_tree(self, curr_node: BVH_Node, objects: list[Hittable], start: int, end: int) -> None:
+    def choose_axis(self, objects: list[Hittable], start: int, end: int) -> int:
+        """Returns the axis along which to split `objects[start:end]`, for the "random" and "longest" strategies."""
+
+        if self.split == "random":
+            return random.randint(0, 2)
+        boxes = [obj.bounding_box.bounds for obj in objects[start:end]]
+        spreads = [max(b[2 * k] for b in boxes) - min(b[2 * k] for b in boxes) for k in range(3)]
+        return spreads.index(max(spreads))
+
+    def sah_split(self, objects: list[Hittable], start: int, end: int) -> tuple[int, int]:
+        """
+        Returns the axis and index of the split of `objects[start:end]` with the least surface area heuristic
+        cost (the sum over both sides of their number of objects times the area of their box), sorting the
+        objects along that axis.
+        """
+
+        best = (math.inf, 0, start + (end - start) // 2)
+        span = end - start
+        for axis in range(3):
+            key = (self.x_axis_key, self.y_axis_key, self.z_axis_key)[axis]
+            ordered = sorted(objects[start:end], key=key)
+            boxes = [obj.bounding_box.bounds for obj in ordered]
+            # areas of the boxes of the first k objects, then of the last span - k
+            prefix = _prefix_areas(boxes)
+            suffix = _prefix_areas(boxes[::-1])
+            for k in range(1, span):
+                cost = k * prefix[k - 1] + (span - k) * suffix[span - k - 1]
+                if cost < best[0]:
+                    best = (cost, axis, start + k)
+        _, axis, mid = best
+        key = (self.x_axis_key, self.y_axis_key, self.z_axis_key)[axis]
+        objects[start:end] = sorted(objects[start:end], key=key)
+        return axis, mid
 
-        # randomly choose axis (either x, y, or z)
-        axis = random.randint(0, 2)
-        axis_key = self.x_axis_key if axis == 0 else self.x_axis_key if axis == 1 else self.z_axis_key
+    def construct_bvh_tree(self, curr_node: BVH_Node, objects: list[Hittable], start: int, end: int) -> None:
 
         # length of subarray
         object_span: int = end - start
 
+        # choose the split axis (randomly with the "random" strategy)
+        if self.split == "sah" and object_span > 2:
+            axis, mid = self.sah_split(objects, start, end)
+        else:
+            axis = self.choose_axis(objects, start, end)
+            mid = start + (object_span // 2)
+        axis_key = self.x_axis_key if axis == 0 else self.y_axis_key if axis == 1 else self.z_axis_key
+        curr_node.axis = axis
+
         # sort subarray using randomly chosen axis
         if object_span == 1:  # base case 1
             # left and right are assigned to `Hittable`s
@@ -133,15 +238,35 @@ class BVH_Tree(Hittable):
                 curr_node.left = objects[start + 1]
                 curr_node.right = objects[start]
         else:
-            objects[start:end] = sorted(objects[start:end], key=axis_key)
-
-            mid: int = start + (object_span // 2)
+            if self.split != "sah":
+                objects[start:end] = sorted(objects[start:end], key=axis_key)
 
             # this creates the BVH_Nodes, the only actual data field is the bbox (AABB) 
             # which is formed after the last recursive call
-            curr_node.left = BVH_Node(depth=curr_node.depth+1)
-            curr_node.right = BVH_Node(depth=curr_node.depth+1)
-            self.construct_bvh_tree(curr_node.left, objects, start, mid)
-            self.construct_bvh_tree(curr_node.right, objects, mid, end)
+            curr_node.left = self.child(curr_node, objects, start, mid)
+            curr_node.right = self.child(curr_node, objects, mid, end)
 
         curr_node.bbox = AABB.merge(curr_node.left.bounding_box, curr_node.right.bounding_box)
+
+    def child(self, parent: BVH_Node, objects: list[Hittable], start: int, end: int) -> Hittable:
+        """Returns the subtree over `objects[start:end]`: a `BVH_Leaf` if they fit in one, else a `BVH_Node`."""
+
+        if self.leaf_size > 2 and end - start <= self.leaf_size:
+            return BVH_Leaf(objects[start:end], parent.depth + 1)
+        node = BVH_Node(depth=parent.depth + 1)
+        self.construct_bvh_tree(node, objects, start, end)
+        return node
+
+
+def _prefix_areas(boxes: list[tuple[float, ...]]) -> list[float]:
+    """Returns the surface areas of the boxes enclosing the first 1, 2, ... of `boxes`."""
+
+    areas = []
+    x0, x1, y0, y1, z0, z1 = boxes[0]
+    for b in boxes:
+        x0, x1 = min(x0, b[0]), max(x1, b[1])
+        y0, y1 = min(y0, b[2]), max(y1, b[3])
+        z0, z1 = min(z0, b[4]), max(z1, b[5])
+        dx, dy, dz = x1 - x0, y1 - y0, z1 - z0
+        areas.append(2.0 * (dx * dy + dy * dz + dz * dx))
+    return areas
@@ -1,23 +1,76 @@
+import os
 import sys
+import copy
 import math
 import time
+import threading
+import multiprocessing
+import multiprocessing.pool
 from typing import Union
 
-from utils import Vector, Point, RGB, normalize, cross, write_color, rand_on_hemisphere, rand_unit_vec, rand_in_unit_disk
-from utils import Ray, Interval, rand_float, deg_to_rad
+import settings
+import tuning
+
+from utils import Vector, Point, RGB, dot, normalize, cross, reflect, write_color, rand_on_hemisphere, rand_unit_vec, rand_in_unit_disk
+from utils import Ray, Interval, rand_float, deg_to_rad, sample_stream, use_stream
 from hittable_list import HittableList
 from hittable import Hittable, HitRecord
 from material import Lambertian, Metal
+from image import Accumulator, encode_row
+from irradiance_cache import IrradianceCache
+from environment import EnvironmentMap
+from telemetry import Telemetry, current_rss_bytes
+from bvh import BVH_Tree
+from packet import RayPacket, intersect_packet
+from guiding import GuidingField, fuzz_pdf
+
+def packet_root(_world: Hittable) -> Hittable | None:
+    """Returns the root of the world's BVH, which packets are traced through, or `None` if it has none."""
+
+    if not isinstance(_world, HittableList):
+        return None
+    accel = _world.accel if _world.accel is not None else _world.build()
+    return accel.root if isinstance(accel, BVH_Tree) else None
+
 
 class Camera:
     """
     Represents the camera which constructs the 2D image using the 3D scene. The camera is 
     responsible for shooting rays into the scene, detecting ray-object intersections and then 
     coloring pixels appropriately.
+
+    Every sample draws its random numbers from its own counter-based stream keyed by (`seed`, pixel, sample
+    index), so a pixel's color does not depend on which process traces it or in what order. Any rectangle of
+    the image can therefore be re-rendered alone and match the full render bit for bit.
+
+    With `backend` set to "thread", renders with `workers` > 1 use threads that share the camera and the scene
+    instead of processes that each receive a copy. Nothing the threads trace through mutates shared state:
+    random number streams and traversal statistics are per thread, the texture tile cache is locked, and
+    unsplit nodes of a `LazyBVH` are split under a lock. On free-threaded CPython builds the threads run in
+    parallel; with the GIL they take turns.
+
+    With `packet_size` set to n > 1, `render_rows` renders blocks of n x n pixels whose camera rays are traced
+    through the BVH together as packets (see `packet.py`); bounces are traced one ray at a time as usual.
+
+    `packet_size`, `rows_per_task` and `backend` left at `None` are taken from the tuning profile of the host
+    (see `tuning.py`), or their defaults if it sets none.
     """
 
+    # side of the pixel blocks traced as ray packets by `render_rows`; 0 or 1 traces every ray alone
+    packet_size: int | None = None
+    # scanlines handed to a pool worker at a time by `render_rows` and `render_timed`
+    rows_per_task: int | None = None
+    # what renders in parallel with `workers` > 1: "process" (a process pool, each worker with its own copy of
+    # the camera and scene) or "thread" (a thread pool sharing them)
+    backend: str | None = None
+    BACKENDS = ("process", "thread")
+    # parameters read from the tuning profile when left unset
+    TUNED = ("packet_size", "rows_per_task", "backend")
+
     def __init__(self, aspect_ratio: float = 1.0, image_width: int = 100, samples_per_pixel: int = 10, max_depth: int = 10, 
-                 vfov: float = 90, lookfrom: Point = Point(0,0,-1), lookat: Point = Point(0,0,0), vup: Vector = Vector(0,1,0), defocus_angle: float = 0.0, focus_dist: float = 10.0) -> None:
+                 vfov: float = 90, lookfrom: Point = Point(0,0,-1), lookat: Point = Point(0,0,0), vup: Vector = Vector(0,1,0), defocus_angle: float = 0.0, focus_dist: float = 10.0,
+                 seed: int = 0, irradiance_cache: IrradianceCache = None, environment: EnvironmentMap = None,
+                 guiding: GuidingField = None) -> None:
 
         self.aspect_ratio: float = aspect_ratio # ratio of image width / height
         self.image_width: int = image_width # rendered image width (pixel count)
@@ -31,6 +84,10 @@ class Camera:
 
         self.defocus_angle: float = defocus_angle # variation angle of rays through each pixel
         self.focus_dist: float = focus_dist # distance from camera `lookfrom` point to plane of perfect focus
+        self.seed: int = seed # key of the per-sample random number streams
+        self.irradiance_cache: IrradianceCache | None = irradiance_cache # caches diffuse indirect light if set
+        self.environment: EnvironmentMap | None = environment # lights the scene instead of the sky gradient if set
+        self.guiding: GuidingField | None = guiding # guides diffuse and glossy scattering if set
 
         # calculate image height (>= 1) (non-imaginary)
         self.image_height: int = max(int(self.image_width / self.aspect_ratio), 1)
@@ -58,6 +115,9 @@ class Camera:
         self.pixel_delta_u: Vector = viewport_u / self.image_width
         self.pixel_delta_v: Vector = viewport_v / self.image_height
 
+        # angle subtended by a pixel, for estimating the size of a pixel's footprint at some distance
+        self.pixel_angle: float = viewport_height / self.focus_dist / self.image_height
+
         # calculate location of upper left pixel
         viewport_upper_left: Point = self.center - (self.focus_dist * self.w) - viewport_u/2 - viewport_v/2
         # not entirely sure why this next step is necessary, maybe to make sure the 00 pixel is within the vp?
@@ -68,40 +128,318 @@ class Camera:
         self.defocus_disk_u: Vector = self.u * defocus_radius # defocus disk horizontal radius
         self.defocus_disk_v: Vector = self.v * defocus_radius # defocus disk vertical radius
 
-    def render(self, _world: HittableList) -> None:
+    def tuned(self, name: str):
+        """Returns the camera's `packet_size`, `rows_per_task` or `backend`, from the tuning profile if unset."""
+
+        value = getattr(self, name)
+        return value if value is not None else tuning.setting(name)
+
+    def pool(self, _world: Hittable, workers: int) -> multiprocessing.pool.Pool:
         """
-        Dispatches rays into world and uses ray-intersection information to construct rendered image
+        Returns a pool of `workers` processes or threads (by `backend`) initialized to render `_world` with
+        this camera through the module's `_render_*` functions. The world's acceleration structure is built
+        first, once for all workers.
         """
 
-        start_time = time.time()
+        if isinstance(_world, HittableList):
+            _world.build()
+        if self.tuned("backend") == "thread":
+            if self.irradiance_cache is not None:
+                raise ValueError("the thread backend cannot share an irradiance cache between threads")
+            return multiprocessing.pool.ThreadPool(workers, initializer=_init_worker, initargs=(self, _world))
+        # worker processes get a copy of the camera with the tuned parameters resolved here: processes started
+        # by spawn rather than fork would otherwise read the profile themselves and lose any overrides
+        camera = copy.copy(self)
+        for name in self.TUNED:
+            setattr(camera, name, self.tuned(name))
+        return multiprocessing.Pool(workers, initializer=_init_worker, initargs=(camera, _world))
+
+    def render(self, _world: HittableList, out=sys.stdout, workers: int = 1, accum: Accumulator = None,
+               telemetry: Telemetry = None) -> None:
+        """
+        Dispatches rays into world and uses ray-intersection information to construct rendered image.
+        With `workers` > 1, scanlines are traced by a pool of processes and written in order as they complete.
+        If `accum` is given, the summed sample colors are also stored in it. Progress is reported to `telemetry`
+        if given.
+        """
 
-        print(f"P3\n{self.image_width} {self.image_height}\n255")
+        start_time = time.time()
 
-        for j in range(self.image_height):
+        out.write(f"P3\n{self.image_width} {self.image_height}\n255\n")
 
+        for j, row in enumerate(self.render_rows(_world, range(self.image_height), workers, telemetry=telemetry)):
             sys.stderr.write(f"\rScanlines remaining: {self.image_height-j} ")
-            for i in range(self.image_width):
+            if accum is not None:
+                accum.set_row(j, row)
+            for pixel_color in row:
+                # write_color divides total color sum by sample size for averaging
+                write_color(out, pixel_color, self.samples_per_pixel)
+
+        sys.stderr.write(f"\rDone. Render took {time.time() - start_time} seconds.\n")
 
-                # if not (j == int(self.image_height*0.5) and i == self.image_width * (2/3)):
-                #     continue
+    def render_timed(self, _world: HittableList, budget: float, workers: int = 1) -> tuple[Accumulator, list[dict]]:
+        """
+        Renders as many samples per pixel as fit in `budget` seconds, in passes over the whole image, and
+        returns the accumulated image (whose `samples_per_pixel` is the number of samples every pixel got)
+        along with the samples and time of each pass.
+
+        Passes take 1, 1, 2, 4, ... samples per pixel, capped at `samples_per_pixel` in total. The cost of
+        the last passes predicts that of the next one (see `pass_cost`), which is shrunk to what fits in the
+        remaining time; rendering stops when not even one more sample fits. Only the first pass is
+        run regardless of the budget, so there is always an image. Sample indices continue from pass to
+        pass, so the image matches a render with the achieved number of samples.
+        """
 
-                # initial pixel_color is black
-                pixel_color = RGB(0, 0, 0)
-                # Collect random sample around original pixel for antialiasing
-                for sample in range(0, self.samples_per_pixel):
-                    # DEBUG
-                    # sys.stderr.write(f"Pixel ({i}, {j}): Sample {sample}\n")
+        start = time.perf_counter()
+        accum = Accumulator(self.image_width, self.image_height, 0)
+        passes: list[dict] = []
+        rows = range(self.image_height)
+        pool = None
+        if workers > 1:
+            pool = self.pool(_world, workers)
+        try:
+            done = 0
+            batch = 1
+            while done < self.samples_per_pixel:
+                if passes:
+                    remaining = budget - (time.perf_counter() - start)
+                    overhead, per_sample = self.pass_cost(passes)
+                    # keep a small margin for the variance of the pass time
+                    batch = min(batch, int((0.95 * remaining - overhead) / per_sample))
+                    if batch < 1:
+                        break
+                batch = min(batch, self.samples_per_pixel - done)
+
+                pass_start = time.perf_counter()
+                samples = range(done, done + batch)
+                if pool is None:
+                    results = (self.render_row(j, _world, samples=samples) for j in rows)
+                else:
+                    results = pool.imap(_render_row, ((j, None, samples) for j in rows), self.tuned("rows_per_task"))
+                for j, row in enumerate(results):
+                    accum.add_row(j, row)
+                passes.append({"samples": batch, "seconds": time.perf_counter() - pass_start})
+                done += batch
+                sys.stderr.write(f"\rPass {len(passes)}: {done} samples per pixel, "
+                                 f"{time.perf_counter() - start:.1f}s of {budget:.1f}s ")
+                batch = max(done, 1)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        accum.samples_per_pixel = done
+        sys.stderr.write(f"\rDone. {done} samples per pixel in {len(passes)} passes, "
+                         f"{time.perf_counter() - start:.1f}s of a {budget:.1f}s budget.\n")
+        return accum, passes
+
+    @staticmethod
+    def pass_cost(passes: list[dict]) -> tuple[float, float]:
+        """
+        Returns the fixed time of a pass (scheduling rows, gathering results) and the time per sample per
+        pixel, fitted to the last two passes if they took different numbers of samples.
+        """
 
-                    sample_ray: Ray = self.rand_pixel_ray(i, j)
-                    sample_ray_color: RGB = self.ray_color(sample_ray, self.max_depth, _world)
-                    # summing colors to be blended (averaged) in write_color
+        last = passes[-1]
+        if len(passes) > 1 and passes[-2]["samples"] != last["samples"]:
+            prev = passes[-2]
+            per_sample = (last["seconds"] - prev["seconds"]) / (last["samples"] - prev["samples"])
+            overhead = last["seconds"] - per_sample * last["samples"]
+            if per_sample > 0.0 and overhead >= 0.0:
+                return overhead, per_sample
+        return 0.0, last["seconds"] / last["samples"]
 
-                    pixel_color = pixel_color + sample_ray_color
-                # write_color divides total color sum by sample size for averaging
-                write_color(sys.stdout, pixel_color, self.samples_per_pixel)
+    def render_bands(self, _world: HittableList, stream, band_height: int = 16, workers: int = 1) -> None:
+        """
+        Renders the image in horizontal bands of `band_height` scanlines and hands each band, encoded as 8-bit
+        RGB rows, to `stream.write_rows` (a `PPMStream` or `PNGStream`) as soon as all bands above it are
+        written. Only the encoded bands in flight are ever held in memory.
+
+        With `workers` > 1, at most two bands per worker are queued or finished ahead of the next band to
+        write; bands that finish early wait in a reorder buffer until their turn.
+        """
+
+        start_time = time.time()
+        bands = [(j, min(j + band_height, self.image_height)) for j in range(0, self.image_height, band_height)]
+
+        if workers <= 1:
+            for band in bands:
+                sys.stderr.write(f"\rScanlines remaining: {self.image_height - band[0]} ")
+                stream.write_rows(self.render_band(band, _world))
+        else:
+            with self.pool(_world, workers) as pool:
+                window = 2 * workers
+                # reorder buffer: bands queued, running or finished but not yet written, by index
+                pending: dict[int, multiprocessing.pool.AsyncResult] = {}
+                submitted = 0
+                for written, band in enumerate(bands):
+                    while submitted < len(bands) and submitted - written < window:
+                        pending[submitted] = pool.apply_async(_render_band, (bands[submitted],))
+                        submitted += 1
+                    # wait for the next band to write; later ones keep running meanwhile
+                    data = pending.pop(written).get()
+                    sys.stderr.write(f"\rScanlines remaining: {self.image_height - band[0]} ")
+                    stream.write_rows(data)
+        stream.close()
 
         sys.stderr.write(f"\rDone. Render took {time.time() - start_time} seconds.\n")
 
+    def render_band(self, band: tuple[int, int], _world: HittableList) -> bytes:
+        """Returns the 8-bit RGB rows of scanlines `band = (j0, j1)` (exclusive upper bound)."""
+
+        return b"".join(encode_row(self.render_row(j, _world), self.samples_per_pixel) for j in range(*band))
+
+    def render_crop(self, _world: HittableList, crop: tuple[int, int, int, int], workers: int = 1,
+                    telemetry: Telemetry = None) -> list[list[RGB]]:
+        """
+        Re-traces only the window `crop = (x0, y0, x1, y1)` of the image (exclusive upper bounds) and returns
+        the summed sample colors of its scanlines, identical to those of the same pixels in a full render.
+        """
+
+        x0, y0, x1, y1 = crop
+        if not (0 <= x0 < x1 <= self.image_width and 0 <= y0 < y1 <= self.image_height):
+            raise ValueError(f"Crop window {crop} is outside the {self.image_width}x{self.image_height} image")
+        return list(self.render_rows(_world, range(y0, y1), workers, columns=range(x0, x1), telemetry=telemetry))
+
+    def render_rows(self, _world: HittableList, rows, workers: int = 1, columns: range = None, samples: range = None,
+                    telemetry: Telemetry = None):
+        """
+        Yields, in order, the summed sample colors of each scanline in `rows`, restricted to `columns` and to
+        the sample indices in `samples` if given. Every finished scanline is reported to `telemetry` if given.
+        """
+
+        if telemetry is not None:
+            yield from self.render_rows_measured(_world, rows, workers, columns, samples, telemetry)
+            return
+
+        if self.tuned("packet_size") > 1:
+            yield from self.render_rows_packets(_world, rows, workers, columns, samples)
+            return
+
+        if workers <= 1:
+            for j in rows:
+                yield self.render_row(j, _world, columns, samples)
+            return
+
+        with self.pool(_world, workers) as pool:
+            yield from pool.imap(_render_row, ((j, columns, samples) for j in rows), self.tuned("rows_per_task"))
+
+    def render_rows_packets(self, _world: HittableList, rows, workers: int, columns: range, samples: range):
+        """`render_rows` for `packet_size` > 1, rendering the scanlines in bands of `packet_size` rows."""
+
+        rows = list(rows)
+        n = self.tuned("packet_size")
+        bands = [rows[k:k + n] for k in range(0, len(rows), n)]
+        if workers <= 1:
+            for band in bands:
+                yield from self.render_block_rows(band, _world, columns, samples)
+            return
+
+        with self.pool(_world, workers) as pool:
+            for band_rows in pool.imap(_render_block_rows, ((band, columns, samples) for band in bands)):
+                yield from band_rows
+
+    def render_rows_measured(self, _world: HittableList, rows, workers: int, columns: range, samples: range,
+                             telemetry: Telemetry):
+        """`render_rows`, with each scanline's samples, rays, trace time and process memory sent to `telemetry`."""
+
+        width = self.image_width if columns is None else len(columns)
+        row_samples = width * (self.samples_per_pixel if samples is None else len(samples))
+        telemetry.begin(len(rows) * row_samples, len(rows))
+
+        if workers <= 1:
+            for j in rows:
+                rays, start = settings.stats.rays, time.perf_counter()
+                row = self.render_row(j, _world, columns, samples)
+                telemetry.update("main", row_samples, settings.stats.rays - rays, time.perf_counter() - start,
+                                 current_rss_bytes())
+                yield row
+        else:
+            with self.pool(_world, workers) as pool:
+                for row, worker, rays, seconds, rss in pool.imap(_render_row_measured,
+                                                                 ((j, columns, samples) for j in rows),
+                                                                 self.tuned("rows_per_task")):
+                    telemetry.update(worker, row_samples, rays, seconds, rss)
+                    yield row
+        telemetry.finish()
+
+    def render_row(self, j: int, _world: HittableList, columns: range = None, samples: range = None) -> list[RGB]:
+        """
+        Returns the summed sample colors of every pixel in scanline `j` (or of those in `columns`).
+        """
+
+        return [self.render_pixel(i, j, _world, samples) for i in (range(self.image_width) if columns is None else columns)]
+
+    def render_block_rows(self, rows: list[int], _world: HittableList, columns: range = None,
+                          samples: range = None) -> list[list[RGB]]:
+        """
+        Returns the summed sample colors of the scanlines `rows` (or of the pixels in `columns`), like
+        `render_row` for each, tracing the camera rays of blocks of `packet_size` columns as packets.
+        """
+
+        columns = range(self.image_width) if columns is None else columns
+        samples = range(self.samples_per_pixel) if samples is None else samples
+        n = max(self.tuned("packet_size"), 1)
+        root = packet_root(_world)
+        out = [[RGB(0, 0, 0)] * len(columns) for _ in rows]
+        for c0 in range(0, len(columns), n):
+            block = [(r, c, j, columns[c]) for r, j in enumerate(rows) for c in range(c0, min(c0 + n, len(columns)))]
+            for sample in samples:
+                # every pixel keeps its own random stream from its camera ray through to the end of its path
+                streams = [sample_stream(self.seed, j * self.image_width + i, sample) for _, _, j, i in block]
+                rays = []
+                for stream, (_, _, j, i) in zip(streams, block):
+                    use_stream(stream)
+                    rays.append(self.rand_pixel_ray(i, j))
+                for stream, (r, c, _, _), ray, found in zip(streams, block, rays, self.trace_primary(rays, root, _world)):
+                    use_stream(stream)
+                    out[r][c] = out[r][c] + self.primary_color(ray, found, _world)
+        use_stream(None)
+        return out
+
+    def trace_primary(self, rays: list[Ray], root: Hittable | None,
+                      _world: Hittable) -> list[tuple[float, Hittable] | None]:
+        """
+        Returns the closest intersection of each camera ray, tracing them as one packet through the BVH under
+        `root` if there is one and the rays are coherent, and one at a time through `_world` otherwise.
+        """
+
+        if root is not None:
+            packet = RayPacket(rays)
+            if packet.coherent:
+                return intersect_packet(root, packet, 0.001, math.inf)
+        return [_world.intersect(r, 0.001, math.inf) for r in rays]
+
+    def primary_color(self, _r: Ray, found: tuple[float, Hittable] | None, _world: Hittable) -> RGB:
+        """`ray_color` for a camera ray whose closest intersection `found` is already known."""
+
+        if self.max_depth <= 0:
+            return RGB(0, 0, 0)
+        settings.stats.rays += 1
+        if found is not None:
+            t, primitive = found
+            return self.shade(_r, primitive.hit_record(_r, t), self.max_depth, _world)
+        return self.background(_r)
+
+    def render_pixel(self, i: int, j: int, _world: HittableList, samples: range = None) -> RGB:
+        """
+        Returns the sum of the sample colors for pixel (i, j), over sample indices `samples`
+        (all `samples_per_pixel` samples by default).
+        """
+
+        pixel: int = j * self.image_width + i
+        # initial pixel_color is black
+        pixel_color = RGB(0, 0, 0)
+        # Collect random sample around original pixel for antialiasing
+        for sample in (range(0, self.samples_per_pixel) if samples is None else samples):
+            use_stream(sample_stream(self.seed, pixel, sample))
+            sample_ray: Ray = self.rand_pixel_ray(i, j)
+            sample_ray_color: RGB = self.ray_color(sample_ray, self.max_depth, _world)
+            # summing colors to be blended (averaged) in write_color
+            pixel_color = pixel_color + sample_ray_color
+        use_stream(None)
+        return pixel_color
+
     def rand_pixel_ray(self, i: int, j: int) -> Ray:
         """
         Get a randomly-sampled camera ray for the pixel at location (i, j), originating from the camera defocus.
@@ -138,35 +476,199 @@ class Camera:
         # modify vector to fit within camera's frame of reference
         return self.center + (p.x * self.defocus_disk_u) + (p.y * self.defocus_disk_v)
 
-    def ray_color(self, _r: Ray, depth: int, _world: Hittable) -> RGB:
+    def ray_color(self, _r: Ray, depth: int, _world: Hittable, use_cache: bool = True, mis_pdf: float = None) -> RGB:
         """
         Returns the RGB color value for a ray `_r` that has been shot into `_world`. Since this function is recursive
         we restrict the maximum recursion depth after which the ray will return `RGB(0, 0, 0)`.
+
+        `mis_pdf` is the density with which the previous bounce sampled `_r`, if that bounce also sampled the
+        environment light explicitly; the environment seen by `_r` is then weighted by multiple importance sampling.
         """
 
         # if ray bounce limit exceeded, no more light is gathered
         if depth <= 0:
             return RGB(0, 0, 0)
 
+        settings.stats.rays += 1
+
         # check if object is hit AND update rec to hold the information of the nearest object (if hit)
-        rec = _world.hit(_r, Interval(0.001, math.inf)) or None
+        rec = _world.hit(_r, 0.001, math.inf)
         if rec is not None:
+            return self.shade(_r, rec, depth, _world, use_cache)
+        if mis_pdf is not None:
+            # power heuristic against the density of the environment light sample taken at the previous hit
+            light_pdf: float = self.environment.pdf(_r.dir)
+            return (mis_pdf * mis_pdf / (mis_pdf * mis_pdf + light_pdf * light_pdf)) * self.background(_r)
+        return self.background(_r)
+
+    def shade(self, _r: Ray, rec: HitRecord, depth: int, _world: Hittable, use_cache: bool = True) -> RGB:
+        """
+        Returns the light leaving the hit `rec` along the incident ray `_r`.
 
-            # DEBUG
-            # sys.stderr.write("`rec` info:\n")
-            # sys.stderr.write(str(rec) + "\n")
+        At `Lambertian` hits, the indirect light is read from the irradiance cache when one is enabled (and
+        `use_cache` is set), instead of tracing the rest of the path. With path guiding enabled, `Lambertian` and
+        fuzzy `Metal` hits are shaded by `shade_guided`.
+        """
 
-            attenuation, scattered = rec.mat.scatter(_r, rec) or (None, None)
-            
-            # rays are not scattered in all scenarios (can be absorbed for instance)
-            if attenuation is not None and scattered is not None:
-                return attenuation * self.ray_color(scattered, depth-1, _world)
-            else:
+        if rec.mat.texture is not None:
+            # textures are filtered over the width of a pixel as seen from the camera
+            rec.footprint = self.pixel_angle * (rec.p - self.center).length()
+
+        if rec.mat.emission is not None:
+            return rec.mat.emission if rec.front_face else RGB(0, 0, 0)
+
+        if self.guiding is not None and (type(rec.mat) is Lambertian or (type(rec.mat) is Metal and rec.mat.fuzz > 0.0)):
+            return self.shade_guided(_r, rec, depth, _world)
+
+        cache = self.irradiance_cache
+        if cache is not None and use_cache and isinstance(rec.mat, Lambertian):
+            if depth <= 1:
+                # no bounce is left for indirect light, as in `ray_color`; nothing is cached from such hits
                 return RGB(0, 0, 0)
+            irradiance: RGB | None = cache.lookup(rec.p, rec.normal)
+            if irradiance is None:
+                irradiance = cache.compute(rec, self, _world, depth)
+            return rec.mat.albedo_at(rec) * irradiance
+
+        attenuation, scattered = rec.mat.scatter(_r, rec) or (None, None)
+
+        if self.environment is not None and isinstance(rec.mat, Lambertian):
+            # explicit environment light sample, combined with the scattered ray by multiple importance sampling
+            direct: RGB = self.sample_environment(rec, _world)
+            # the Lambertian scattered direction is cosine-distributed
+            bsdf_pdf: float = max(dot(normalize(scattered.dir), rec.normal), 0.0) / math.pi
+            return direct + attenuation * self.ray_color(scattered, depth-1, _world, use_cache, bsdf_pdf)
+
+        # rays are not scattered in all scenarios (can be absorbed for instance)
+        if attenuation is not None and scattered is not None:
+            return attenuation * self.ray_color(scattered, depth-1, _world, use_cache)
+        else:
+            return RGB(0, 0, 0)
+
+    def shade_guided(self, _r: Ray, rec: HitRecord, depth: int, _world: Hittable) -> RGB:
+        """
+        Returns the light leaving the `Lambertian` or fuzzy `Metal` hit `rec` along `_r`, from one direction
+        drawn either from the guiding distribution of the hit's cell (with probability `guide_fraction`, scaled
+        by the fuzz of a `Metal`) or from the material itself, weighted by the mixture of both densities
+        (one-sample multiple importance sampling). Where the field does not guide yet, this is exactly the
+        material's own sampling. While the field is `learning`, the light found is recorded in it.
+        """
+
+        field: GuidingField = self.guiding
+        mat = rec.mat
+        lobe = field.distribution(rec.p, rec.normal)
+        lambertian: bool = type(mat) is Lambertian
+        alpha: float = 0.0 if lobe is None else field.guide_fraction * (1.0 if lambertian else mat.fuzz)
+
+        if alpha > 0.0 and rand_float() < alpha:
+            direction: Vector = field.sample(lobe)
+        else:
+            sampled = mat.scatter(_r, rec)
+            if sampled is None:
+                return RGB(0, 0, 0)  # absorbed
+            direction = sampled[1].dir
+
+        # density of the material's own sampling, which is also its reflectance times the cosine
+        cos_theta: float = dot(normalize(direction), rec.normal)
+        if cos_theta <= 0.0:
+            return RGB(0, 0, 0)
+        if lambertian:
+            bsdf_pdf: float = cos_theta / math.pi
         else:
-            # sys.stderr.write("`rec` is `None`:\n")
+            bsdf_pdf = fuzz_pdf(reflect(normalize(_r.dir), rec.normal), mat.fuzz, direction)
+        pdf: float = bsdf_pdf if alpha == 0.0 else alpha * field.pdf(lobe, direction) + (1.0 - alpha) * bsdf_pdf
+        if pdf <= 0.0:
+            return RGB(0, 0, 0)
+
+        incoming: RGB = self.ray_color(Ray(rec.p, direction), depth-1, _world)
+        if field.learning:
+            field.record(rec.p, rec.normal, direction, incoming, pdf)
+        return (bsdf_pdf / pdf) * (mat.albedo_at(rec) * incoming)
+
+    def train_guiding(self, _world: Hittable, passes: int = 4, pixel_stride: int = 2) -> None:
+        """
+        Teaches the guiding field the light of `_world`: traces `passes` passes of one sample through every
+        `pixel_stride`-th pixel of every `pixel_stride`-th row, recording the light found along every guided
+        bounce, and updates the field's distributions after each pass, so that later passes are guided by
+        the earlier ones. The samples themselves are discarded.
+
+        Training is serial and its streams are keyed apart from those of the image's samples, so the field,
+        and with it the image, depends only on the scene, the camera and the seed.
+        """
+
+        field: GuidingField = self.guiding
+        field.learning = True
+        try:
+            for k in range(passes):
+                for j in range(0, self.image_height, pixel_stride):
+                    for i in range(0, self.image_width, pixel_stride):
+                        use_stream(sample_stream(~self.seed, j * self.image_width + i, k))
+                        self.ray_color(self.rand_pixel_ray(i, j), self.max_depth, _world)
+                field.update()
+        finally:
+            use_stream(None)
+            field.learning = False
+
+    def sample_environment(self, rec: HitRecord, _world: Hittable) -> RGB:
+        """
+        Returns the environment light reflected at the `Lambertian` hit `rec` towards the incident ray, estimated
+        from one importance-sampled light direction and weighted by the power heuristic.
+        """
+
+        light_dir, light_pdf = self.environment.sample(rand_float(), rand_float())
+        cos_theta: float = dot(light_dir, rec.normal)
+        if light_pdf <= 0.0 or cos_theta <= 0.0:
+            return RGB(0, 0, 0)
+
+        settings.stats.rays += 1
+        if _world.intersect(Ray(rec.p, light_dir), 0.001, math.inf) is not None:
+            return RGB(0, 0, 0)  # occluded
+
+        bsdf_pdf: float = cos_theta / math.pi
+        weight: float = light_pdf * light_pdf / (light_pdf * light_pdf + bsdf_pdf * bsdf_pdf)
+        # albedo / pi * L * cos / pdf
+        return (weight * cos_theta / (math.pi * light_pdf)) * (rec.mat.albedo_at(rec) * self.environment.lookup(light_dir))
+
+    def background(self, _r: Ray) -> RGB:
+        """Returns the light arriving along a ray that does not hit any objects in the scene."""
+
+        if self.environment is not None:
+            return self.environment.lookup(_r.dir)
+
+        # if the ray does not hit any objects in the scene, then the background (sky) is colored using a gradient
+        unit_dir = normalize(_r.dir)
+        a = 0.5 * (unit_dir.y + 1.0)
+        return (1.0-a)*RGB(1.0, 1.0, 1.0) + a*RGB(0.5, 0.7, 1.0)
+
+
+# per-process state of render pool workers, set once by `_init_worker`
+_worker_camera: Camera = None
+_worker_world: Hittable = None
+
+def _init_worker(camera: Camera, world: Hittable) -> None:
+    global _worker_camera, _worker_world
+    settings.init()
+    _worker_camera = camera
+    _worker_world = world
+
+def _render_row(task: tuple) -> list[RGB]:
+    j, columns, samples = task
+    return _worker_camera.render_row(j, _worker_world, columns, samples)
+
+def _render_block_rows(task: tuple) -> list[list[RGB]]:
+    rows, columns, samples = task
+    return _worker_camera.render_block_rows(rows, _worker_world, columns, samples)
+
+def _render_band(band: tuple[int, int]) -> bytes:
+    return _worker_camera.render_band(band, _worker_world)
+
+def _render_row_measured(task: tuple) -> tuple[list[RGB], str, int, float, int]:
+    rays, start = settings.stats.rays, time.perf_counter()
+    row = _render_row(task)
+    return row, _worker_name(), settings.stats.rays - rays, time.perf_counter() - start, current_rss_bytes()
+
+def _worker_name() -> str:
+    """Names the calling pool worker for telemetry: its process id, and its thread for the thread backend."""
 
-            # if the ray does not hit any objects in the scene, then the background (sky) is colored using a gradient
-            unit_dir = normalize(_r.dir)
-            a = 0.5 * (unit_dir.y + 1.0)
-            return (1.0-a)*RGB(1.0, 1.0, 1.0) + a*RGB(0.5, 0.7, 1.0)
\ No newline at end of file
+    thread = threading.current_thread()
+    return str(os.getpid()) if thread is threading.main_thread() else f"{os.getpid()}/{thread.name}"
@@ -0,0 +1,325 @@
+"""
+Compiled binary scene format. A built scene (flattened BVH, sphere array and material table) is written to a
+single versioned file, which render processes attach to with `mmap` instead of unpickling a Python object graph:
+the operating system shares the file's pages between all of them. The file doubles as an on-disk BVH cache,
+since it records a hash of the primitives it was built from.
+
+Layout (little endian, every section 8-byte aligned), struct-of-arrays so each section is a plain typed array:
+
+    header           magic, version, node/sphere/material counts, sha256 of the primitives
+    node_bounds      6 doubles per node: x_min, x_max, y_min, y_max, z_min, z_max
+    node_children    3 int32 per node: left, right, split axis; a child c >= 0 is node c, c < 0 is sphere ~c
+    sphere_data      4 doubles per sphere: center x, y, z, radius
+    sphere_material  1 int32 per sphere: index into the material table
+    material_type    1 int32 per material: 0 Lambertian, 1 Metal, 2 Dielectric
+    material_params  5 doubles per material: albedo r, g, b, fuzz, refractive index
+"""
+import os
+import mmap
+import struct
+import hashlib
+import math
+from math import inf, sqrt
+from array import array
+
+import settings
+from utils import Vector, Point, RGB, Ray
+from hittable import Hittable, HitRecord, AABB
+from hittable_list import HittableList
+from sphere import Sphere, sphere_uv
+from material import Material, Lambertian, Metal, Dielectric
+from bvh import BVH_Node, BVH_Tree
+
+
+MAGIC = b"PYRTSCN\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIII32s")
+
+LAMBERTIAN, METAL, DIELECTRIC = 0, 1, 2
+
+
+def align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def section_layout(nodes: int, spheres: int, materials: int) -> list[tuple[str, str, int, int]]:
+    """Returns (name, array typecode, item count, byte offset) of each section, in file order."""
+
+    sections = [("node_bounds", "d", 6 * nodes), ("node_children", "i", 3 * nodes),
+                ("sphere_data", "d", 4 * spheres), ("sphere_material", "i", spheres),
+                ("material_type", "i", materials), ("material_params", "d", 5 * materials)]
+    layout = []
+    offset = align8(HEADER.size)
+    for name, code, count in sections:
+        layout.append((name, code, count, offset))
+        offset = align8(offset + count * array(code).itemsize)
+    return layout
+
+
+def material_params(mat: Material) -> tuple[int, tuple[float, ...]]:
+    if mat.texture is not None:
+        raise ValueError("Cannot compile textured materials")
+    if isinstance(mat, Lambertian):
+        return LAMBERTIAN, (mat.albedo.x, mat.albedo.y, mat.albedo.z, 0.0, 0.0)
+    if isinstance(mat, Metal):
+        return METAL, (mat.albedo.x, mat.albedo.y, mat.albedo.z, mat.fuzz, 0.0)
+    if isinstance(mat, Dielectric):
+        return DIELECTRIC, (0.0, 0.0, 0.0, 0.0, mat.ir)
+    raise ValueError(f"Cannot compile material type {type(mat).__name__}")
+
+
+def scene_hash(objects: list[Hittable]) -> bytes:
+    """Returns a sha256 digest of the geometry and materials of `objects`, in order."""
+
+    digest = hashlib.sha256()
+    for obj in objects:
+        if not isinstance(obj, Sphere):
+            raise ValueError(f"Cannot compile object type {type(obj).__name__}")
+        kind, params = material_params(obj.mat)
+        digest.update(struct.pack("<4di5d", obj.center.x, obj.center.y, obj.center.z, obj.radius, kind, *params))
+    return digest.digest()
+
+
+def compile_scene(world: HittableList, path: str) -> None:
+    """Builds the BVH of `world` (if needed) and writes the compiled scene to `path`."""
+
+    objects = world.objects
+    digest = scene_hash(objects)
+    sphere_index = {id(obj): k for k, obj in enumerate(objects)}
+
+    materials: list[Material] = []
+    material_index: dict[int, int] = {}
+    for obj in objects:
+        if id(obj.mat) not in material_index:
+            material_index[id(obj.mat)] = len(materials)
+            materials.append(obj.mat)
+
+    data = {name: array(code) for name, code, _, _ in section_layout(0, 0, 0)}
+    for obj in objects:
+        data["sphere_data"].extend((obj.center.x, obj.center.y, obj.center.z, obj.radius))
+        data["sphere_material"].append(material_index[id(obj.mat)])
+    for mat in materials:
+        kind, params = material_params(mat)
+        data["material_type"].append(kind)
+        data["material_params"].extend(params)
+
+    if len(objects) <= 1:
+        # a single root referencing the only sphere from both sides; an empty box is never entered
+        box = objects[0].bounding_box.bounds if objects else (inf, -inf, inf, -inf, inf, -inf)
+        data["node_bounds"].extend(box)
+        data["node_children"].extend((~0, ~0, 0))
+    else:
+        # breadth-first numbering of the interior nodes
+        nodes: list[BVH_Node] = BVH_Tree(world, leaf_size=2).interior_nodes()
+        node_index = {id(node): k for k, node in enumerate(nodes)}
+
+        def encode(child: Hittable) -> int:
+            return node_index[id(child)] if isinstance(child, BVH_Node) else ~sphere_index[id(child)]
+
+        for node in nodes:
+            data["node_bounds"].extend(node.bbox.bounds)
+            data["node_children"].extend((encode(node.left), encode(node.right), node.axis))
+
+    node_count = len(data["node_bounds"]) // 6
+    layout = section_layout(node_count, len(objects), len(materials))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, node_count, len(objects), len(materials), digest))
+        for name, code, count, offset in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            values = data[name]
+            if values.itemsize != array(code).itemsize or len(values) != count:
+                raise AssertionError(f"section {name} has the wrong size")
+            if struct.pack("=i", 1) != struct.pack("<i", 1):
+                values.byteswap()
+            f.write(values.tobytes())
+    # readers never see a partially written file
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> tuple | None:
+    """Returns the header fields of the compiled scene at `path`, or `None` if it is missing or not one."""
+
+    try:
+        with open(path, "rb") as f:
+            fields = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return fields if fields[0] == MAGIC else None
+
+
+def load_or_compile(world: HittableList, path: str) -> 'CompiledScene':
+    """
+    Attaches to the compiled scene at `path` if it was compiled from the same primitives and format version,
+    so the BVH build is skipped; otherwise compiles `world` to `path` first.
+    """
+
+    header = read_header(path)
+    if header is None or header[1] != VERSION or header[5] != scene_hash(world.objects):
+        compile_scene(world, path)
+    return CompiledScene(path)
+
+
+class CompiledSphere(Hittable):
+    """A sphere of a `CompiledScene`, returned by its `intersect` for building the final hit record."""
+
+    __slots__ = ("scene", "index")
+
+    def __init__(self, scene: 'CompiledScene', index: int) -> None:
+        self.scene = scene
+        self.index = index
+
+    @property
+    def bounding_box(self) -> AABB:
+        cx, cy, cz, r = self.scene.sphere_data[4 * self.index:4 * self.index + 4]
+        return AABB.from_corners(Point(cx - r, cy - r, cz - r), Point(cx + r, cy + r, cz + r))
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        hit = self.scene.intersect_sphere(self.index, _r, t_min, t_max)
+        return None if hit is None else (hit, self)
+
+    def hit_record(self, _r: Ray, t: float) -> HitRecord:
+        scene = self.scene
+        cx, cy, cz, radius = scene.sphere_data[4 * self.index:4 * self.index + 4]
+        rec = HitRecord(p=_r.at(t), t=t, mat=scene.materials[scene.sphere_material[self.index]], primitive=self)
+        outward_normal: Vector = (rec.p - Point(cx, cy, cz)) / radius
+        rec.set_face_normal(_r, outward_normal)
+        return rec
+
+
+    def surface_uv(self, p: Point) -> tuple[float, float]:
+        cx, cy, cz, radius = self.scene.sphere_data[4 * self.index:4 * self.index + 4]
+        r = abs(radius)
+        return sphere_uv((p.x - cx) / r, (p.y - cy) / r, (p.z - cz) / r)
+
+    @property
+    def uv_scale(self) -> float:
+        return 2 * math.pi * abs(self.scene.sphere_data[4 * self.index + 3])
+
+
+class CompiledScene(Hittable):
+    """
+    A scene attached read-only from a compiled scene file. All geometry is read in place from the memory
+    mapping; only the (small) material table is turned back into `Material` objects. Pickling a
+    `CompiledScene` only pickles its path, so worker processes re-attach to the same file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nodes, spheres, materials, self.digest = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled scene")
+        if version != VERSION:
+            raise ValueError(f"{path} has format version {version}, expected {VERSION}")
+        if struct.pack("=i", 1) != struct.pack("<i", 1):
+            raise ValueError("compiled scenes can only be attached on little-endian machines")
+
+        view = memoryview(self.mm)
+        for name, code, count, offset in section_layout(nodes, spheres, materials):
+            size = count * array(code).itemsize
+            setattr(self, name, view[offset:offset + size].cast(code))
+
+        self.materials: list[Material] = []
+        for k in range(materials):
+            r, g, b, fuzz, ir = self.material_params[5 * k:5 * k + 5]
+            kind = self.material_type[k]
+            self.materials.append(Lambertian(RGB(r, g, b)) if kind == LAMBERTIAN else
+                                  Metal(RGB(r, g, b), fuzz) if kind == METAL else Dielectric(ir))
+        # created up front, so that intersecting never writes to a scene shared between render threads
+        self.primitives: list[CompiledSphere] = [CompiledSphere(self, k) for k in range(spheres)]
+        self.bbox = AABB.from_bounds(*self.node_bounds[0:6])
+
+    def __reduce__(self):
+        return (CompiledScene, (self.path,))
+
+    def __len__(self) -> int:
+        return len(self.primitives)
+
+    @property
+    def bounding_box(self) -> AABB:
+        return self.bbox
+
+    def primitive(self, index: int) -> CompiledSphere:
+        return self.primitives[index]
+
+    def intersect_sphere(self, index: int, _r: Ray, t_min: float, t_max: float) -> float | None:
+        s = 4 * index
+        data = self.sphere_data
+        ox, oy, oz = _r.orig
+        d = _r.dir
+        ocx, ocy, ocz = ox - data[s], oy - data[s + 1], oz - data[s + 2]
+        radius = data[s + 3]
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        half_b = ocx * d.x + ocy * d.y + ocz * d.z
+        c = ocx * ocx + ocy * ocy + ocz * ocz - radius * radius
+        disc = half_b * half_b - a * c
+        if disc < 0:
+            return None
+        sqrtd = sqrt(disc)
+        root = (-half_b - sqrtd) / a
+        if not t_min < root < t_max:
+            root = (-half_b + sqrtd) / a
+            if not t_min < root < t_max:
+                return None
+        return root
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        """
+        Front-to-back traversal of the flattened BVH with an explicit stack: the nearer child along the
+        split axis is popped first, and nodes are slab-tested against the closest hit found so far.
+        """
+
+        bounds = self.node_bounds
+        children = self.node_children
+        ox, oy, oz = _r.orig
+        ix, iy, iz = _r.inv_dir
+        sign = _r.sign
+        sx, sy, sz = sign
+        closest = -1
+        visits = 0
+
+        stack = [0]
+        while stack:
+            n = stack.pop()
+            if n < 0:
+                t = self.intersect_sphere(~n, _r, t_min, t_max)
+                if t is not None:
+                    t_max = t
+                    closest = ~n
+                continue
+
+            visits += 1
+            b = 6 * n
+            lo, hi = t_min, t_max
+            t0 = (bounds[b + sx] - ox) * ix
+            t1 = (bounds[b + 1 - sx] - ox) * ix
+            if t0 > lo: lo = t0
+            if t1 < hi: hi = t1
+            if hi <= lo:
+                continue
+            t0 = (bounds[b + 2 + sy] - oy) * iy
+            t1 = (bounds[b + 3 - sy] - oy) * iy
+            if t0 > lo: lo = t0
+            if t1 < hi: hi = t1
+            if hi <= lo:
+                continue
+            t0 = (bounds[b + 4 + sz] - oz) * iz
+            t1 = (bounds[b + 5 - sz] - oz) * iz
+            if t0 > lo: lo = t0
+            if t1 < hi: hi = t1
+            if hi <= lo:
+                continue
+
+            c = 3 * n
+            left, right = children[c], children[c + 1]
+            if sign[children[c + 2]]:
+                left, right = right, left
+            # the near child is pushed last so that it is searched first
+            if right != left:
+                stack.append(right)
+            stack.append(left)
+
+        settings.stats.count += visits
+        return None if closest < 0 else (t_max, self.primitive(closest))
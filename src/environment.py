@@ -0,0 +1,249 @@
+import math
+import struct
+from array import array
+from bisect import bisect_right
+from typing import Iterator
+
+from utils import Vector, RGB
+
+
+def read_pfm(path: str) -> tuple[int, int, array]:
+    """
+    Reads a color PFM image and returns its width, height and RGB floats in row-major order, top row first.
+    """
+
+    width, height, rows = read_pfm_rows(path)
+    data = array("f")
+    for row in rows:
+        data.extend(row)
+    return width, height, data
+
+
+def read_pfm_rows(path: str) -> tuple[int, int, Iterator[array]]:
+    """
+    Returns the width and height of a color PFM image and an iterator over its rows of RGB floats, top row
+    first, each read from the file when reached.
+    """
+
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"PF":
+            raise ValueError(f"{path} is not a color PFM image")
+        dims = f.readline().split()
+        while len(dims) < 2:
+            dims += f.readline().split()
+        width, height = int(dims[0]), int(dims[1])
+        scale = float(f.readline())
+        offset = f.tell()
+    # a negative scale means little endian data
+    swap = (scale < 0) != (struct.pack("=f", 1.0) == struct.pack("<f", 1.0))
+
+    def rows() -> Iterator[array]:
+        row_bytes = 4 * 3 * width
+        with open(path, "rb") as f:
+            for j in range(height):
+                # PFM stores the bottom row first
+                f.seek(offset + (height - 1 - j) * row_bytes)
+                row = array("f")
+                row.frombytes(f.read(row_bytes))
+                if swap:
+                    row.byteswap()
+                yield row
+
+    return width, height, rows()
+
+
+def read_hdr(path: str) -> tuple[int, int, array]:
+    """
+    Reads a Radiance RGBE (.hdr) image, flat or run-length encoded, and returns its width, height and RGB
+    floats in row-major order, top row first. Only the standard `-Y height +X width` orientation is supported.
+    """
+
+    width, height, rows = read_hdr_rows(path)
+    data = array("f")
+    for row in rows:
+        data.extend(row)
+    return width, height, data
+
+
+def read_hdr_rows(path: str) -> tuple[int, int, Iterator[array]]:
+    """
+    Returns the width and height of a Radiance RGBE (.hdr) image and an iterator over its rows of RGB floats,
+    top row first, each decoded from the file when reached. See `read_hdr`.
+    """
+
+    with open(path, "rb") as f:
+        if not f.readline().startswith(b"#?"):
+            raise ValueError(f"{path} is not a Radiance HDR image")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path}: missing resolution line")
+            if line.strip() == b"":
+                break
+            if line.startswith(b"FORMAT=") and line.strip() != b"FORMAT=32-bit_rle_rgbe":
+                raise ValueError(f"{path}: unsupported format {line.strip().decode()}")
+        res = f.readline().split()
+        if len(res) != 4 or res[0] != b"-Y" or res[2] != b"+X":
+            raise ValueError(f"{path}: unsupported orientation {b' '.join(res).decode()}")
+        height, width = int(res[1]), int(res[3])
+        offset = f.tell()
+
+    def rows() -> Iterator[array]:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for _ in range(height):
+                yield decode_rgbe(read_scanline(f, width), width)
+
+    return width, height, rows()
+
+
+def read_scanline(f, width: int) -> bytearray:
+    """Reads the next RGBE scanline of `width` pixels from `f`, decoding the run-length encoding if used."""
+
+    head = f.read(4)
+    if not (8 <= width < 32768 and len(head) == 4 and head[0] == 2 and head[1] == 2
+            and (head[2] << 8 | head[3]) == width):
+        return bytearray(head + f.read(4 * width - len(head)))
+
+    # new run-length encoding: each of the four components is encoded separately
+    scanline = bytearray(4 * width)
+    for c in range(4):
+        i = 0
+        while i < width:
+            count = f.read(1)[0]
+            if count > 128:
+                count -= 128
+                scanline[4 * i + c:4 * (i + count) + c:4] = f.read(1) * count
+            else:
+                scanline[4 * i + c:4 * (i + count) + c:4] = f.read(count)
+            i += count
+    return scanline
+
+
+def decode_rgbe(scanline: bytearray, width: int) -> array:
+    """Returns the RGB floats of a scanline of RGBE pixels."""
+
+    row = array("f", bytes(4 * 3 * width))
+    for i in range(width):
+        r, g, b, e = scanline[4 * i:4 * i + 4]
+        if e:
+            scale = math.ldexp(1.0, e - (128 + 8))
+            row[3 * i] = r * scale
+            row[3 * i + 1] = g * scale
+            row[3 * i + 2] = b * scale
+    return row
+
+
+class EnvironmentMap:
+    """
+    Distant light from a latitude-longitude HDR image surrounding the scene. Row 0 of the image looks
+    straight up (+y) and column 0 looks along -x, with longitude increasing towards +z; `rotation` (degrees)
+    turns the map about the y axis and `scale` multiplies its radiance.
+
+    For importance sampling, each texel is weighted by its luminance times sin(theta), which accounts for
+    the texels shrinking towards the poles. A marginal CDF over rows and a conditional CDF within each row
+    let `sample` pick a direction with two binary searches, with a probability density proportional to the
+    light arriving from it.
+    """
+
+    def __init__(self, width: int, height: int, data: array, scale: float = 1.0, rotation: float = 0.0) -> None:
+        self.width = width
+        self.height = height
+        self.data = data
+        self.scale = scale
+        self.rotation = math.radians(rotation)
+        self.build_distribution()
+
+    @classmethod
+    def load(cls, path: str, scale: float = 1.0, rotation: float = 0.0) -> 'EnvironmentMap':
+        """Loads an environment map from a PFM or Radiance .hdr image."""
+
+        width, height, data = read_pfm(path) if path.lower().endswith(".pfm") else read_hdr(path)
+        return cls(width, height, data, scale, rotation)
+
+    def build_distribution(self) -> None:
+        """Precomputes the marginal (per row) and conditional (per texel within a row) CDF tables."""
+
+        w, h, data = self.width, self.height, self.data
+        self.conditional: list[array] = []
+        row_weights = array("d")
+        for j in range(h):
+            sin_theta = math.sin(math.pi * (j + 0.5) / h)
+            cdf = array("d", [0.0] * w)
+            total = 0.0
+            for i in range(w):
+                k = 3 * (j * w + i)
+                total += (0.2126 * data[k] + 0.7152 * data[k + 1] + 0.0722 * data[k + 2]) * sin_theta
+                cdf[i] = total
+            self.conditional.append(cdf)
+            row_weights.append(total)
+
+        self.marginal = array("d", [0.0] * h)
+        total = 0.0
+        for j in range(h):
+            total += row_weights[j]
+            self.marginal[j] = total
+        self.total = total
+
+    def texel(self, _dir: Vector) -> tuple[int, int]:
+        """Returns the (column, row) of the texel seen in direction `_dir`."""
+
+        length = _dir.length()
+        cos_theta = max(-1.0, min(1.0, _dir.y / length))
+        phi = math.atan2(_dir.z, _dir.x) - self.rotation
+        u = (phi + math.pi) / (2 * math.pi) % 1.0
+        v = math.acos(cos_theta) / math.pi
+        return min(int(u * self.width), self.width - 1), min(int(v * self.height), self.height - 1)
+
+    def lookup(self, _dir: Vector) -> RGB:
+        """Returns the radiance arriving from direction `_dir`."""
+
+        i, j = self.texel(_dir)
+        k = 3 * (j * self.width + i)
+        s = self.scale
+        return RGB(self.data[k] * s, self.data[k + 1] * s, self.data[k + 2] * s)
+
+    def texel_weight(self, i: int, j: int) -> float:
+        cdf = self.conditional[j]
+        return cdf[i] - (cdf[i - 1] if i > 0 else 0.0)
+
+    def pdf(self, _dir: Vector) -> float:
+        """Returns the solid angle probability density with which `sample` returns direction `_dir`."""
+
+        if self.total <= 0.0:
+            return 0.0
+        i, j = self.texel(_dir)
+        sin_theta = math.sqrt(max(0.0, 1.0 - _dir.y * _dir.y / _dir.length_squared()))
+        if sin_theta == 0.0:
+            return 0.0
+        # density over the unit square of (u, v), converted to solid angle
+        pdf_uv = self.texel_weight(i, j) / self.total * self.width * self.height
+        return pdf_uv / (2 * math.pi * math.pi * sin_theta)
+
+    def sample(self, u1: float, u2: float) -> tuple[Vector, float]:
+        """
+        Maps two uniform random numbers in [0, 1) to a unit direction distributed in proportion to the light
+        arriving from it, and returns it with its solid angle probability density.
+        """
+
+        x = u1 * self.total
+        j = min(bisect_right(self.marginal, x), self.height - 1)
+        row_start = self.marginal[j - 1] if j > 0 else 0.0
+        dv = (x - row_start) / (self.marginal[j] - row_start)
+
+        cdf = self.conditional[j]
+        x = u2 * cdf[-1]
+        i = min(bisect_right(cdf, x), self.width - 1)
+        texel_start = cdf[i - 1] if i > 0 else 0.0
+        du = (x - texel_start) / (cdf[i] - texel_start)
+
+        # the remainders of the searches give a uniform position within the texel
+        phi = 2 * math.pi * (i + du) / self.width - math.pi + self.rotation
+        theta = math.pi * (j + dv) / self.height
+        sin_theta = math.sin(theta)
+        _dir = Vector(sin_theta * math.cos(phi), math.cos(theta), sin_theta * math.sin(phi))
+
+        if sin_theta == 0.0:
+            return _dir, 0.0
+        pdf_uv = self.texel_weight(i, j) / self.total * self.width * self.height
+        return _dir, pdf_uv / (2 * math.pi * math.pi * sin_theta)
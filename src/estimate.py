@@ -0,0 +1,150 @@
+import sys
+import math
+import time
+import random
+import resource
+import multiprocessing
+
+import settings
+from camera import Camera
+from hittable import Hittable
+from hittable_list import HittableList
+
+
+# two-sided z value of the reported confidence bounds (95%)
+Z_95: float = 1.96
+# pixels traced by the worker process whose memory is measured
+WORKER_PIXELS: int = 8
+
+
+class RenderEstimate:
+    """
+    Extrapolated cost of a full render, measured by `estimate`. Every quantity with a confidence bound is
+    stored as a `(low, mean, high)` tuple.
+    """
+
+    def __init__(self, pixels: int, samples: int, seconds: tuple, rays: tuple, memory_bytes: int,
+                 build_seconds: float, workers: int, sampled_pixels: int, sampled_paths: int) -> None:
+        self.pixels = pixels
+        self.samples = samples
+        self.seconds = seconds
+        self.rays = rays
+        self.memory_bytes = memory_bytes
+        self.build_seconds = build_seconds
+        self.workers = workers
+        self.sampled_pixels = sampled_pixels
+        self.sampled_paths = sampled_paths
+
+    def __str__(self) -> str:
+        low, mean, high = self.seconds
+        r_low, r_mean, r_high = self.rays
+        return (f"Estimate from {self.sampled_paths} paths over {self.sampled_pixels} pixels:\n"
+                f"  pixels:  {self.pixels} x {self.samples} samples\n"
+                f"  time:    {format_seconds(mean)} (95% CI {format_seconds(low)} - {format_seconds(high)}) "
+                f"on {self.workers} worker(s), including {self.build_seconds:.2f}s BVH build\n"
+                f"  rays:    {r_mean:.4g} (95% CI {r_low:.4g} - {r_high:.4g})\n"
+                f"  memory:  {self.memory_bytes / 2**20:.1f} MiB peak resident\n")
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def format_seconds(seconds: float) -> str:
+    """Formats a duration as `HhMMmSSs`."""
+
+    seconds = max(int(round(seconds)), 0)
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s"
+
+
+def rss_bytes() -> int:
+    """Returns the peak resident set size of this process in bytes."""
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def stratified_pixels(width: int, height: int, count: int) -> list[tuple[int, int]]:
+    """
+    Returns about `count` pixels, one jittered pixel per cell of a grid of strata covering the image.
+    """
+
+    cols = max(1, min(width, round(math.sqrt(count * width / height))))
+    rows = max(1, min(height, round(count / cols)))
+    pixels: list[tuple[int, int]] = []
+    for r in range(rows):
+        for c in range(cols):
+            i = int((c + random.random()) * width / cols)
+            j = int((r + random.random()) * height / rows)
+            pixels.append((min(i, width - 1), min(j, height - 1)))
+    return pixels
+
+
+def mean_bounds(values: list[float]) -> tuple[float, float, float]:
+    """Returns the mean of `values` along with its 95% confidence bounds."""
+
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, mean, mean
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    half_width = Z_95 * math.sqrt(variance / n)
+    return max(mean - half_width, 0.0), mean, mean + half_width
+
+
+def worker_rss_bytes(cam: Camera, world: Hittable, pixels: list[tuple[int, int]]) -> int:
+    """
+    Returns the peak resident set size of a worker process that received `cam` and `world` the way render
+    workers do, pickled, and traced one path through each of `pixels`.
+    """
+
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(_trace_rss_bytes, (cam, world, pixels))
+
+
+def _trace_rss_bytes(cam: Camera, world: Hittable, pixels: list[tuple[int, int]]) -> int:
+    for i, j in pixels:
+        cam.ray_color(cam.rand_pixel_ray(i, j), cam.max_depth, world)
+    return rss_bytes()
+
+
+def estimate(cam: Camera, world: Hittable, pixel_count: int = 64, samples: int = 4, workers: int = 1) -> RenderEstimate:
+    """
+    Estimates the cost of `cam.render(world)` by tracing `samples` paths through each of `pixel_count`
+    stratified pixels and extrapolating the per-path time and ray count to the full image.
+
+    Each stratum contributes one measurement per quantity, so the confidence bounds capture how unevenly
+    the cost is spread over the image. Time assumes perfect scaling over `workers`. Memory is the peak of
+    this process, plus that of one worker process started to trace a few paths for each worker process
+    (threads share this process's memory).
+    """
+
+    build_start = time.perf_counter()
+    if isinstance(world, HittableList):
+        world.build()
+    build_seconds = time.perf_counter() - build_start
+
+    samples = max(1, min(samples, cam.samples_per_pixel))
+    path_seconds: list[float] = []
+    path_rays: list[float] = []
+    pixels = stratified_pixels(cam.image_width, cam.image_height, pixel_count)
+    for i, j in pixels:
+        rays_before = settings.stats.rays
+        start = time.perf_counter()
+        for _ in range(samples):
+            cam.ray_color(cam.rand_pixel_ray(i, j), cam.max_depth, world)
+        path_seconds.append((time.perf_counter() - start) / samples)
+        path_rays.append((settings.stats.rays - rays_before) / samples)
+
+    paths = cam.image_width * cam.image_height * cam.samples_per_pixel
+    seconds = tuple(build_seconds + t * paths / workers for t in mean_bounds(path_seconds))
+    rays = tuple(r * paths for r in mean_bounds(path_rays))
+
+    memory = rss_bytes()
+    if workers > 1 and cam.tuned("backend") != "thread":
+        # every worker process holds its own copy of the scene besides this one; threads share this process's
+        memory += workers * worker_rss_bytes(cam, world, pixels[:WORKER_PIXELS])
+
+    return RenderEstimate(pixels=cam.image_width * cam.image_height, samples=cam.samples_per_pixel,
+                          seconds=seconds, rays=rays, memory_bytes=memory, build_seconds=build_seconds,
+                          workers=workers, sampled_pixels=len(path_seconds), sampled_paths=len(path_seconds) * samples)
@@ -0,0 +1,206 @@
+from math import inf
+
+import settings
+from utils import Ray
+from hittable import Hittable, AABB
+
+
+def split_large(objects: list[Hittable], large_factor: float = 8.0) -> tuple[list[Hittable], list[Hittable]]:
+    """
+    Returns the objects whose bounding box extent is more than `large_factor` times the median extent
+    (such as the ground sphere) and the others.
+    """
+
+    extents = sorted(max(b[1] - b[0], b[3] - b[2], b[5] - b[4]) for b in (o.bounding_box.bounds for o in objects))
+    limit = large_factor * extents[len(extents) // 2] if extents else inf
+    large: list[Hittable] = []
+    small: list[Hittable] = []
+    for obj in objects:
+        b = obj.bounding_box.bounds
+        (large if max(b[1] - b[0], b[3] - b[2], b[5] - b[4]) > limit else small).append(obj)
+    return large, small
+
+
+class Grid(Hittable):
+    """
+    Uniform grid acceleration structure, an alternative to `BVH_Tree` for scenes of evenly spread, similarly
+    sized objects such as the final render's sphere field.
+
+    The grid covers the bounding box of the scene's ordinary objects with about `density` cells per object
+    (Cleary and Wyvill's heuristic: the cells are as close to cubes as the box allows). Each cell lists the
+    objects whose bounding boxes overlap it, and rays walk the cells they pierce in order with a 3D-DDA
+    (Amanatides and Woo), stopping at the first cell whose far side lies beyond the closest hit.
+
+    Objects much larger than the typical object (more than `large_factor` times the median bounding box
+    extent, such as the ground sphere) would stretch the grid over mostly empty space and land in every
+    cell, so they are kept aside and tested against every ray first. With `two_level` set, cells holding
+    more than `max_cell_objects` objects get a grid of their own, which adapts the resolution to clusters.
+    """
+
+    def __init__(self, objects: list[Hittable], density: float = 4.0, large_factor: float = 8.0,
+                 two_level: bool = False, max_cell_objects: int = 8) -> None:
+        self.large, small = split_large(objects, large_factor)
+
+        x0 = y0 = z0 = inf
+        x1 = y1 = z1 = -inf
+        for obj in small:
+            b = obj.bounding_box.bounds
+            x0, x1 = min(x0, b[0]), max(x1, b[1])
+            y0, y1 = min(y0, b[2]), max(y1, b[3])
+            z0, z1 = min(z0, b[4]), max(z1, b[5])
+        self.bounds: tuple[float, ...] = (x0, x1, y0, y1, z0, z1)
+        self.bbox = AABB.from_bounds(*self.bounds)
+        for obj in self.large:
+            self.bbox = AABB.merge(self.bbox, obj.bounding_box)
+
+        if not small:
+            self.res = (0, 0, 0)
+            self.cells: list = []
+            return
+
+        # cells per unit length such that there are about `density` cells per object
+        sizes = [max(x1 - x0, 1e-9), max(y1 - y0, 1e-9), max(z1 - z0, 1e-9)]
+        volume = max(sizes[0] * sizes[1] * sizes[2], 1e-12)
+        per_unit = (density * len(small) / volume) ** (1.0 / 3.0)
+        self.res = tuple(max(1, min(256, round(s * per_unit))) for s in sizes)
+        nx, ny, nz = self.res
+        self.cell_size: tuple[float, ...] = (sizes[0] / nx, sizes[1] / ny, sizes[2] / nz)
+
+        cells: list = [None] * (nx * ny * nz)
+        for obj in small:
+            i0, j0, k0 = self.cell_of(*obj.bounding_box.bounds[0::2])
+            i1, j1, k1 = self.cell_of(*obj.bounding_box.bounds[1::2])
+            for k in range(k0, k1 + 1):
+                for j in range(j0, j1 + 1):
+                    for i in range(i0, i1 + 1):
+                        idx = i + nx * (j + ny * k)
+                        if cells[idx] is None:
+                            cells[idx] = []
+                        cells[idx].append(obj)
+
+        for idx, cell in enumerate(cells):
+            if cell is None:
+                continue
+            if two_level and len(cell) > max_cell_objects:
+                # a nested grid resolves the cluster; every object in it counts as ordinary
+                cells[idx] = Grid(cell, density, large_factor=inf)
+            else:
+                cells[idx] = tuple(cell)
+        self.cells = cells
+
+    @property
+    def bounding_box(self) -> AABB:
+        return self.bbox
+
+    def cell_of(self, x: float, y: float, z: float) -> tuple[int, int, int]:
+        """Returns the indices of the cell containing a point, clamped to the grid."""
+
+        nx, ny, nz = self.res
+        return (min(max(int((x - self.bounds[0]) / self.cell_size[0]), 0), nx - 1),
+                min(max(int((y - self.bounds[2]) / self.cell_size[1]), 0), ny - 1),
+                min(max(int((z - self.bounds[4]) / self.cell_size[2]), 0), nz - 1))
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        """
+        Returns the distance to and primitive of the closest intersection of the ray, walking the grid cells
+        it pierces front to back.
+        """
+
+        closest = None
+        for obj in self.large:
+            found = obj.intersect(_r, t_min, t_max)
+            if found is not None:
+                t_max = found[0]
+                closest = found
+        if not self.cells:
+            return closest
+
+        # clip the ray to the grid's box
+        b = self.bounds
+        ox, oy, oz = _r.orig
+        ix, iy, iz = _r.inv_dir
+        sx, sy, sz = _r.sign
+        t_enter, t_exit = t_min, t_max
+        for lo, hi in (((b[sx] - ox) * ix, (b[sx ^ 1] - ox) * ix),
+                       ((b[2 + sy] - oy) * iy, (b[3 - sy] - oy) * iy),
+                       ((b[4 + sz] - oz) * iz, (b[5 - sz] - oz) * iz)):
+            if lo > t_enter:
+                t_enter = lo
+            if hi < t_exit:
+                t_exit = hi
+        if t_exit <= t_enter:
+            return closest
+
+        d = _r.dir
+        nx, ny, nz = self.res
+        cdx, cdy, cdz = self.cell_size
+        i, j, k = self.cell_of(ox + t_enter * d.x, oy + t_enter * d.y, oz + t_enter * d.z)
+
+        # distance along the ray to the next cell boundary on each axis, and between boundaries
+        if d.x > 0:
+            step_i, next_x, delta_x, stop_i = 1, (b[0] + (i + 1) * cdx - ox) * ix, cdx * ix, nx
+        elif d.x < 0:
+            step_i, next_x, delta_x, stop_i = -1, (b[0] + i * cdx - ox) * ix, -cdx * ix, -1
+        else:
+            step_i, next_x, delta_x, stop_i = 0, inf, inf, -1
+        if d.y > 0:
+            step_j, next_y, delta_y, stop_j = 1, (b[2] + (j + 1) * cdy - oy) * iy, cdy * iy, ny
+        elif d.y < 0:
+            step_j, next_y, delta_y, stop_j = -1, (b[2] + j * cdy - oy) * iy, -cdy * iy, -1
+        else:
+            step_j, next_y, delta_y, stop_j = 0, inf, inf, -1
+        if d.z > 0:
+            step_k, next_z, delta_z, stop_k = 1, (b[4] + (k + 1) * cdz - oz) * iz, cdz * iz, nz
+        elif d.z < 0:
+            step_k, next_z, delta_z, stop_k = -1, (b[4] + k * cdz - oz) * iz, -cdz * iz, -1
+        else:
+            step_k, next_z, delta_z, stop_k = 0, inf, inf, -1
+
+        cells = self.cells
+        stride_j, stride_k = nx, nx * ny
+        idx = i + stride_j * j + stride_k * k
+        visits = 0
+        while True:
+            visits += 1
+            cell = cells[idx]
+            if cell is not None:
+                if type(cell) is tuple:
+                    for obj in cell:
+                        found = obj.intersect(_r, t_min, t_max)
+                        if found is not None:
+                            t_max = found[0]
+                            closest = found
+                else:
+                    found = cell.intersect(_r, t_min, t_max)
+                    if found is not None:
+                        t_max = found[0]
+                        closest = found
+
+            # step into the neighbouring cell across the nearest boundary
+            if next_x <= next_y and next_x <= next_z:
+                cell_exit = next_x
+                i += step_i
+                if i == stop_i:
+                    break
+                idx += step_i
+                next_x += delta_x
+            elif next_y <= next_z:
+                cell_exit = next_y
+                j += step_j
+                if j == stop_j:
+                    break
+                idx += step_j * stride_j
+                next_y += delta_y
+            else:
+                cell_exit = next_z
+                k += step_k
+                if k == stop_k:
+                    break
+                idx += step_k * stride_k
+                next_z += delta_z
+            # objects of the cells ahead cannot be closer than a hit inside the cell just left
+            if t_max <= cell_exit or t_exit <= cell_exit:
+                break
+
+        settings.stats.count += visits
+        return closest
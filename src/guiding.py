@@ -0,0 +1,171 @@
+import math
+
+from utils import Vector, Point, RGB, dot, cross, normalize, rand_float
+
+
+class GuidingField:
+    """
+    Path guiding: a learned estimate of the direction light arrives from at each region of the scene, used to
+    sample scattered directions towards where light actually comes from.
+
+    Space is hashed into cubic cells of side `cell_size`, and each cell learns one von Mises-Fisher lobe (a
+    Gaussian-like distribution of directions around a mean direction) fitted to the light arriving at the
+    cell. While `learning` is set, `Camera.shade_guided` adds every estimate of the light arriving along a
+    scattered direction, divided by the density that direction was sampled with, to the statistics of the
+    cell: the weighted sum of the directions and the sum of the weights. `update` then fits the lobes of the cells that
+    received at least `min_samples` samples: they point along the mean direction, and are the sharper the
+    closer the directions agree. A fraction `uniform_fraction` of the guided directions is drawn uniformly, so
+    that no direction has zero density.
+
+    A single lobe per cell is far more robust to the few, very bright samples that find a small light than
+    a directional histogram, whose bins a handful of such samples decide; it suits scenes whose light mostly
+    arrives from one region, such as a room lit by a lamp.
+
+    Guided directions are combined with the material's own sampling by one-sample multiple importance
+    sampling: with probability `guide_fraction` (scaled by the fuzz of `Metal`s) the direction is drawn from
+    the cell's lobe, and in either case the sample is weighted by the mixture of both densities.
+    """
+
+    # sharpest lobe fitted, to keep lobes fitted to few samples from collapsing to a point
+    MAX_CONCENTRATION: float = 50.0
+    # number of nested grids, each `COARSENING` times coarser than the previous; hits in cells without enough
+    # samples of their own are guided by the lobe of the finest enclosing cell that has enough
+    LEVELS: int = 2
+    COARSENING: int = 4
+
+    def __init__(self, cell_size: float = 0.5, min_samples: int = 32, uniform_fraction: float = 0.2,
+                 guide_fraction: float = 0.5) -> None:
+        self.cell_size = cell_size
+        self.min_samples = min_samples
+        self.uniform_fraction = uniform_fraction
+        self.guide_fraction = guide_fraction
+        self.learning = False
+        # per cell: weighted sum of the directions (x, y, z), sum of the weights, and number of samples
+        self.sums: dict[tuple[int, int, int, int, int], list[float]] = {}
+        # per cell: lobe (mean direction, concentration, normalization of the density), built by `update`
+        self.lobes: dict[tuple[int, int, int, int, int], tuple[Vector, float, float]] = {}
+
+    def stats(self) -> str:
+        finest = [key for key in self.sums if key[-1] == 0]
+        return (f"guiding: {len(finest)} cells learned, {sum(key[-1] == 0 for key in self.lobes)} guiding, "
+                f"{sum(self.sums[key][4] for key in finest)} samples")
+
+    def cell(self, p: Point, n: Vector, level: int = 0) -> tuple[int, int, int, int, int]:
+        """
+        Returns the key of the cell of the hit at `p` with normal `n`, at the `level`-th coarser grid. Hits
+        facing different ways (by the dominant axis of the normal) are kept apart, since light arriving on
+        one side of an object is of no use on the other.
+        """
+
+        s = self.cell_size * self.COARSENING ** level
+        ax, ay, az = abs(n.x), abs(n.y), abs(n.z)
+        if ax >= ay and ax >= az:
+            facing = 0 if n.x > 0 else 1
+        elif ay >= az:
+            facing = 2 if n.y > 0 else 3
+        else:
+            facing = 4 if n.z > 0 else 5
+        return (math.floor(p.x / s), math.floor(p.y / s), math.floor(p.z / s), facing, level)
+
+    def record(self, p: Point, n: Vector, d: Vector, radiance: RGB, pdf: float) -> None:
+        """
+        Adds the estimate `radiance` of the light arriving at the hit at `p` with normal `n` from direction
+        `d`, sampled with density `pdf`.
+        """
+
+        if pdf <= 0.0:
+            return
+        # luminance of the estimate
+        weight = (0.2126 * radiance.x + 0.7152 * radiance.y + 0.0722 * radiance.z) / pdf
+        length = d.length()
+        wx, wy, wz = weight * d.x / length, weight * d.y / length, weight * d.z / length
+        for level in range(self.LEVELS):
+            key = self.cell(p, n, level)
+            sums = self.sums.get(key)
+            if sums is None:
+                sums = self.sums[key] = [0.0, 0.0, 0.0, 0.0, 0]
+            sums[0] += wx
+            sums[1] += wy
+            sums[2] += wz
+            sums[3] += weight
+            sums[4] += 1
+
+    def update(self) -> None:
+        """Fits the lobes of the cells to their samples so far."""
+
+        for key, (x, y, z, total, count) in self.sums.items():
+            length = math.sqrt(x * x + y * y + z * z)
+            if count < self.min_samples or total <= 0.0 or length <= 0.0:
+                continue
+            # mean resultant length, and the usual approximation of the concentration it implies
+            r = min(length / total, 0.999)
+            kappa = min(r * (3.0 - r * r) / (1.0 - r * r), self.MAX_CONCENTRATION)
+            norm = kappa / (2 * math.pi * (1.0 - math.exp(-2.0 * kappa)))
+            self.lobes[key] = (Vector(x / length, y / length, z / length), kappa, norm)
+
+    def distribution(self, p: Point, n: Vector) -> tuple[Vector, float, float] | None:
+        """
+        Returns the lobe of the finest cell of the hit at `p` with normal `n` that guides, or `None` if none
+        does yet.
+        """
+
+        for level in range(self.LEVELS):
+            lobe = self.lobes.get(self.cell(p, n, level))
+            if lobe is not None:
+                return lobe
+        return None
+
+    def sample(self, lobe: tuple[Vector, float, float]) -> Vector:
+        """Returns a unit direction drawn from `lobe`, mixed with the uniform distribution."""
+
+        if rand_float() < self.uniform_fraction:
+            z = 1.0 - 2.0 * rand_float()
+            phi = 2 * math.pi * rand_float()
+            r = math.sqrt(max(0.0, 1.0 - z * z))
+            return Vector(r * math.cos(phi), r * math.sin(phi), z)
+
+        mean, kappa, _ = lobe
+        # cosine of the angle to the mean direction, by inverting its distribution
+        w = 1.0 + math.log(rand_float() * (1.0 - math.exp(-2.0 * kappa)) + math.exp(-2.0 * kappa)) / kappa
+        w = max(-1.0, min(w, 1.0))
+        phi = 2 * math.pi * rand_float()
+        s = math.sqrt(1.0 - w * w)
+        # orthonormal basis around the mean direction
+        a = Vector(1, 0, 0) if abs(mean.x) < 0.9 else Vector(0, 1, 0)
+        t = normalize(cross(a, mean))
+        b = cross(mean, t)
+        return w * mean + (s * math.cos(phi)) * t + (s * math.sin(phi)) * b
+
+    def pdf(self, lobe: tuple[Vector, float, float], d: Vector) -> float:
+        """Returns the solid angle density of direction `d` under `lobe` mixed with the uniform distribution."""
+
+        mean, kappa, norm = lobe
+        cos = dot(mean, d) / d.length()
+        return ((1.0 - self.uniform_fraction) * norm * math.exp(kappa * (cos - 1.0)) +
+                self.uniform_fraction / (4 * math.pi))
+
+
+def fuzz_pdf(reflected: Vector, fuzz: float, d: Vector) -> float:
+    """
+    Returns the solid angle density of the directions scattered by `Metal` (`reflected` + `fuzz` times a
+    uniform unit vector, `reflected` being of unit length) at direction `d`.
+    """
+
+    if fuzz <= 0.0:
+        return 0.0
+    d = d / d.length()
+    # points t * d on the sphere of radius `fuzz` around the tip of `reflected`
+    b = dot(d, reflected)
+    disc = b * b - 1.0 + fuzz * fuzz
+    if disc <= 0.0:
+        return 0.0
+    root = math.sqrt(disc)
+    density = 0.0
+    for t in (b - root, b + root):
+        if t <= 0.0:
+            continue
+        # area density 1 / (4 pi fuzz^2), converted to solid angle by t^2 / |cos| at the sphere's surface
+        cos = abs(t - b) / fuzz
+        if cos > 1e-9:
+            density += t * t / (4 * math.pi * fuzz * fuzz * cos)
+    return density
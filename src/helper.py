@@ -1,16 +1,67 @@
 import random
 import math
+import threading
 
 # utility functions
 
 def deg_to_rad(degrees: float) -> float:
     return degrees * math.pi / 180.0
 
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_GOLDEN64 = 0x9E3779B97F4A7C15
+
+def mix64(z: int) -> int:
+    """SplitMix64 finalizer: scrambles a 64-bit integer into a statistically independent one."""
+
+    z = (z + _GOLDEN64) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+class SampleStream:
+    """
+    Counter-based random number stream. The n-th number of the stream is a hash of the stream key and n,
+    so a stream depends only on the key it was created with, never on what was drawn elsewhere before.
+    """
+
+    __slots__ = ("key", "counter")
+
+    def __init__(self, key: int) -> None:
+        self.key = key
+        self.counter = 0
+
+    def random(self) -> float:
+        """Returns the next real number in [0, 1)."""
+
+        self.counter += 1
+        z = (self.key + self.counter * _GOLDEN64) & _MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return ((z ^ (z >> 31)) >> 11) * 1.1102230246251565e-16  # top 53 bits / 2**53
+
+def sample_stream(seed: int, pixel: int, sample: int) -> SampleStream:
+    """Returns the stream of random numbers for sample number `sample` of pixel number `pixel`."""
+
+    return SampleStream(mix64(mix64(mix64(seed & _MASK64) ^ pixel) ^ sample))
+
+class _StreamState(threading.local):
+    # stream drawn from by `rand_float` in this thread; the global `random` module is used when it is `None`
+    stream: SampleStream | None = None
+
+# every thread draws from its own stream, so render threads never share one
+_state = _StreamState()
+
+def use_stream(stream: SampleStream | None) -> None:
+    """Makes `rand_float` in the calling thread draw from `stream` (or from the global `random` module if `None`)."""
+
+    _state.stream = stream
+
 def rand_float(lower_b: float = None, upper_b: float = None) -> float:
     '''returns a random real number in [lower_b, upper_b) if lower_b and upper_b specified'''
     '''otherwise returns random real number in [0, 1)'''
 
-    random_float = random.random()
+    stream = _state.stream
+    random_float = stream.random() if stream is not None else random.random()
     if lower_b is not None and upper_b is not None:
         return lower_b + (upper_b - lower_b) * random_float
     else:
@@ -14,15 +14,28 @@ class HitRecord:
     - `mat`: material type of surface (`Material`)
     - `t`: time at which ray intersects object (`float`)
     - `front_face`: whether surface is hit from outside (`bool`)
+    - `primitive`: the object hit (`Hittable`), which computes the surface coordinates `uv` on first use
+    - `footprint`: width of the area seen through a pixel at the hit, in world units, if known (`float`)
     """
 
     def __init__(self, p: Point = None, normal: Vector = None, mat=None, t: float = None,
-                 front_face: bool = None) -> None:
+                 front_face: bool = None, primitive: 'Hittable' = None) -> None:
         self.p = p
         self.normal = normal
         self.mat = mat
         self.t = t
         self.front_face = front_face
+        self.primitive = primitive
+        self.footprint: float = 0.0
+        self._uv: tuple[float, float] | None = None
+
+    @property
+    def uv(self) -> tuple[float, float]:
+        """Surface (u, v) coordinates of the hit, in [0, 1]. Only textured materials need them."""
+
+        if self._uv is None:
+            self._uv = self.primitive.surface_uv(self.p) if self.primitive is not None else (0.0, 0.0)
+        return self._uv
 
     def set_face_normal(self, _r: Ray, _outward_normal: Vector) -> None:
         """
@@ -44,21 +57,58 @@ class HitRecord:
         self.mat = other.mat
         self.t = other.t
         self.front_face = other.front_face
+        self.primitive = other.primitive
+        self.footprint = other.footprint
+        self._uv = other._uv
 
     def __str__(self) -> str:
         return f"p = {self.p}, normal = {self.normal}, mat = {self.mat}, t = {self.t}, front_face = {self.front_face}"
 
 
 class Hittable(ABC):
-    """Abstract base class representing any object in the scene which is \"hittable\" by the ray."""
+    """
+    Abstract base class representing any object in the scene which is \"hittable\" by the ray.
+
+    Closest-hit queries are split in two: `intersect` only finds the distance to the closest intersection and
+    the primitive hit, which is all a search needs, and `hit_record` then builds the full `HitRecord` (point,
+    normal, face orientation, material) once, for the intersection that was finally kept.
+    """
 
     @abstractmethod
-    def hit(self, _r: Ray, ray_t: Interval) -> HitRecord | None:
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, 'Hittable'] | None:
         """
-        TODO: Change after refactoring `hit` to return `HitRecord` object.
+        Returns the distance `t` to the closest intersection of the ray with this object within
+        (`t_min`, `t_max`) along with the primitive intersected, or `None` if there is none.
         """
         pass
 
+    def hit_record(self, _r: Ray, t: float) -> HitRecord:
+        """
+        Returns the hit record of the ray's intersection with this primitive at distance `t`.
+        Only primitives implement this; aggregates return their primitives from `intersect`.
+        """
+        raise NotImplementedError(f"{type(self).__name__} is not a primitive")
+
+    def surface_uv(self, p: Point) -> tuple[float, float]:
+        """Returns the surface (u, v) coordinates of point `p` on this primitive."""
+        return 0.0, 0.0
+
+    @property
+    def uv_scale(self) -> float:
+        """Returns the world length spanned by one unit of surface coordinates, for filtering textures."""
+        return 1.0
+
+    def hit(self, _r: Ray, t_min: float, t_max: float) -> HitRecord | None:
+        """
+        Returns the hit record of the closest intersection of the ray with this object within
+        (`t_min`, `t_max`), or `None` if there is none.
+        """
+        found = self.intersect(_r, t_min, t_max)
+        if found is None:
+            return None
+        t, primitive = found
+        return primitive.hit_record(_r, t)
+
     @property
     @abstractmethod
     def bounding_box(self) -> AABB:
@@ -7,14 +7,29 @@ from hittable import Hittable, HitRecord, AABB
 class HittableList(Hittable):
     """
     Represents the scene itself as a list of all `Hittable` objects within it.
+
+    The list accelerates itself: the first `hit` query after the list has changed builds (and caches) an
+    acceleration structure over its objects, of the kind named by `accelerator`. Lists with at most
+    `LINEAR_THRESHOLD` objects are scanned linearly instead.
     """
 
+    # number of objects at or below which a linear closest-hit scan is cheaper than building a BVH
+    LINEAR_THRESHOLD: int = 4
+    # acceleration structure built by `build`: "bvh" (`BVH_Tree`), "lbvh" (Morton code `LBVH`), "lazy" (`LazyBVH`,
+    # split as rays reach its nodes), "grid" or "grid2" (two-level `Grid`)
+    accelerator: str = "bvh"
+    ACCELERATORS: tuple[str, ...] = ("bvh", "lbvh", "lazy", "grid", "grid2")
+
     def __init__(self, object: Hittable = None) -> None:
         self.bbox: AABB = AABB()
         self.objects: list[Hittable] = []
+        self.accel: Hittable | None = None  # cached acceleration structure, `None` when dirty
         if isinstance(object, Hittable):
             self.add(object)
 
+    def __len__(self) -> int:
+        return len(self.objects)
+
     @property
     def bounding_box(self) -> AABB:
         """Returns the bounding box of the entire scene."""
@@ -26,6 +41,27 @@ class HittableList(Hittable):
 
         self.objects.append(object)
         self.bbox = AABB.merge(self.bbox, object.bounding_box)
+        self.accel = None
+
+    def extend(self, objects: list[Hittable]) -> None:
+        """
+        Adds several objects to the scene, merging their bounding boxes in a single pass.
+        """
+
+        objects = list(objects)
+        if not objects:
+            return
+
+        x0, x1, y0, y1, z0, z1 = self.bbox.bounds
+        for object in objects:
+            b = object.bounding_box.bounds
+            x0, x1 = min(x0, b[0]), max(x1, b[1])
+            y0, y1 = min(y0, b[2]), max(y1, b[3])
+            z0, z1 = min(z0, b[4]), max(z1, b[5])
+
+        self.objects.extend(objects)
+        self.bbox = AABB.from_bounds(x0, x1, y0, y1, z0, z1)
+        self.accel = None
 
     def clear(self) -> None:
         """
@@ -33,25 +69,54 @@ class HittableList(Hittable):
         """
 
         self.objects.clear()
+        self.bbox = AABB()
+        self.accel = None
 
-    def hit(self, _r: Ray, ray_t: Interval) -> HitRecord | None:
+    def build(self) -> Hittable | None:
         """
-        Returns true if the ray hits any object in the scene.
+        Builds the acceleration structure for the current objects and caches it until the list changes.
+        Returns `None` if the list is small enough to be scanned linearly.
+        """
+
+        if len(self.objects) > self.LINEAR_THRESHOLD:
+            # imported here since `bvh` itself depends on this module
+            if self.accelerator == "bvh":
+                from bvh import BVH_Tree
+                self.accel = BVH_Tree(self)
+            elif self.accelerator == "lbvh":
+                from lbvh import LBVH
+                self.accel = LBVH(self)
+            elif self.accelerator == "lazy":
+                from lazy_bvh import LazyBVH
+                self.accel = LazyBVH(self)
+            elif self.accelerator in ("grid", "grid2"):
+                from grid import Grid
+                self.accel = Grid(self.objects, two_level=self.accelerator == "grid2")
+            else:
+                raise ValueError(f"Unknown acceleration structure: {self.accelerator}")
+        else:
+            self.accel = None
+        return self.accel
 
-        TODO: Update to store hit record information from calling individual hittable `hit` function
-        and then return it as part of a tuple
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
         """
+        Returns the distance to and primitive of the closest object hit by the ray within (`t_min`, `t_max`),
+        or `None` if nothing is hit.
+        """
+
+        accel = self.accel
+        if accel is None and len(self.objects) > self.LINEAR_THRESHOLD:
+            accel = self.build()
+        if accel is not None:
+            return accel.intersect(_r, t_min, t_max)
+
+        closest = None
+        t_closest: float = t_max
+        for object in self.objects:
+            # pass in t_closest for processing only objects that are closer than previously found objects
+            found = object.intersect(_r, t_min, t_closest)
+            if found is not None:
+                t_closest = found[0]
+                closest = found
 
-        hit_anything: bool = False
-        t_closest: float = ray_t.upper_b
-        hit_anything = True
-        rec = self.objects[0].hit(_r, Interval(ray_t.lower_b, t_closest)) or None
-        # for object in self.objects:
-        #     # pass in t_closest for processing only objects that are closer than previously found objects
-        #     temp_rec = object.hit(_r, Interval(ray_t.lower_b, t_closest)) or None
-        #     if temp_rec is not None:
-        #         hit_anything = True
-        #         t_closest = temp_rec.t
-        #         rec = temp_rec
-        #
-        return rec
+        return closest
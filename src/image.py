@@ -0,0 +1,193 @@
+import io
+import math
+import zlib
+import struct
+from array import array
+
+from utils import RGB, write_color
+
+
+class Accumulator:
+    """
+    Accumulation buffer holding, for every pixel, the sum of its sample colors over `samples_per_pixel`
+    samples. Unlike a quantized image, it keeps full precision and can be saved, patched and reloaded.
+    """
+
+    MAGIC = b"PYRTACC1"
+    HEADER = struct.Struct("<8sIII")
+
+    def __init__(self, width: int, height: int, samples_per_pixel: int) -> None:
+        self.width = width
+        self.height = height
+        self.samples_per_pixel = samples_per_pixel
+        self.data: array = array("d", bytes(8 * 3 * width * height))
+
+    def set_row(self, j: int, row: list[RGB], i0: int = 0) -> None:
+        """Stores the summed colors of `row`, whose first pixel is (i0, j)."""
+
+        data = self.data
+        k = 3 * (j * self.width + i0)
+        for c in row:
+            data[k] = c.x
+            data[k + 1] = c.y
+            data[k + 2] = c.z
+            k += 3
+
+    def add_row(self, j: int, row: list[RGB], i0: int = 0) -> None:
+        """Adds the summed colors of `row`, whose first pixel is (i0, j), to those already stored."""
+
+        data = self.data
+        k = 3 * (j * self.width + i0)
+        for c in row:
+            data[k] += c.x
+            data[k + 1] += c.y
+            data[k + 2] += c.z
+            k += 3
+
+    def pixel(self, i: int, j: int) -> RGB:
+        """Returns the summed color of pixel (i, j)."""
+
+        k = 3 * (j * self.width + i)
+        return RGB(self.data[k], self.data[k + 1], self.data[k + 2])
+
+    def write_ppm(self, out) -> None:
+        """Writes the averaged, gamma-corrected buffer to stream `out` as a P3 PPM image."""
+
+        out.write(f"P3\n{self.width} {self.height}\n255\n")
+        for j in range(self.height):
+            for i in range(self.width):
+                write_color(out, self.pixel(i, j), self.samples_per_pixel)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.width, self.height, self.samples_per_pixel))
+            self.data.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> 'Accumulator':
+        with open(path, "rb") as f:
+            magic, width, height, spp = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(f"{path} is not an accumulation buffer")
+            acc = cls(width, height, spp)
+            acc.data = array("d")
+            acc.data.fromfile(f, 3 * width * height)
+        return acc
+
+
+def read_ppm(path: str) -> tuple[int, int, list[str]]:
+    """
+    Reads a P3 PPM image as written by `Camera.render` and returns its width, height and the list of
+    its pixel lines (`"r g b"`), in scanline order.
+    """
+
+    with open(path) as f:
+        tokens = f.read().split()
+    if tokens[0] != "P3":
+        raise ValueError(f"{path} is not a P3 PPM image")
+    width, height = int(tokens[1]), int(tokens[2])
+    values = tokens[4:]
+    pixels = [f"{values[k]} {values[k + 1]} {values[k + 2]}" for k in range(0, 3 * width * height, 3)]
+    return width, height, pixels
+
+
+def write_ppm(path: str, width: int, height: int, pixels: list[str]) -> None:
+    """Writes pixel lines as returned by `read_ppm` to a P3 PPM image."""
+
+    with open(path, "w") as f:
+        f.write(f"P3\n{width} {height}\n255\n")
+        for p in pixels:
+            f.write(p + "\n")
+
+
+def patch_ppm(pixels: list[str], width: int, crop: tuple[int, int, int, int], rows: list[list[RGB]],
+              samples_per_pixel: int) -> None:
+    """
+    Replaces the pixels of the window `crop = (x0, y0, x1, y1)` (exclusive upper bounds) in pixel lines
+    `pixels` with the summed colors `rows`, one list per scanline of the window.
+    """
+
+    x0, y0, x1, y1 = crop
+    for j, row in zip(range(y0, y1), rows):
+        for i, pixel_color in zip(range(x0, x1), row):
+            line = io.StringIO()
+            write_color(line, pixel_color, samples_per_pixel)
+            pixels[j * width + i] = line.getvalue().rstrip("\n")
+
+
+def encode_row(row: list[RGB], samples_per_pixel: int) -> bytes:
+    """
+    Returns the 8-bit RGB bytes of a scanline of summed colors, with the same averaging, gamma and
+    quantization as `write_color`.
+    """
+
+    scale = 1.0 / samples_per_pixel
+    out = bytearray(3 * len(row))
+    k = 0
+    for c in row:
+        for v in (c.x, c.y, c.z):
+            v = math.sqrt(v * scale)
+            out[k] = int(256 * (0.0 if v < 0.0 else 0.999 if v > 0.999 else v))
+            k += 1
+    return bytes(out)
+
+
+class PPMStream:
+    """Writes a binary (P6) PPM image to the binary stream `out` a band of scanlines at a time."""
+
+    def __init__(self, out, width: int, height: int) -> None:
+        self.out = out
+        out.write(f"P6\n{width} {height}\n255\n".encode())
+
+    def write_rows(self, data: bytes) -> None:
+        """Appends scanlines given as consecutive rows of 8-bit RGB bytes."""
+
+        self.out.write(data)
+
+    def close(self) -> None:
+        self.out.flush()
+
+
+class PNGStream:
+    """
+    Writes an 8-bit RGB PNG image to the binary stream `out` a band of scanlines at a time. Scanlines are fed
+    through a single incremental `zlib` compressor, and compressed data is written out in IDAT chunks of
+    about `chunk_size` bytes, so memory use does not grow with the image.
+    """
+
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+    def __init__(self, out, width: int, height: int, level: int = 6, chunk_size: int = 1 << 16) -> None:
+        self.out = out
+        self.width = width
+        self.chunk_size = chunk_size
+        self.compressor = zlib.compressobj(level)
+        self.pending = bytearray()
+        out.write(self.SIGNATURE)
+        # 8 bits per channel, color type 2 (RGB), default compression and filter method, no interlacing
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def chunk(self, kind: bytes, data: bytes) -> None:
+        self.out.write(struct.pack(">I", len(data)) + kind + data)
+        self.out.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, data: bytes) -> None:
+        """Appends scanlines given as consecutive rows of 8-bit RGB bytes."""
+
+        stride = 3 * self.width
+        filtered = bytearray()
+        for k in range(0, len(data), stride):
+            # filter type 0: the scanline is stored as is
+            filtered.append(0)
+            filtered += data[k:k + stride]
+        self.pending += self.compressor.compress(bytes(filtered))
+        while len(self.pending) >= self.chunk_size:
+            self.chunk(b"IDAT", bytes(self.pending[:self.chunk_size]))
+            del self.pending[:self.chunk_size]
+
+    def close(self) -> None:
+        self.pending += self.compressor.flush()
+        if self.pending:
+            self.chunk(b"IDAT", bytes(self.pending))
+        self.chunk(b"IEND", b"")
+        self.out.flush()
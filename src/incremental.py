@@ -0,0 +1,335 @@
+"""
+Incremental re-rendering after scene edits. While rendering, every tile of the image records which objects
+its paths hit and which BVH nodes its rays entered, as two bitsets. After an object is moved, resized or
+given another material, only the tiles whose paths can see the difference are traced again and merged into
+the previous accumulation buffer:
+
+- tiles that hit the object before the edit (its old look or position mattered to them), and
+- for a moved or resized object, tiles whose rays entered the smallest BVH node enclosing its new bounding
+  box. A ray that hits the object at its new position passes through that box before any hit it had before,
+  so it entered the node (and all the node's ancestors), whatever the traversal order.
+
+Objects much larger than the others (the ground sphere) are kept out of the tree and tested against every
+ray, as in `Grid`; otherwise the boxes near the root would span them and enclose every moved object.
+
+Node numbers only mean something for one tree, so the tree's topology is saved with the footprints and
+updates trace a tree of the same topology, refitted around the edited objects. Since tiles recorded before
+and after a refit entered boxes of different extents, each node keeps the intersection of all the boxes it
+has had for the containment test.
+
+Footprint file layout (little endian):
+
+    header    magic, width, height, tile size, node count, object count, large object count, digest of the
+              render settings
+    large     per large object: int32, its index
+    nodes     per node: 6 doubles, its box (x_min, x_max, ...); 3 int32, left, right, split axis, where a
+              child c >= 0 is node c and c < 0 is object ~c
+    objects   per object: 8-byte digest of its geometry, 8-byte digest of its material
+    tiles     per tile, in row-major order: bitset of nodes entered, bitset of objects hit
+"""
+import os
+import sys
+import struct
+import pickle
+import hashlib
+import multiprocessing
+
+import settings
+from utils import Ray, RGB
+from hittable import Hittable, AABB
+from bvh import BVH_Node, BVH_Tree
+from hittable_list import HittableList
+from grid import split_large
+from image import Accumulator
+from camera import Camera
+
+
+def object_digests(obj: Hittable) -> tuple[bytes, bytes]:
+    """Returns digests of the geometry and of the material of a sphere, to tell which edits were made to it."""
+
+    geometry = pickle.dumps((type(obj).__name__, obj.center.x, obj.center.y, obj.center.z, obj.radius))
+    return (hashlib.blake2b(geometry, digest_size=8).digest(),
+            hashlib.blake2b(pickle.dumps(obj.mat), digest_size=8).digest())
+
+
+def settings_digest(*values) -> bytes:
+    """Returns a digest of the settings that every pixel depends on (camera, sampling, lighting)."""
+
+    return hashlib.blake2b(pickle.dumps(values), digest_size=16).digest()
+
+
+def footprint_tree(objects: list[Hittable]) -> tuple[BVH_Tree, list[int]]:
+    """Returns a BVH over the objects that are not much larger than the others, and the indices of those that are."""
+
+    large, small = split_large(objects)
+    if not small:
+        large, small = [], objects
+    hit_list = HittableList()
+    hit_list.extend(small)
+    large_ids = {id(obj) for obj in large}
+    return BVH_Tree(hit_list, leaf_size=2), [k for k, obj in enumerate(objects) if id(obj) in large_ids]
+
+
+def refit_tree(objects: list[Hittable], children: list[tuple[int, int, int]]) -> BVH_Tree:
+    """
+    Returns a `BVH_Tree` over `objects` with the topology `children` (as saved in footprints, breadth-first)
+    and boxes fitted to the objects' current bounds.
+    """
+
+    tree = BVH_Tree.__new__(BVH_Tree)
+    nodes = [BVH_Node() for _ in children]
+    tree.root = nodes[0]
+    tree.root.depth = 1
+
+    def child(c: int) -> Hittable:
+        return nodes[c] if c >= 0 else objects[~c]
+
+    for node, (left, right, axis) in zip(nodes, children):
+        node.left, node.right, node.axis = child(left), child(right), axis
+        for c in (left, right):
+            if c >= 0:
+                nodes[c].depth = node.depth + 1
+    # children are numbered after their parents, so boxes are merged bottom-up in reverse order
+    for node in reversed(nodes):
+        node.bbox = AABB.merge(node.left.bounding_box, node.right.bounding_box)
+    return tree
+
+
+class Footprints:
+    """
+    Per-tile bitsets of the BVH nodes entered and objects hit by the paths of each `tile_size` square of
+    the image, with the tree topology and object digests they refer to.
+    """
+
+    MAGIC = b"PYRTFPT1"
+    HEADER = struct.Struct("<8sIIIIII16s")
+
+    def __init__(self, width: int, height: int, tile_size: int, digest: bytes, tree: BVH_Tree,
+                 objects: list[Hittable], large: list[int]) -> None:
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.digest = digest
+        self.large = large  # indices of the objects kept out of the tree
+        nodes = tree.interior_nodes()
+        node_index = {id(node): k for k, node in enumerate(nodes)}
+        object_index = {id(obj): k for k, obj in enumerate(objects)}
+
+        def encode(c: Hittable) -> int:
+            return node_index[id(c)] if isinstance(c, BVH_Node) else ~object_index[id(c)]
+
+        self.boxes: list[tuple[float, ...]] = [node.bbox.bounds for node in nodes]
+        self.children: list[tuple[int, int, int]] = [(encode(n.left), encode(n.right), n.axis) for n in nodes]
+        self.objects: list[tuple[bytes, bytes]] = [object_digests(obj) for obj in objects]
+        self.tiles: list[list[int]] = [[0, 0] for _ in range(self.tiles_x * self.tiles_y)]
+
+    @property
+    def tiles_x(self) -> int:
+        return (self.width + self.tile_size - 1) // self.tile_size
+
+    @property
+    def tiles_y(self) -> int:
+        return (self.height + self.tile_size - 1) // self.tile_size
+
+    def tile_window(self, tile: int) -> tuple[int, int, int, int]:
+        """Returns the pixel window (x0, y0, x1, y1) of a tile, exclusive upper bounds."""
+
+        t = self.tile_size
+        x0, y0 = (tile % self.tiles_x) * t, (tile // self.tiles_x) * t
+        return x0, y0, min(x0 + t, self.width), min(y0 + t, self.height)
+
+    def affected_tiles(self, objects: list[Hittable]) -> tuple[list[int], list[int]]:
+        """
+        Returns the tiles whose colors can be changed by the differences between `objects` and the objects
+        the footprints were recorded with (matched by position in the list), along with the edited objects.
+        """
+
+        node_mask = hit_mask = 0
+        edited = []
+        for k, (obj, (geometry, material)) in enumerate(zip(objects, self.objects)):
+            new_geometry, new_material = object_digests(obj)
+            if (new_geometry, new_material) == (geometry, material):
+                continue
+            edited.append(k)
+            hit_mask |= 1 << k
+            if new_geometry != geometry:
+                node = self.enclosing_node(obj.bounding_box.bounds)
+                if node is None:
+                    # a ray may now hit the object without entering the tree at all
+                    return list(range(len(self.tiles))), edited
+                node_mask |= 1 << node
+
+        return [t for t, (nodes, hits) in enumerate(self.tiles) if nodes & node_mask or hits & hit_mask], edited
+
+    def enclosing_node(self, b: tuple[float, ...]) -> int | None:
+        """Returns the node with the smallest box enclosing the bounds `b`, or `None` if none does."""
+
+        best, best_volume = None, None
+        for k, n in enumerate(self.boxes):
+            if n[0] <= b[0] and b[1] <= n[1] and n[2] <= b[2] and b[3] <= n[3] and n[4] <= b[4] and b[5] <= n[5]:
+                volume = (n[1] - n[0]) * (n[3] - n[2]) * (n[5] - n[4])
+                if best is None or volume < best_volume:
+                    best, best_volume = k, volume
+        return best
+
+    def refit(self, objects: list[Hittable]) -> BVH_Tree:
+        """
+        Returns the tree of the recorded topology over the edited `objects`, and shrinks each node's box
+        to its intersection with the refitted one, updating the object digests.
+        """
+
+        tree = refit_tree(objects, self.children)
+        for k, node in enumerate(tree.interior_nodes()):
+            a, b = self.boxes[k], node.bbox.bounds
+            self.boxes[k] = (max(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3]),
+                             max(a[4], b[4]), min(a[5], b[5]))
+        self.objects = [object_digests(obj) for obj in objects]
+        return tree
+
+    def save(self, path: str) -> None:
+        node_bytes = (len(self.boxes) + 7) // 8
+        object_bytes = (len(self.objects) + 7) // 8
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.width, self.height, self.tile_size, len(self.boxes),
+                                     len(self.objects), len(self.large), self.digest))
+            f.write(struct.pack(f"<{len(self.large)}i", *self.large))
+            for box, links in zip(self.boxes, self.children):
+                f.write(struct.pack("<6d3i", *box, *links))
+            for geometry, material in self.objects:
+                f.write(geometry + material)
+            for nodes, hits in self.tiles:
+                f.write(nodes.to_bytes(node_bytes, "little") + hits.to_bytes(object_bytes, "little"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Footprints':
+        with open(path, "rb") as f:
+            magic, width, height, tile_size, node_count, object_count, large_count, digest = \
+                cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(f"{path} is not a footprint file")
+            fp = cls.__new__(cls)
+            fp.width, fp.height, fp.tile_size, fp.digest = width, height, tile_size, digest
+            fp.large = list(struct.unpack(f"<{large_count}i", f.read(4 * large_count)))
+            fp.boxes, fp.children = [], []
+            for _ in range(node_count):
+                values = struct.unpack("<6d3i", f.read(60))
+                fp.boxes.append(values[:6])
+                fp.children.append(values[6:])
+            fp.objects = []
+            for _ in range(object_count):
+                raw = f.read(16)
+                fp.objects.append((raw[:8], raw[8:]))
+            node_bytes, object_bytes = (node_count + 7) // 8, (object_count + 7) // 8
+            fp.tiles = []
+            for _ in range(fp.tiles_x * fp.tiles_y):
+                raw = f.read(node_bytes + object_bytes)
+                fp.tiles.append([int.from_bytes(raw[:node_bytes], "little"), int.from_bytes(raw[node_bytes:], "little")])
+        return fp
+
+
+class FootprintRecorder(Hittable):
+    """
+    Traces rays through the large objects and then a BVH like `BVH_Node.intersect`, and collects in
+    `entered` the bits of the nodes whose boxes the rays entered, and in `hits` the bits of the objects they hit.
+    """
+
+    def __init__(self, tree: BVH_Tree, objects: list[Hittable], large: list[int]) -> None:
+        self.tree = tree
+        self.objects = objects
+        self.large = large
+        self.large_objects = [objects[k] for k in large]
+        # bits are keyed by object identity, so they are rebuilt rather than pickled
+        self.node_bit = {id(node): 1 << k for k, node in enumerate(tree.interior_nodes())}
+        self.object_bit = {id(obj): 1 << k for k, obj in enumerate(objects)}
+        self.entered = 0
+        self.hits = 0
+
+    def __reduce__(self):
+        return (FootprintRecorder, (self.tree, self.objects, self.large))
+
+    @property
+    def bounding_box(self) -> AABB:
+        box = self.tree.bounding_box
+        for obj in self.large_objects:
+            box = AABB.merge(box, obj.bounding_box)
+        return box
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        closest = None
+        for obj in self.large_objects:
+            found = obj.intersect(_r, t_min, t_max)
+            if found is not None:
+                t_max = found[0]
+                closest = found
+        found = self.visit(self.tree.root, _r, t_min, t_max) or closest
+        if found is not None:
+            self.hits |= self.object_bit[id(found[1])]
+        return found
+
+    def visit(self, node: BVH_Node, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        settings.stats.count += 1
+        if not node.bbox.hit(_r, t_min, t_max):
+            return None
+        self.entered |= self.node_bit[id(node)]
+
+        if node.ordered and _r.sign[node.axis]:
+            near, far = node.right, node.left
+        else:
+            near, far = node.left, node.right
+        visit = self.visit
+        hit_near = visit(near, _r, t_min, t_max) if type(near) is BVH_Node else near.intersect(_r, t_min, t_max)
+        if far is near:
+            return hit_near
+        t_far = hit_near[0] if hit_near is not None else t_max
+        hit_far = visit(far, _r, t_min, t_far) if type(far) is BVH_Node else far.intersect(_r, t_min, t_far)
+        return hit_far if hit_far is not None else hit_near
+
+
+def render_tiles(cam: Camera, recorder: FootprintRecorder, footprints: Footprints, tiles: list[int], accum: Accumulator,
+                 workers: int = 1) -> None:
+    """
+    Renders the pixels of `tiles` into `accum` and replaces the tiles' footprints with those recorded
+    while tracing them.
+    """
+
+    tasks = ((t, footprints.tile_window(t)) for t in tiles)
+    if workers <= 1:
+        results = (_render_tile(task, cam, recorder) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_footprint_worker, initargs=(cam, recorder))
+        results = pool.imap_unordered(_render_footprint_task, tasks)
+    try:
+        for done, (t, rows, entered, hits) in enumerate(results):
+            x0, y0, _, _ = footprints.tile_window(t)
+            for j, row in enumerate(rows, y0):
+                accum.set_row(j, row, x0)
+            footprints.tiles[t] = [entered, hits]
+            sys.stderr.write(f"\rTiles remaining: {len(tiles) - done} ")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _render_tile(task: tuple, cam: Camera, recorder: FootprintRecorder) -> tuple[int, list[list[RGB]], int, int]:
+    t, (x0, y0, x1, y1) = task
+    recorder.entered = recorder.hits = 0
+    rows = [cam.render_row(j, recorder, range(x0, x1)) for j in range(y0, y1)]
+    return t, rows, recorder.entered, recorder.hits
+
+
+# per-process state of footprint recording workers, set once by `_init_footprint_worker`
+_worker_camera: Camera = None
+_worker_recorder: FootprintRecorder = None
+
+def _init_footprint_worker(cam: Camera, recorder: FootprintRecorder) -> None:
+    global _worker_camera, _worker_recorder
+    settings.init()
+    _worker_camera = cam
+    _worker_recorder = recorder
+
+def _render_footprint_task(task: tuple) -> tuple[int, list[list[RGB]], int, int]:
+    return _render_tile(task, _worker_camera, _worker_recorder)
@@ -0,0 +1,151 @@
+import math
+from math import inf
+
+import settings
+from utils import Vector, Point, RGB, Ray, dot, rand_unit_vec
+from hittable import Hittable, HitRecord
+
+
+class IrradianceRecord:
+    """
+    A cached sample of the indirect light arriving at point `p` with surface normal `normal`:
+    - `irradiance`: average cosine-weighted incident radiance over the hemisphere (`RGB`)
+    - `radius`: harmonic mean distance to the surfaces seen from `p`, which bounds how far the sample is valid
+    """
+
+    __slots__ = ("p", "normal", "irradiance", "radius")
+
+    def __init__(self, p: Point, normal: Vector, irradiance: RGB, radius: float) -> None:
+        self.p = p
+        self.normal = normal
+        self.irradiance = irradiance
+        self.radius = radius
+
+
+class IrradianceCache:
+    """
+    Caches indirect irradiance at diffuse (`Lambertian`) hits and interpolates it at nearby hits, following
+    Ward's irradiance caching. A record at p_i is used at point p with normal n if its weight
+
+        w_i = 1 / (|p - p_i| / R_i + sqrt(1 - n . n_i))
+
+    exceeds `1 / accuracy`; otherwise a new record is computed by tracing `samples` cosine-distributed paths
+    from p. Smaller `accuracy` values give fewer reuses and a more faithful image. Record radii are clamped
+    to [`min_spacing`, `max_spacing`] in world units, and to at least `min_pixels` pixel footprints as seen
+    from the camera, so the number of records follows the image resolution rather than the scene's detail.
+
+    Records are kept in a spatial hash of cubic cells of side `cell_size`, each record being inserted in
+    every cell its validity sphere overlaps. The cache fills in lazily during rendering, so with several
+    render processes every process grows its own cache, and the image depends on the order pixels are traced.
+    """
+
+    def __init__(self, accuracy: float = 0.25, samples: int = 64, min_spacing: float = 0.05,
+                 max_spacing: float = 2.0, min_pixels: float = 3.0, cell_size: float = 0.25) -> None:
+        self.accuracy = accuracy
+        self.samples = samples
+        self.min_spacing = min_spacing
+        self.max_spacing = max_spacing
+        self.min_pixels = min_pixels
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int, int], list[IrradianceRecord]] = {}
+        self.records = 0
+        self.lookups = 0
+        self.hits = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered by interpolating cached records."""
+
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> str:
+        return f"irradiance cache: {self.records} records, {self.lookups} lookups, {self.hit_rate:.1%} hit rate"
+
+    def cell(self, x: float, y: float, z: float) -> tuple[int, int, int]:
+        s = self.cell_size
+        return (math.floor(x / s), math.floor(y / s), math.floor(z / s))
+
+    def lookup(self, p: Point, normal: Vector) -> RGB | None:
+        """
+        Returns the irradiance interpolated from the valid records around `p`, or `None` if there are none.
+        """
+
+        self.lookups += 1
+        min_weight = 1.0 / self.accuracy
+        total_weight = 0.0
+        r = g = b = 0.0
+        for rec in self.cells.get(self.cell(p.x, p.y, p.z), ()):
+            dx, dy, dz = p.x - rec.p.x, p.y - rec.p.y, p.z - rec.p.z
+            # records in front of p see occluders that p does not
+            if dx * rec.normal.x + dy * rec.normal.y + dz * rec.normal.z < -0.05 * rec.radius:
+                continue
+            cos_n = dot(normal, rec.normal)
+            if cos_n <= 0.0:
+                continue
+            error = math.sqrt(dx * dx + dy * dy + dz * dz) / rec.radius + math.sqrt(max(0.0, 1.0 - cos_n))
+            weight = inf if error == 0.0 else 1.0 / error
+            if weight <= min_weight:
+                continue
+            if weight == inf:
+                return rec.irradiance
+            total_weight += weight
+            r += weight * rec.irradiance.x
+            g += weight * rec.irradiance.y
+            b += weight * rec.irradiance.z
+
+        if total_weight == 0.0:
+            return None
+        self.hits += 1
+        return RGB(r / total_weight, g / total_weight, b / total_weight)
+
+    def insert(self, record: IrradianceRecord) -> None:
+        """Adds `record` to every cell overlapped by the sphere in which it can be valid."""
+
+        self.records += 1
+        reach = self.accuracy * record.radius
+        p = record.p
+        lo = self.cell(p.x - reach, p.y - reach, p.z - reach)
+        hi = self.cell(p.x + reach, p.y + reach, p.z + reach)
+        for i in range(lo[0], hi[0] + 1):
+            for j in range(lo[1], hi[1] + 1):
+                for k in range(lo[2], hi[2] + 1):
+                    self.cells.setdefault((i, j, k), []).append(record)
+
+    def compute(self, rec: HitRecord, cam, world: Hittable, depth: int) -> RGB:
+        """
+        Estimates the irradiance at hit `rec` by tracing `samples` cosine-distributed paths of at most
+        `depth - 1` bounces (which do not use the cache themselves), stores it as a new record and returns it.
+        `depth` must be at least 2: with no bounce left, the irradiance is zero and would be cached as such for
+        hits that have bounces left.
+        """
+
+        if depth <= 1:
+            raise ValueError("irradiance cache records need at least one bounce")
+        r = g = b = 0.0
+        inv_dist = 0.0
+        for _ in range(self.samples):
+            scatter_dir: Vector = rec.normal + rand_unit_vec()
+            if scatter_dir.near_zero():
+                scatter_dir = rec.normal
+            ray = Ray(rec.p, scatter_dir)
+
+            settings.stats.rays += 1
+            hit = world.hit(ray, 0.001, inf)
+            if hit is None:
+                color = cam.background(ray)
+            else:
+                inv_dist += 1.0 / (hit.t * scatter_dir.length())
+                color = cam.shade(ray, hit, depth - 1, world, use_cache=False)
+            r += color.x
+            g += color.y
+            b += color.z
+
+        n = self.samples
+        # harmonic mean distance to the surroundings, clamped to the spacing bounds
+        radius = n / inv_dist if inv_dist > 0.0 else inf
+        footprint = self.min_pixels * cam.pixel_angle * (rec.p - cam.center).length()
+        radius = min(max(radius, self.min_spacing, footprint), self.max_spacing)
+
+        irradiance = RGB(r / n, g / n, b / n)
+        self.insert(IrradianceRecord(rec.p, rec.normal, irradiance, radius))
+        return irradiance
@@ -0,0 +1,87 @@
+import threading
+
+from hittable import Hittable, AABB
+from hittable_list import HittableList
+from bvh import BVH_Node, BVH_Tree
+from utils import Ray
+
+# serializes splits between threads sharing a tree; processes each split their own copy
+_split_lock = threading.Lock()
+
+
+class LazyBVH_Node(BVH_Node):
+    """
+    A `BVH_Node` whose subtree has not been built yet: it only holds its objects and their bounding box.
+
+    The first ray that enters the box splits the node in two and it becomes an ordinary `BVH_Node`, so
+    regions of the scene no ray reaches are never sorted or split. Splits are deterministic (at the median of
+    the objects' lower bounds along the axis where those spread the most), so every process sharing the scene
+    grows the same tree.
+    """
+
+    def __init__(self, objects: list[Hittable], bounds: list[tuple[float, ...]], depth: int = 0) -> None:
+        super().__init__(depth)
+        self.objects = objects
+        self.bounds = bounds  # bounds of each object's box
+        if objects:
+            # columns of the objects' bounds, reduced by the builtins rather than a loop over the objects
+            x0, x1, y0, y1, z0, z1 = zip(*bounds)
+            self.bbox = AABB.from_bounds(min(x0), max(x1), min(y0), max(y1), min(z0), max(z1))
+            self.lows = (x0, y0, z0)  # lower bounds of the objects along each axis, for `split`
+        else:
+            self.bbox = AABB()
+            self.lows = ((), (), ())
+
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
+        if self.bbox.hit(_r, t_min, t_max):
+            self.split()
+        return BVH_Node.intersect(self, _r, t_min, t_max)
+
+    def split(self) -> None:
+        """Builds the node's children (unsplit themselves) and turns it into a `BVH_Node`."""
+
+        with _split_lock:
+            # another thread may have split the node while this one waited
+            if type(self) is not LazyBVH_Node:
+                return
+            objects, bounds = self.objects, self.bounds
+            # split along the axis over which the objects' lower bounds spread the most, at their median
+            lows, box = self.lows, self.bbox.bounds
+            spreads = [max(lows[k]) - box[2 * k] for k in range(3)]
+            axis = spreads.index(max(spreads))
+            order = sorted(range(len(objects)), key=lows[axis].__getitem__)
+            if len(objects) <= 2:
+                left, right = objects[order[0]], objects[order[-1]]
+            else:
+                mid = len(objects) // 2
+                left = LazyBVH_Node([objects[k] for k in order[:mid]], [bounds[k] for k in order[:mid]], self.depth + 1)
+                right = LazyBVH_Node([objects[k] for k in order[mid:]], [bounds[k] for k in order[mid:]], self.depth + 1)
+            self.axis = axis
+            self.left, self.right = left, right
+            self.objects = self.bounds = self.lows = None
+            # from now on the node is traversed like any other
+            self.__class__ = BVH_Node
+
+
+class LazyBVH(BVH_Tree):
+    """
+    BVH built on demand: construction only bounds the scene, and nodes are split when rays first enter
+    them (see `LazyBVH_Node`). For huge scenes seen through a narrow field of view or a small crop window,
+    most of the tree is never built. Rendering the whole scene builds about as much as `BVH_Tree`, spread
+    over the render.
+    """
+
+    def __init__(self, hit_list: HittableList) -> None:
+        objects = hit_list.objects[:]
+        self.root: BVH_Node = LazyBVH_Node(objects, [obj.bounding_box.bounds for obj in objects], depth=1)
+
+    def built_nodes(self) -> tuple[int, int]:
+        """Returns the number of nodes split so far and the number still unsplit."""
+
+        split = unsplit = 0
+        for node in self.interior_nodes():
+            if type(node) is LazyBVH_Node:
+                unsplit += 1
+            else:
+                split += 1
+        return split, unsplit
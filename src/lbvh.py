@@ -0,0 +1,135 @@
+from bisect import bisect_left
+
+from hittable import Hittable, AABB
+from hittable_list import HittableList
+from bvh import BVH_Node, BVH_Tree
+
+
+def spread_bits(v: int) -> int:
+    """Spreads the bits of `v` so that two zero bits follow every bit."""
+
+    out = 0
+    for k in range(v.bit_length()):
+        out |= ((v >> k) & 1) << (3 * k)
+    return out
+
+
+# spread bits of every 11-bit integer; wider integers are spread in two halves
+SPREAD = [spread_bits(v) for v in range(1 << 11)]
+
+
+def morton_code(x: int, y: int, z: int) -> int:
+    """Interleaves the bits of three integers of at most 21 bits as ...x1y1z1x0y0z0."""
+
+    if (x | y | z) < (1 << 11):
+        return (SPREAD[x] << 2) | (SPREAD[y] << 1) | SPREAD[z]
+    return (morton_code(x >> 11, y >> 11, z >> 11) << 33) | morton_code(x & 0x7FF, y & 0x7FF, z & 0x7FF)
+
+
+class LBVH(BVH_Tree):
+    """
+    Linear BVH (Lauterbach et al.), built from the Morton codes of the objects' centroids instead of by
+    sorting the objects again at every level like `BVH_Tree`.
+
+    Centroids are quantized to `bits` bits per axis (10 for 30-bit codes, 21 for 63-bit codes) within the
+    scene's centroid bounds and sorted once by their codes. The hierarchy is the radix tree of the sorted
+    codes, emitted in array form: each node splits its range of objects where their codes first differ
+    (found with one binary search), which is a spatial median split along the axis of that bit. This is the
+    same tree as Karras's per-node parallel construction, but built top-down, which costs less in Python.
+    Objects with equal codes are split in the middle of their range.
+
+    The tree is made of ordinary `BVH_Node`s, so it is traversed and compiled exactly like `BVH_Tree`.
+    """
+
+    def __init__(self, hit_list: HittableList, bits: int = 10) -> None:
+        objects = hit_list.objects
+        self.bits = bits
+        self.root: BVH_Node = BVH_Node(depth=1)
+        if len(objects) < 2:
+            # a single object is referenced from both sides of the root, as in `BVH_Tree`
+            if objects:
+                self.root.left = self.root.right = objects[0]
+                self.root.bbox = objects[0].bounding_box
+            return
+
+        codes, order = self.sorted_codes(objects)
+        left, right, axes = self.emit_hierarchy(codes)
+        self.link(objects, order, left, right, axes)
+
+    def sorted_codes(self, objects: list[Hittable]) -> tuple[list[int], list[int]]:
+        """Returns the sorted Morton codes of the objects' centroids and the object index of each."""
+
+        centroids = [(0.5 * (b[0] + b[1]), 0.5 * (b[2] + b[3]), 0.5 * (b[4] + b[5]))
+                     for b in (obj.bounding_box.bounds for obj in objects)]
+        lo = [min(c[k] for c in centroids) for k in range(3)]
+        hi = [max(c[k] for c in centroids) for k in range(3)]
+        top = (1 << self.bits) - 1
+        scale = [top / (hi[k] - lo[k]) if hi[k] > lo[k] else 0.0 for k in range(3)]
+
+        codes = [morton_code(int((x - lo[0]) * scale[0]), int((y - lo[1]) * scale[1]), int((z - lo[2]) * scale[2]))
+                 for x, y, z in centroids]
+        order = sorted(range(len(objects)), key=codes.__getitem__)
+        return [codes[k] for k in order], order
+
+    def emit_hierarchy(self, codes: list[int]) -> tuple[list[int], list[int], list[int]]:
+        """
+        Returns the left and right children and split axis of each internal node, in array form. A child
+        c >= 0 is internal node c, and c < 0 is the leaf holding sorted object ~c. Node 0 is the root.
+        """
+
+        n = len(codes)
+        width = 3 * self.bits
+        left, right, axes = [0] * (n - 1), [0] * (n - 1), [0] * (n - 1)
+        count = 1
+        stack = [(0, 0, n - 1)]
+        while stack:
+            i, first, last = stack.pop()
+            diff = codes[first] ^ codes[last]
+            if diff == 0:
+                # identical codes are split in the middle
+                split = (first + last) // 2
+            else:
+                # the last code with a 0 at the highest bit where the range's codes differ
+                bit = diff.bit_length() - 1
+                split = bisect_left(codes, (codes[last] >> bit) << bit, first, last + 1) - 1
+                # code bits cycle through x, y, z from the top
+                axes[i] = (width - 1 - bit) % 3
+
+            if split == first:
+                left[i] = ~first
+            else:
+                left[i] = count
+                stack.append((count, first, split))
+                count += 1
+            if split + 1 == last:
+                right[i] = ~last
+            else:
+                right[i] = count
+                stack.append((count, split + 1, last))
+                count += 1
+        return left, right, axes
+
+    def link(self, objects: list[Hittable], order: list[int], left: list[int], right: list[int],
+             axes: list[int]) -> None:
+        """Creates the `BVH_Node`s of the hierarchy and computes their bounding boxes, children first."""
+
+        nodes = [self.root] + [BVH_Node() for _ in range(len(left) - 1)]
+
+        def child(c: int) -> Hittable:
+            return objects[order[~c]] if c < 0 else nodes[c]
+
+        # pre-order for depths, then reversed for bounds, so that children are merged before their parents
+        visit = [0]
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            node = nodes[i]
+            node.left, node.right, node.axis = child(left[i]), child(right[i]), axes[i]
+            for c in (left[i], right[i]):
+                if c >= 0:
+                    nodes[c].depth = node.depth + 1
+                    stack.append(c)
+                    visit.append(c)
+        for i in reversed(visit):
+            node = nodes[i]
+            node.bbox = AABB.merge(node.left.bounding_box, node.right.bounding_box)
@@ -1,93 +1,337 @@
+import os
 import sys, time, math
+import random
+import argparse
+import json
 
-from utils import Interval
-from utils import Vector, RGB, Point, dot, cross, normalize, write_color, random
-from utils import Ray, rand_float
+from utils import Vector, RGB, Point
+from hittable import Hittable
 from hittable_list import HittableList
 from camera import Camera
-from sphere import Sphere
-from material import Lambertian, Metal, Dielectric
-from bvh import BVH_Node, BVH_Tree
+from bvh import BVH_Tree
+from scene import DEFAULT_CAMERA, random_spheres, load_scene, camera_kwargs
+from estimate import estimate
+from image import Accumulator, PNGStream, PPMStream, read_ppm, write_ppm, patch_ppm
+from irradiance_cache import IrradianceCache
+from environment import EnvironmentMap
+from guiding import GuidingField
+from compiled_scene import load_or_compile
+from telemetry import Telemetry
+from sequence import render_sequence, turntable
+from incremental import Footprints, FootprintRecorder, footprint_tree, render_tiles, settings_digest
+import texture
+import tuning
 import settings
 
 
-def main():
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Renders a scene to a PPM image.")
+    parser.add_argument("--scene", help="JSON scene file (defaults to the random spheres scene)")
+    parser.add_argument("--width", type=int, help="image width in pixels")
+    parser.add_argument("--aspect", type=float, help="aspect ratio (width / height)")
+    parser.add_argument("--spp", type=int, help="samples per pixel")
+    parser.add_argument("--max-depth", type=int, help="maximum number of ray bounces")
+    parser.add_argument("-o", "--output", default="-", help="output PPM file, '-' for stdout")
+    parser.add_argument("-j", "--workers", type=int,
+                        help="number of render processes (default: the tuning profile's, else 1)")
+    parser.add_argument("--backend", choices=Camera.BACKENDS,
+                        help="run --workers as processes, or as threads sharing one scene (which only run in "
+                             "parallel on free-threaded Python builds); default: the tuning profile's, else process")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the scene generation and of the per-sample random number streams")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("X0", "Y0", "X1", "Y1"),
+                        help="re-render only this pixel window (exclusive upper bounds) and patch it into "
+                             "the --patch image and/or the --accum buffer")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="render as many samples per pixel (up to --spp) as fit in this wall-clock time")
+    parser.add_argument("--stream", action="store_true",
+                        help="render in bands written straight to a binary PPM or (for a .png --output) a PNG "
+                             "image, keeping only a few bands in memory")
+    parser.add_argument("--band-height", type=int, default=16, help="scanlines per band with --stream")
+    parser.add_argument("--patch", metavar="PPM", help="existing image to patch with the --crop window")
+    parser.add_argument("--accum", metavar="FILE",
+                        help="accumulation buffer to write (full render) or to patch (with --crop)")
+    parser.add_argument("--irradiance-cache", action="store_true",
+                        help="interpolate diffuse indirect lighting from an irradiance cache")
+    parser.add_argument("--ic-accuracy", type=float, default=0.25,
+                        help="irradiance cache error bound, smaller is slower and more accurate")
+    parser.add_argument("--ic-samples", type=int, default=64, help="paths traced per irradiance cache record")
+    parser.add_argument("--texture-cache-mb", type=float, default=64,
+                        help="memory budget of the texture tile cache of each render process, in MB")
+    parser.add_argument("--envmap", metavar="IMAGE",
+                        help="latitude-longitude PFM or Radiance .hdr environment map lighting the scene")
+    parser.add_argument("--env-scale", type=float, default=1.0, help="radiance multiplier of the environment map")
+    parser.add_argument("--env-rotation", type=float, default=0.0,
+                        help="rotation of the environment map about the vertical axis, in degrees")
+    parser.add_argument("--guiding", action="store_true",
+                        help="guide diffuse and glossy bounces towards the light, learned in training passes first")
+    parser.add_argument("--guiding-passes", type=int, default=4,
+                        help="training passes of one sample through every other pixel for --guiding")
+    parser.add_argument("--accel", default="bvh", choices=HittableList.ACCELERATORS,
+                        help="acceleration structure (lbvh: Morton code BVH, grid2: two-level grid); --compiled-scene "
+                             "always uses a BVH")
+    parser.add_argument("--packets", type=int, metavar="N",
+                        help="trace the camera rays of N x N pixel blocks as packets (4 or 8; BVH accelerators only)")
+    parser.add_argument("--bvh-split", choices=BVH_Tree.SPLITS,
+                        help="BVH split strategy: random axis, longest axis or surface area heuristic")
+    parser.add_argument("--leaf-size", type=int, metavar="N", help="most objects in a BVH leaf")
+    parser.add_argument("--rows-per-task", type=int, metavar="N", help="scanlines handed to a worker at a time")
+    parser.add_argument("--footprints", metavar="FILE",
+                        help="record which objects and BVH nodes the paths of each tile touch (requires --accum); "
+                             "with --update, re-render only the tiles affected by edits to the scene since")
+    parser.add_argument("--update", action="store_true",
+                        help="update the --accum buffer and --footprints after moving or re-materialing objects")
+    parser.add_argument("--tile-size", type=int, default=16, help="side of the tiles of --footprints, in pixels")
+    parser.add_argument("--compiled-scene", metavar="FILE",
+                        help="compiled scene file shared by the render processes; reused as a BVH cache while "
+                             "the scene is unchanged, rewritten otherwise")
+    parser.add_argument("--status", metavar="FILE", help="JSON status file updated with live render metrics")
+    parser.add_argument("--metrics", metavar="ADDR",
+                        help="serve live metrics in Prometheus format at /metrics (and JSON at /status) on "
+                             "HOST:PORT, :PORT or unix:PATH")
+    parser.add_argument("--telemetry-interval", type=float, default=1.0,
+                        help="seconds between updates of the --status file")
+    parser.add_argument("--frames", metavar="JSON",
+                        help="render a sequence: a JSON list of per-frame camera settings (lookfrom, lookat, vfov, "
+                             "focus_dist, ...); --output is then a pattern such as frame_%%04d.ppm")
+    parser.add_argument("--turntable", type=int, metavar="N",
+                        help="render a sequence of N frames orbiting the camera once around its lookat point")
+    parser.add_argument("--estimate", action="store_true",
+                        help="estimate render time, rays and memory instead of rendering")
+    parser.add_argument("--estimate-pixels", type=int, default=64, help="pixels traced by --estimate")
+    parser.add_argument("--estimate-spp", type=int, default=4, help="samples per pixel traced by --estimate")
+    parser.add_argument("--json", action="store_true", help="print the --estimate, sequence or --time-budget report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+
     # Create the world
-    world: HittableList = HittableList()
-
-    ground_material: Lambertian = Lambertian(RGB(0.5, 0.5, 0.5))
-    world.add(Sphere(Point(0, -1000, 0), 1000, ground_material))
-
-    density = 1
-    n = 11
-    # Create and randomly position spheres of random material types into the scene
-    for a in range(-n, n):
-        for b in range(-n, n):
-            choose_mat: float = rand_float()
-            center: Point = Point(a / density + 0.9 * rand_float(), 0.2, b / density + 0.9 * rand_float())
-
-            if (center - Point(4, 0.2, 0)).length() > 0.9:
-                if choose_mat < 0.8:
-                    # diffuse
-                    albedo: RGB = RGB.random() * RGB.random()
-                    sphere_material: Lambertian = Lambertian(albedo)
-                    world.add(Sphere(center, 0.2, sphere_material))
-                elif choose_mat < 0.95:
-                    # metal
-                    albedo: RGB = RGB.random(0.5, 1)
-                    fuzz: float = rand_float(0, 0.5)
-                    sphere_material: Metal = Metal(albedo, fuzz)
-                    world.add(Sphere(center, 0.2, sphere_material))
-                else:
-                    # dielectric (glass)
-                    sphere_material: Dielectric = Dielectric(1.5)
-                    world.add(Sphere(center, 0.2, sphere_material))
-
-    # Sphere 1
-    material1: Dielectric = Dielectric(1.5)
-    world.add(Sphere(Point(0, 1, 0), 1.0, material1))
-    # Sphere 2
-    material2: Lambertian = Lambertian(RGB(1.0, 0.2, 0.1))
-    world.add(Sphere(Point(-4, 1, 0), 1.0, material2))
-    # Sphere 3
-    material3: Metal = Metal(RGB(0.7, 0.6, 0.5), 0.0)
-    world.add(Sphere(Point(4, 1, 0), 1.0, material3))
-    # world.add(Sphere(Point(0, 1, 0), 2.0, material2))
-    # world.add(Sphere(Point(0, 1, 2), 2.0, material2))
-
-    bvh_on = True
-
-    if bvh_on:
-        # bvh_tree: BVH_Tree = BVH_Tree(world)
-        # sys.stderr.write("BVH Tree Constructed\n")
-        # bvh_tree.print_bfs()
-        world: HittableList = HittableList(BVH_Tree(world))
-    
-    aspect_ratio: float = 16.0 / 9.0
-    image_width: int = 1200
-    samples_per_pixel: int = 250 # originally 250
-    max_depth: int = 50 # originally 50
-
-    vfov: float = 20
-    lookfrom: Point = Point(13, 2, 3)
-    lookat: Point = Point(0, 0, 0)
-    vup: Vector = Vector(0, 1, 0)
-
-    defocus_angle: float = 0.6
-    focus_dist: float = 10.0
-
-    cam: Camera = Camera(aspect_ratio=aspect_ratio, 
-                         image_width=image_width, 
-                         samples_per_pixel=samples_per_pixel,
-                         max_depth=max_depth,
-                         vfov=vfov, 
-                         lookfrom=lookfrom, 
-                         lookat=lookat, 
-                         vup=vup, 
-                         defocus_angle=defocus_angle,
-                         focus_dist=focus_dist)
-
-    cam.render(world)
+    HittableList.accelerator = args.accel
+    # parameters left unset are taken from the tuning profile written by autotune.py
+    BVH_Tree.split = args.bvh_split
+    BVH_Tree.leaf_size = args.leaf_size
+    Camera.packet_size = args.packets
+    Camera.rows_per_task = args.rows_per_task
+    Camera.backend = args.backend
+    if args.workers is None:
+        args.workers = tuning.setting("workers")
+    if (args.backend or tuning.setting("backend")) == "thread" and args.irradiance_cache:
+        raise SystemExit("--backend thread cannot be used with --irradiance-cache, which each worker builds alone")
+    if (args.status or args.metrics) and (args.stream or args.time_budget is not None or args.footprints
+                                          or args.frames or args.turntable or args.estimate):
+        raise SystemExit("--status and --metrics only report full and --crop renders, not --stream, --time-budget, "
+                         "--footprints, sequences or --estimate")
+    texture.tile_cache.max_bytes = int(args.texture_cache_mb * (1 << 20))
+    random.seed(args.seed)
+    if args.scene:
+        world, cam_settings = load_scene(args.scene)
+    else:
+        world, cam_settings = random_spheres(), dict(DEFAULT_CAMERA)
+
+    # command line settings override those of the scene
+    overrides = {"image_width": args.width, "aspect_ratio": args.aspect,
+                 "samples_per_pixel": args.spp, "max_depth": args.max_depth}
+    cam_settings.update({k: v for k, v in overrides.items() if v is not None})
+    if args.compiled_scene:
+        world = load_or_compile(world, args.compiled_scene)
+
+    cache = IrradianceCache(accuracy=args.ic_accuracy, samples=args.ic_samples) if args.irradiance_cache else None
+    environment = EnvironmentMap.load(args.envmap, args.env_scale, args.env_rotation) if args.envmap else None
+    cam: Camera = Camera(**camera_kwargs(cam_settings), seed=args.seed, irradiance_cache=cache,
+                         environment=environment)
+    if args.guiding:
+        if cache is not None or environment is not None:
+            raise SystemExit("--guiding cannot be used with --irradiance-cache or --envmap")
+        if args.frames or args.turntable or args.footprints:
+            raise SystemExit("--guiding cannot be used with sequences or --footprints")
+        start = time.perf_counter()
+        cam.guiding = GuidingField()
+        cam.train_guiding(world, args.guiding_passes)
+        sys.stderr.write(f"{cam.guiding.stats()} in {time.perf_counter() - start:.1f}s\n")
+
+    if args.estimate:
+        report = estimate(cam, world, pixel_count=args.estimate_pixels, samples=args.estimate_spp, workers=args.workers)
+        sys.stdout.write(json.dumps(report.as_dict()) + "\n" if args.json else str(report))
+        return
+
+    if args.frames or args.turntable:
+        render_frames(world, cam_settings, args, cache, environment)
+        return
+
+    telemetry = None
+    if args.status or args.metrics:
+        telemetry = Telemetry(args.status, args.metrics, interval=args.telemetry_interval)
+
+    try:
+        if args.crop:
+            render_crop(cam, world, args, telemetry)
+            return
+
+        if args.footprints:
+            render_footprints(cam, world, cam_settings, args)
+            return
+        if args.stream:
+            render_stream(cam, world, args)
+            return
+        if args.time_budget is not None:
+            render_timed(cam, world, args)
+            return
+
+        accum = Accumulator(cam.image_width, cam.image_height, cam.samples_per_pixel) if args.accum else None
+        if args.output == "-":
+            cam.render(world, sys.stdout, workers=args.workers, accum=accum, telemetry=telemetry)
+        else:
+            with open(args.output, "w") as out:
+                cam.render(world, out, workers=args.workers, accum=accum, telemetry=telemetry)
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+    if accum is not None:
+        accum.save(args.accum)
+    if cache is not None and args.workers <= 1:
+        sys.stderr.write(cache.stats() + "\n")
+    if texture.tile_cache.hits + texture.tile_cache.misses and args.workers <= 1:
+        sys.stderr.write(texture.tile_cache.stats() + "\n")
+
+
+def render_frames(world: Hittable, cam_settings: dict, args: argparse.Namespace, cache: IrradianceCache,
+                  environment: EnvironmentMap) -> None:
+    """Renders the `--frames` or `--turntable` sequence with one scene and one worker pool for all frames."""
+
+    if args.frames:
+        with open(args.frames) as f:
+            frames = json.load(f)
+    else:
+        frames = turntable(cam_settings, args.turntable)
+    output = args.output if args.output != "-" else "frame_%04d.ppm"
+    try:
+        output % 0
+    except TypeError:
+        raise SystemExit(f"--output {output} must contain a frame number pattern such as %04d")
+
+    report = render_sequence(world, cam_settings, frames, output, workers=args.workers,
+                             camera_options=dict(seed=args.seed, irradiance_cache=cache, environment=environment))
+    sys.stdout.write(json.dumps(report.as_dict()) + "\n" if args.json else str(report))
+
+
+def render_footprints(cam: Camera, world: Hittable, cam_settings: dict, args: argparse.Namespace) -> None:
+    """
+    Renders with per-tile footprints recorded to `--footprints` and the image accumulated in `--accum`. With
+    `--update`, only the tiles affected by the edits made to the scene's objects since are re-rendered; the
+    whole image is rendered if there are no previous footprints or the camera, sampling or number of objects
+    changed.
+    """
+
+    if not args.accum:
+        raise SystemExit("--footprints requires --accum")
+    if not isinstance(world, HittableList):
+        raise SystemExit("--footprints cannot be used with --compiled-scene")
+    if cam.irradiance_cache is not None:
+        raise SystemExit("--footprints cannot be used with --irradiance-cache, which shares light between tiles")
+
+    digest = settings_digest(sorted(cam_settings.items()), args.seed, args.envmap, args.env_scale, args.env_rotation)
+    footprints = None
+    if args.update and os.path.exists(args.footprints) and os.path.exists(args.accum):
+        footprints = Footprints.load(args.footprints)
+        if footprints.digest != digest or footprints.tile_size != args.tile_size:
+            sys.stderr.write("Render settings changed, rendering the whole image\n")
+            footprints = None
+        elif len(footprints.objects) != len(world.objects):
+            sys.stderr.write("Objects were added or removed, rendering the whole image\n")
+            footprints = None
+
+    if footprints is not None:
+        accum = Accumulator.load(args.accum)
+        tiles, edited = footprints.affected_tiles(world.objects)
+        tree = footprints.refit(world.objects)
+        sys.stderr.write(f"Edited objects {edited}: re-rendering {len(tiles)} of {len(footprints.tiles)} tiles "
+                         f"({len(tiles) / len(footprints.tiles):.0%})\n")
+    else:
+        tree, large = footprint_tree(world.objects)
+        accum = Accumulator(cam.image_width, cam.image_height, cam.samples_per_pixel)
+        footprints = Footprints(cam.image_width, cam.image_height, args.tile_size, digest, tree, world.objects, large)
+        tiles = list(range(len(footprints.tiles)))
+
+    start = time.perf_counter()
+    recorder = FootprintRecorder(tree, world.objects, footprints.large)
+    render_tiles(cam, recorder, footprints, tiles, accum, workers=args.workers)
+    sys.stderr.write(f"\rDone in {time.perf_counter() - start:.1f}s.\n")
+    accum.save(args.accum)
+    footprints.save(args.footprints)
+    if args.output == "-":
+        accum.write_ppm(sys.stdout)
+    else:
+        with open(args.output, "w") as out:
+            accum.write_ppm(out)
+
+
+def render_timed(cam: Camera, world: Hittable, args: argparse.Namespace) -> None:
+    """
+    Renders for `--time-budget` seconds and writes the image, the `--accum` buffer if asked (which records
+    the achieved samples per pixel), and with `--json` a report of the passes to stdout (or to stderr if the
+    image is written to stdout).
+    """
+
+    accum, passes = cam.render_timed(world, args.time_budget, workers=args.workers)
+    if args.output == "-":
+        accum.write_ppm(sys.stdout)
+    else:
+        with open(args.output, "w") as out:
+            accum.write_ppm(out)
+    if args.accum:
+        accum.save(args.accum)
+    if args.json:
+        report = {"budget_seconds": args.time_budget, "samples_per_pixel": accum.samples_per_pixel,
+                  "seconds": sum(p["seconds"] for p in passes), "passes": passes}
+        (sys.stderr if args.output == "-" else sys.stdout).write(json.dumps(report) + "\n")
+
+
+def render_stream(cam: Camera, world: Hittable, args: argparse.Namespace) -> None:
+    """Renders the image in bands streamed to `--output`: a PNG if its name ends in .png, else a binary PPM."""
+
+    if args.accum:
+        raise SystemExit("--stream cannot write an --accum buffer")
+    stream_cls = PNGStream if args.output.lower().endswith(".png") else PPMStream
+    if args.output == "-":
+        stream = stream_cls(sys.stdout.buffer, cam.image_width, cam.image_height)
+        cam.render_bands(world, stream, args.band_height, workers=args.workers)
+    else:
+        with open(args.output, "wb") as out:
+            stream = stream_cls(out, cam.image_width, cam.image_height)
+            cam.render_bands(world, stream, args.band_height, workers=args.workers)
+
+
+def render_crop(cam: Camera, world: Hittable, args: argparse.Namespace, telemetry: Telemetry = None) -> None:
+    """
+    Re-renders the `--crop` window and patches it into the `--accum` buffer and/or the `--patch` image.
+    The patched image is written to `--output`, or back to the `--patch` file if no output is given.
+    """
+
+    if not (args.patch or args.accum):
+        raise SystemExit("--crop requires --patch and/or --accum")
+
+    rows = cam.render_crop(world, tuple(args.crop), workers=args.workers, telemetry=telemetry)
+    x0, y0, x1, y1 = args.crop
+
+    if args.accum:
+        accum = Accumulator.load(args.accum)
+        if (accum.width, accum.height, accum.samples_per_pixel) != (cam.image_width, cam.image_height, cam.samples_per_pixel):
+            raise SystemExit(f"{args.accum} was rendered with different image settings")
+        for j, row in zip(range(y0, y1), rows):
+            accum.set_row(j, row, x0)
+        accum.save(args.accum)
+
+    if args.patch:
+        width, height, pixels = read_ppm(args.patch)
+        if (width, height) != (cam.image_width, cam.image_height):
+            raise SystemExit(f"{args.patch} is {width}x{height}, expected {cam.image_width}x{cam.image_height}")
+        patch_ppm(pixels, width, tuple(args.crop), rows, cam.samples_per_pixel)
+        write_ppm(args.patch if args.output == "-" else args.output, width, height, pixels)
+    elif args.output != "-":
+        with open(args.output, "w") as out:
+            accum.write_ppm(out)
 
 
 if __name__ == '__main__':
@@ -95,5 +339,5 @@ if __name__ == '__main__':
     settings.init()
     # import pdb; pdb.set_trace()
     main()
-    sys.stderr.write(f"Count: {settings.count}")
-    sys.stderr.write(f"Max Depth: {settings.max_depth}")
+    sys.stderr.write(f"Count: {settings.stats.count}\n")
+    sys.stderr.write(f"Max Depth: {settings.stats.max_depth}\n")
@@ -33,6 +33,19 @@ class Material(ABC):
         '''
         pass
 
+    # texture modulating the albedo, `None` for a constant `albedo`
+    texture = None
+    # light emitted by the surface, `None` for surfaces that do not emit
+    emission = None
+
+    def albedo_at(self, _rec: HitRecord) -> RGB:
+        """Returns the albedo at the hit `_rec`, looked up in the texture if there is one."""
+
+        if self.texture is None:
+            return self.albedo
+        u, v = _rec.uv
+        return self.texture.value(u, v, _rec.p, _rec.footprint / _rec.primitive.uv_scale)
+
 class Lambertian(Material):
     """
     Material type which models diffuse (matte) surfaces. Diffuse surfaces can be thought of as random-like, with photons 
@@ -41,8 +54,9 @@ class Lambertian(Material):
     the probability a ray is scattered in a certain direction is proportional to its angle from the surface normal.
     """
 
-    def __init__(self, albedo: RGB) -> None:
+    def __init__(self, albedo: RGB, texture=None) -> None:
         self.albedo = albedo
+        self.texture = texture
     
     def scatter(self, _ray_in: Ray, _rec: HitRecord) -> tuple[RGB, Ray]:
         """
@@ -72,18 +86,32 @@ class Lambertian(Material):
 
         # NOTE: scatter should handle the scattering of the ray, but it makes more sense for ray_color to handle the mixing of color values
         scattered = Ray(_rec.p, scatter_dir)
-        attenuation = RGB(self.albedo.x, self.albedo.y, self.albedo.z)
+        albedo = self.albedo_at(_rec)
+        attenuation = RGB(albedo.x, albedo.y, albedo.z)
          
         return attenuation, scattered
     
+class DiffuseLight(Material):
+    """
+    Material type which models light sources: the front face of the surface emits `emission` equally in all
+    directions and scatters nothing.
+    """
+
+    def __init__(self, emission: RGB) -> None:
+        self.emission: RGB = emission
+
+    def scatter(self, _ray_in: Ray, _rec: HitRecord) -> None:
+        return None
+
 class Metal(Material):
     """
     Material type which models metal surfaces. Rays are reflected about the surface normal with a specified specularity
     which can be thought of as the precision of reflectance.
     """
-    def __init__(self, albedo: RGB, fuzz: float) -> None:
+    def __init__(self, albedo: RGB, fuzz: float, texture=None) -> None:
         self.albedo: RGB = albedo
         self.fuzz: float = min(fuzz, 1.0)
+        self.texture = texture
 
     def scatter(self, _ray_in: Ray, _rec: HitRecord) -> (tuple[RGB, Ray] | None):
         """
@@ -105,7 +133,8 @@ class Metal(Material):
         reflected: Vector = reflect(normalize(_ray_in.dir), _rec.normal)
         
         scattered = Ray(_rec.p, reflected + self.fuzz*rand_unit_vec())
-        attenuation = RGB(self.albedo.x, self.albedo.y, self.albedo.z)
+        albedo = self.albedo_at(_rec)
+        attenuation = RGB(albedo.x, albedo.y, albedo.z)
 
         # if the ray is scattered below the surface, then it is absorbed in which case nothing is returned
         return (attenuation, scattered) if dot(scattered.dir, _rec.normal) > 0.0 else None
@@ -0,0 +1,109 @@
+"""
+Packet tracing of camera rays. The primary rays of a block of neighbouring pixels leave from (nearly) the
+same point in nearly the same direction and visit almost the same BVH nodes, so they are traced down the
+tree together: each node's box is tested once for the whole packet, and only the primitives of the leaves
+the packet reaches are tested against each ray.
+"""
+from math import isfinite
+
+import settings
+from utils import Ray
+from hittable import Hittable
+from bvh import BVH_Node
+
+
+class RayPacket:
+    """
+    A bundle of rays whose direction components have the same sign on every axis. The origins and
+    reciprocal directions of the rays are bounded by intervals, and interval arithmetic on those gives
+    conservative bounds of the slab distances of every ray of the packet to a box at once.
+    """
+
+    def __init__(self, rays: list[Ray]) -> None:
+        self.rays = rays
+        origins = [r.orig for r in rays]
+        inv_dirs = [r.inv_dir for r in rays]
+        self.orig_lo = tuple(min(o[k] for o in origins) for k in range(3))
+        self.orig_hi = tuple(max(o[k] for o in origins) for k in range(3))
+        self.inv_lo = tuple(min(d[k] for d in inv_dirs) for k in range(3))
+        self.inv_hi = tuple(max(d[k] for d in inv_dirs) for k in range(3))
+        self.sign = rays[0].sign if rays else (0, 0, 0)
+
+    @property
+    def coherent(self) -> bool:
+        """
+        Returns true if the packet can be traced as one: all rays travel the same way along every axis, and
+        no direction component is zero (whose infinite reciprocal would make the intervals meaningless).
+        """
+
+        sign = self.sign
+        return (all(r.sign == sign for r in self.rays) and
+                all(isfinite(v) for v in self.inv_lo) and all(isfinite(v) for v in self.inv_hi))
+
+    def may_hit(self, b: tuple[float, ...], t_min: float, t_max: float) -> bool:
+        """
+        Returns false only if no ray of the packet intersects the box with bounds `b` within
+        (`t_min`, `t_max`). One test stands for all the rays' slab tests.
+        """
+
+        t_enter, t_exit = t_min, t_max
+        for axis in range(3):
+            s = self.sign[axis]
+            near, far = b[2 * axis + s], b[2 * axis + 1 - s]
+            o0, o1 = self.orig_lo[axis], self.orig_hi[axis]
+            i0, i1 = self.inv_lo[axis], self.inv_hi[axis]
+            # the entry distance of every ray is at least the smallest product of (near - origin) and the
+            # reciprocal direction, the exit distance at most the largest product of (far - origin) and it
+            lo = min((near - o0) * i0, (near - o0) * i1, (near - o1) * i0, (near - o1) * i1)
+            hi = max((far - o0) * i0, (far - o0) * i1, (far - o1) * i0, (far - o1) * i1)
+            if lo > t_enter:
+                t_enter = lo
+            if hi < t_exit:
+                t_exit = hi
+            if t_exit <= t_enter:
+                return False
+        return True
+
+
+def intersect_packet(root: Hittable, packet: RayPacket, t_min: float, t_max: float) -> list[tuple[float, Hittable] | None]:
+    """
+    Returns the closest intersection (as from `Hittable.intersect`) of each ray of a coherent packet with the
+    BVH under `root`.
+
+    Nodes are visited front to back along the packet's common direction, and a node is skipped when the
+    packet misses its box or when its box lies beyond the closest hits found so far for all the rays.
+    """
+
+    rays = packet.rays
+    closest: list[tuple[float, Hittable] | None] = [None] * len(rays)
+    t_far: list[float] = [t_max] * len(rays)
+    sign = packet.sign
+    may_hit = packet.may_hit
+    visits = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if type(node) is not BVH_Node:
+            # a primitive, tested against each ray up to its own closest hit
+            for k, r in enumerate(rays):
+                found = node.intersect(r, t_min, t_far[k])
+                if found is not None:
+                    t_far[k] = found[0]
+                    closest[k] = found
+            continue
+
+        visits += 1
+        if not may_hit(node.bbox.bounds, t_min, max(t_far)):
+            continue
+        if sign[node.axis]:
+            near, far = node.right, node.left
+        else:
+            near, far = node.left, node.right
+        # the near child is pushed last, so that it is searched first; leaves holding a single object
+        # reference it from both sides
+        if far is not near:
+            stack.append(far)
+        stack.append(near)
+
+    settings.stats.count += visits
+    return closest
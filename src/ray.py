@@ -1,21 +1,38 @@
+from math import inf, copysign
+
 from vec3 import Vector, Point
 
 class Ray:
     """
     Represents a light ray which is traced by the program, which is essentially a parametrization of a
     line in 3D space. Composed of a starting `Point` and a direction `Vector` (of the form alpha(t) = a + tv).
+
+    For slab tests against bounding boxes, the ray caches once at creation:
+    - `orig`: the origin as a tuple of floats
+    - `inv_dir`: the reciprocal of each direction component (signed infinity for a zero component)
+    - `sign`: 1 if the direction component is negative, 0 otherwise; indexes the near slab plane
     """
 
+    __slots__ = ("origin", "dir", "orig", "inv_dir", "sign")
+
     def __init__(self, origin: Point = None, direction: Vector = None):
         self.origin: Point = origin
         self.dir: Vector = direction
+        if origin is not None and direction is not None:
+            self.orig: tuple[float, float, float] = (origin.x, origin.y, origin.z)
+            dx, dy, dz = direction.x, direction.y, direction.z
+            ix = 1.0 / dx if dx else copysign(inf, dx)
+            iy = 1.0 / dy if dy else copysign(inf, dy)
+            iz = 1.0 / dz if dz else copysign(inf, dz)
+            self.inv_dir: tuple[float, float, float] = (ix, iy, iz)
+            self.sign: tuple[int, int, int] = (int(ix < 0), int(iy < 0), int(iz < 0))
 
     def __repr__(self) -> str:
         """String expression for `Ray`."""
 
-        return "{self.__class__.__name__}(origin={self.orig}, direction={self.dir})".format(self=self)
+        return "{self.__class__.__name__}(origin={self.origin}, direction={self.dir})".format(self=self)
 
     def at(self, t) -> Vector:
         """Returns the point at `t` along the `ray`."""
 
-        return self.origin + t*self.dir
\ No newline at end of file
+        return self.origin + t*self.dir
@@ -0,0 +1,281 @@
+"""
+Equal-quality performance regression harness. Run from `src/`:
+
+    python regression.py                      # check every configuration against the baseline history
+    python regression.py --record             # check, then append the results to the history
+    python regression.py --update-references  # re-render the high-spp reference images
+
+Each configuration renders a fixed, seeded scene in progressively doubling sample passes until the image is
+within `target_rmse` of the scene's stored high-spp reference, and the samples per pixel at which the error
+crossed the target are interpolated (the error falls as 1 / sqrt(spp)). The rays traced and the wall time
+(the fastest of several renders) to reach the target are compared with the last recorded result of the
+configuration, and the harness exits with status 1 if either grew by more than its tolerance (time also by
+more than a small noise floor). Rays are deterministic for a given seed; time depends on the machine, so
+baselines should be recorded on the machine that runs the checks.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import datetime
+import subprocess
+
+import settings
+import tuning
+from utils import Point, RGB
+from camera import Camera
+from sphere import Sphere
+from hittable_list import HittableList
+from material import Lambertian, Metal, Dielectric
+from image import Accumulator
+from irradiance_cache import IrradianceCache
+from scene import DEFAULT_CAMERA, random_spheres, camera_kwargs
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "regression")
+REFERENCE_DIR = os.path.join(DATA_DIR, "references")
+HISTORY_FILE = os.path.join(DATA_DIR, "history.json")
+
+WIDTH = 64
+REFERENCE_SPP = 256
+MAX_SPP = 256
+# renders timed per configuration, the fastest counting
+REPEATS = 3
+# differences in time below this many seconds are never regressions
+NOISE_FLOOR = 0.1
+# version of the measurement, recorded with every result; only results of the same version are compared
+METHOD = 2
+SEED = 1
+# references use different sample streams than the measured renders, so their noise is independent
+REFERENCE_SEED = 1_000_003
+
+
+def final_scene() -> HittableList:
+    """The `main.py` scene, with a fixed seed."""
+
+    random.seed(SEED)
+    return random_spheres()
+
+
+def book_scene() -> HittableList:
+    """The scene of the `past_renders` dielectric, metal and fov renders (_Ray Tracing in One Weekend_ ch. 11-13)."""
+
+    world = HittableList()
+    world.add(Sphere(Point(0, -100.5, -1), 100, Lambertian(RGB(0.8, 0.8, 0.0))))
+    world.add(Sphere(Point(0, 0, -1), 0.5, Lambertian(RGB(0.1, 0.2, 0.5))))
+    world.add(Sphere(Point(-1, 0, -1), 0.5, Dielectric(1.5)))
+    world.add(Sphere(Point(-1, 0, -1), -0.4, Dielectric(1.5)))
+    world.add(Sphere(Point(1, 0, -1), 0.5, Metal(RGB(0.8, 0.6, 0.2), 0.0)))
+    return world
+
+
+# name -> (scene builder, camera settings)
+SCENES: dict = {
+    "final": (final_scene, dict(DEFAULT_CAMERA, max_depth=10)),
+    "dielectric": (book_scene, dict(aspect_ratio=16.0 / 9.0, max_depth=50, vfov=90, lookfrom=[0, 0, 0],
+                                    lookat=[0, 0, -1], defocus_angle=0.0)),
+    "fov_wide": (book_scene, dict(aspect_ratio=16.0 / 9.0, max_depth=50, vfov=90, lookfrom=[-2, 2, 1],
+                                  lookat=[0, 0, -1], defocus_angle=0.0)),
+    "fov_narrow": (book_scene, dict(aspect_ratio=16.0 / 9.0, max_depth=50, vfov=20, lookfrom=[-2, 2, 1],
+                                    lookat=[0, 0, -1], defocus_angle=10.0, focus_dist=3.4)),
+}
+
+# name -> (scene, target RMSE, extra `Camera` keyword arguments)
+CONFIGS: dict = {
+    "final": ("final", 0.035, {}),
+    "final-irradiance-cache": ("final", 0.035, {"irradiance_cache": lambda: IrradianceCache(accuracy=0.5, samples=32)}),
+    "dielectric": ("dielectric", 0.025, {}),
+    "fov_wide": ("fov_wide", 0.02, {}),
+    "fov_narrow": ("fov_narrow", 0.035, {}),
+}
+
+
+def make_camera(scene: str, spp: int, seed: int, extra: dict = None) -> Camera:
+    cam_settings = dict(SCENES[scene][1], image_width=WIDTH, samples_per_pixel=spp)
+    options = {k: (v() if callable(v) else v) for k, v in (extra or {}).items()}
+    return Camera(**camera_kwargs(cam_settings), seed=seed, **options)
+
+
+def reference_path(scene: str) -> str:
+    return os.path.join(REFERENCE_DIR, f"{scene}.acc")
+
+
+def render_reference(scene: str, spp: int = REFERENCE_SPP, workers: int = 1) -> None:
+    """Renders and stores the reference accumulation buffer of `scene`."""
+
+    world = SCENES[scene][0]()
+    cam = make_camera(scene, spp, REFERENCE_SEED)
+    accum = Accumulator(cam.image_width, cam.image_height, spp)
+    for j, row in enumerate(cam.render_rows(world, range(cam.image_height), workers)):
+        accum.set_row(j, row)
+    os.makedirs(REFERENCE_DIR, exist_ok=True)
+    accum.save(reference_path(scene))
+
+
+def display(value: float) -> float:
+    """Maps a linear color component to the gamma-corrected [0, 1] range written to images."""
+
+    return min(math.sqrt(max(value, 0.0)), 1.0)
+
+
+def rmse(sums: list[float], spp: int, reference: Accumulator) -> float:
+    """Returns the RMSE between the displayed image of color sums `sums` and that of `reference`."""
+
+    ref, ref_spp = reference.data, reference.samples_per_pixel
+    total = 0.0
+    for s, r in zip(sums, ref):
+        d = display(s / spp) - display(r / ref_spp)
+        total += d * d
+    return math.sqrt(total / len(sums))
+
+
+def render_sums(cam: Camera, world: HittableList, samples: range, sums: list[float]) -> None:
+    """Adds the color sums of the samples `samples` of every pixel to `sums`."""
+
+    k = 0
+    for row in cam.render_rows(world, range(cam.image_height), samples=samples):
+        for c in row:
+            sums[k] += c.x
+            sums[k + 1] += c.y
+            sums[k + 2] += c.z
+            k += 3
+
+
+def measure(name: str, max_spp: int = MAX_SPP, repeats: int = REPEATS) -> dict:
+    """
+    Renders configuration `name` in passes of 1, 1, 2, 4, ... samples per pixel until its RMSE against the
+    reference reaches the target, and returns the samples per pixel, rays and time needed to reach it.
+
+    Since the RMSE falls as 1 / sqrt(spp), the samples per pixel at which it crosses the target are
+    interpolated from the last pass, `target_spp = spp * (rmse / target) ** 2`, and the rays and time are
+    scaled from those of all `spp` samples by `target_spp / spp`. The time is that of the fastest of
+    `repeats` renders of all `spp` samples at once, each with a fresh camera (and irradiance cache).
+    """
+
+    scene, target, extra = CONFIGS[name]
+    reference = Accumulator.load(reference_path(scene))
+    world = SCENES[scene][0]()
+    cam = make_camera(scene, max_spp, SEED, extra)
+
+    settings.init()
+    sums = [0.0] * len(reference.data)
+    spp = previous_spp = 0
+    error = math.inf
+    while spp < max_spp:
+        batch = min(max(spp, 1), max_spp - spp)
+        render_sums(cam, world, range(spp, spp + batch), sums)
+        previous_spp, spp = spp, spp + batch
+        error = rmse(sums, spp, reference)
+        if error <= target:
+            break
+    rays = settings.stats.rays
+
+    seconds = math.inf
+    for _ in range(repeats):
+        cam = make_camera(scene, max_spp, SEED, extra)
+        start = time.perf_counter()
+        render_sums(cam, world, range(spp), [0.0] * len(sums))
+        seconds = min(seconds, time.perf_counter() - start)
+
+    # the crossing lies between the last two passes
+    target_spp = min(max(spp * (error / target) ** 2, previous_spp), spp) if error <= target else spp
+    scale = target_spp / spp
+    return {"config": name, "method": METHOD, "passed_target": error <= target, "rmse": error,
+            "target_rmse": target, "spp": spp, "target_spp": target_spp, "seconds": seconds * scale,
+            "rays": round(rays * scale)}
+
+
+def load_history() -> dict:
+    if not os.path.exists(HISTORY_FILE):
+        return {}
+    with open(HISTORY_FILE) as f:
+        return json.load(f)
+
+
+def save_history(history: dict) -> None:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(HISTORY_FILE, "w") as f:
+        json.dump(history, f, indent=2)
+        f.write("\n")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(result: dict, baseline: dict | None, tolerance: float, rays_tolerance: float) -> list[str]:
+    """
+    Returns the regressions of `result` relative to `baseline`, as messages. Time regresses if it grew by more
+    than `tolerance` and more than `NOISE_FLOOR` seconds; rays, which are deterministic, if they grew by more
+    than `rays_tolerance`.
+    """
+
+    if not result["passed_target"]:
+        return [f"did not reach RMSE {result['target_rmse']} within {result['spp']} spp (got {result['rmse']:.4f})"]
+    if baseline is None or baseline.get("method") != result["method"]:
+        return []
+    problems = []
+    if (result["seconds"] > baseline["seconds"] * (1.0 + tolerance)
+            and result["seconds"] - baseline["seconds"] > NOISE_FLOOR):
+        problems.append(f"seconds {result['seconds']:.4g} > baseline {baseline['seconds']:.4g} "
+                        f"(+{tolerance:.0%} tolerance)")
+    if result["rays"] > baseline["rays"] * (1.0 + rays_tolerance):
+        problems.append(f"rays {result['rays']:.4g} > baseline {baseline['rays']:.4g} "
+                        f"(+{rays_tolerance:.0%} tolerance)")
+    return problems
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Checks time and rays to reach a target RMSE against a baseline.")
+    parser.add_argument("configs", nargs="*", help=f"configurations to run, any of {', '.join(CONFIGS)} (default: all)")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative growth of time")
+    parser.add_argument("--rays-tolerance", type=float, default=0.05, help="allowed relative growth of rays")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="timed renders per configuration")
+    parser.add_argument("--record", action="store_true", help="append the results to the baseline history")
+    parser.add_argument("--update-references", action="store_true", help="re-render the reference images")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="processes used to render references")
+    args = parser.parse_args(argv)
+    # baselines were recorded with the default acceleration and scheduling parameters
+    tuning.use_defaults()
+    for name in args.configs:
+        if name not in CONFIGS:
+            parser.error(f"unknown configuration: {name}")
+    names = args.configs or list(CONFIGS)
+
+    if args.update_references:
+        for scene in sorted({CONFIGS[name][0] for name in names}):
+            sys.stderr.write(f"Rendering reference {scene} at {REFERENCE_SPP} spp\n")
+            render_reference(scene, workers=args.workers)
+
+    history = load_history()
+    failed = False
+    for name in names:
+        result = measure(name, repeats=args.repeats)
+        runs = history.get(name, [])
+        baseline = runs[-1] if runs else None
+        problems = compare(result, baseline, args.tolerance, args.rays_tolerance)
+        status = "FAIL" if problems else "ok" if baseline is not None and baseline.get("method") == METHOD else "new"
+        print(f"{name:<24} {status:<4} {result['seconds']:7.2f}s {result['rays']:>9} rays "
+              f"{result['target_spp']:6.1f} spp  rmse {result['rmse']:.4f} at {result['spp']} spp")
+        for problem in problems:
+            print(f"    {problem}")
+        failed = failed or bool(problems)
+
+        if args.record and result["passed_target"]:
+            result.update(date=datetime.datetime.now().isoformat(timespec="seconds"), commit=git_commit())
+            history.setdefault(name, []).append(result)
+
+    if args.record:
+        save_history(history)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import os
+import json
+
+from utils import Vector, RGB, Point, rand_float
+from hittable_list import HittableList
+from sphere import Sphere
+from material import Material, Lambertian, Metal, Dielectric, DiffuseLight
+from texture import ImageTexture, TiledTexture
+
+
+# camera settings of the final render, used when a scene does not specify its own
+DEFAULT_CAMERA: dict = {
+    "aspect_ratio": 16.0 / 9.0,
+    "image_width": 1200,
+    "samples_per_pixel": 250,
+    "max_depth": 50,
+    "vfov": 20,
+    "lookfrom": [13, 2, 3],
+    "lookat": [0, 0, 0],
+    "vup": [0, 1, 0],
+    "defocus_angle": 0.6,
+    "focus_dist": 10.0,
+}
+
+
+def random_spheres(n: int = 11, density: float = 1) -> HittableList:
+    """
+    Builds the final scene of _Ray Tracing in One Weekend_: a field of small spheres of random materials
+    on a large ground sphere, plus three large spheres.
+    """
+
+    world: HittableList = HittableList()
+
+    ground_material: Lambertian = Lambertian(RGB(0.5, 0.5, 0.5))
+    world.add(Sphere(Point(0, -1000, 0), 1000, ground_material))
+
+    spheres: list[Sphere] = []
+    # Create and randomly position spheres of random material types into the scene
+    for a in range(-n, n):
+        for b in range(-n, n):
+            choose_mat: float = rand_float()
+            center: Point = Point(a / density + 0.9 * rand_float(), 0.2, b / density + 0.9 * rand_float())
+
+            if (center - Point(4, 0.2, 0)).length() > 0.9:
+                if choose_mat < 0.8:
+                    # diffuse
+                    albedo: RGB = RGB.random() * RGB.random()
+                    sphere_material: Lambertian = Lambertian(albedo)
+                    spheres.append(Sphere(center, 0.2, sphere_material))
+                elif choose_mat < 0.95:
+                    # metal
+                    albedo: RGB = RGB.random(0.5, 1)
+                    fuzz: float = rand_float(0, 0.5)
+                    sphere_material: Metal = Metal(albedo, fuzz)
+                    spheres.append(Sphere(center, 0.2, sphere_material))
+                else:
+                    # dielectric (glass)
+                    sphere_material: Dielectric = Dielectric(1.5)
+                    spheres.append(Sphere(center, 0.2, sphere_material))
+
+    # Sphere 1
+    material1: Dielectric = Dielectric(1.5)
+    spheres.append(Sphere(Point(0, 1, 0), 1.0, material1))
+    # Sphere 2
+    material2: Lambertian = Lambertian(RGB(1.0, 0.2, 0.1))
+    spheres.append(Sphere(Point(-4, 1, 0), 1.0, material2))
+    # Sphere 3
+    material3: Metal = Metal(RGB(0.7, 0.6, 0.5), 0.0)
+    spheres.append(Sphere(Point(4, 1, 0), 1.0, material3))
+
+    # the world builds and caches its own BVH on the first ray query
+    world.extend(spheres)
+    return world
+
+
+# camera settings of `light_box`
+LIGHT_BOX_CAMERA: dict = {
+    "aspect_ratio": 1.0,
+    "image_width": 400,
+    "samples_per_pixel": 64,
+    "max_depth": 8,
+    "vfov": 70,
+    "lookfrom": [0, 2, 3],
+    "lookat": [0, 1, 0],
+    "vup": [0, 1, 0],
+    "defocus_angle": 0.0,
+    "focus_dist": 10.0,
+}
+
+
+def light_box() -> HittableList:
+    """
+    Builds a closed room lit only by a small, bright lamp tucked under a shade against the ceiling: nearly
+    all the light reaching the room's contents has bounced off the ceiling first, the case where sampling
+    scattered directions from the materials alone finds the light least often.
+    """
+
+    objects: list[Sphere] = [
+        # the room: the inside of a sphere, floor, walls and ceiling alike
+        Sphere(Point(0, 3, 0), 4.0, Lambertian(RGB(0.3, 0.3, 0.3))),
+        # the lamp
+        Sphere(Point(0, 5.5, 0), 0.6, DiffuseLight(RGB(30.0, 28.5, 25.5))),
+        # the room's contents, standing on the floor
+        Sphere(Point(-2.2, 0, 0), 1.0, Lambertian(RGB(0.8, 0.3, 0.2))),
+        Sphere(Point(0, 0, -1.0), 1.0, Metal(RGB(0.8, 0.8, 0.7), 0.3)),
+        Sphere(Point(2.2, 0, 0), 1.0, Lambertian(RGB(0.2, 0.4, 0.8))),
+    ]
+    world: HittableList = HittableList()
+    world.extend(objects)
+    return world
+
+
+def parse_texture(desc: dict, base_dir: str) -> ImageTexture | None:
+    """
+    Constructs the albedo texture of a material description, if it has a `texture` image (a path relative to
+    the scene file), whose colors are multiplied by `albedo`.
+    """
+
+    if "texture" not in desc:
+        return None
+    image = TiledTexture.load(os.path.join(base_dir, desc["texture"]))
+    return ImageTexture(image, RGB(*desc.get("albedo", [1, 1, 1])))
+
+
+def parse_material(desc: dict, base_dir: str = ".") -> Material:
+    """Constructs a `Material` from its scene file description."""
+
+    kind = desc.get("type", "lambertian")
+    texture = parse_texture(desc, base_dir)
+    albedo = RGB(*desc.get("albedo", [1, 1, 1]))
+    if kind == "lambertian":
+        return Lambertian(albedo, texture)
+    if kind == "metal":
+        return Metal(albedo, desc.get("fuzz", 0.0), texture)
+    if kind == "dielectric":
+        return Dielectric(desc["ir"])
+    if kind == "diffuse_light":
+        return DiffuseLight(RGB(*desc["emission"]))
+    raise ValueError(f"Unknown material type: {kind}")
+
+
+def load_scene(path: str) -> tuple[HittableList, dict]:
+    """
+    Loads a scene from a JSON file and returns the world along with the camera settings of the scene.
+
+    The file holds an optional `camera` object (keyword arguments of `Camera`, with points given as lists),
+    a `materials` object mapping names to material descriptions and an `objects` list, e.g.
+
+        {
+            "camera": {"vfov": 20, "lookfrom": [13, 2, 3]},
+            "materials": {"ground": {"type": "lambertian", "albedo": [0.5, 0.5, 0.5]},
+                          "earth": {"type": "lambertian", "texture": "earthmap.ppm"}},
+            "objects": [{"type": "sphere", "center": [0, -1000, 0], "radius": 1000, "material": "ground"}]
+        }
+
+    A scene may instead set `"builtin": "random_spheres"` or `"builtin": "light_box"` to use `random_spheres()`
+    or `light_box()` (with its own default camera) as its objects. Light sources are spheres of material
+    `{"type": "diffuse_light", "emission": [r, g, b]}`.
+    Texture images (PPM, PFM or .hdr) are converted to tiled texture files next to them on first use.
+    """
+
+    with open(path) as f:
+        desc: dict = json.load(f)
+
+    camera: dict = dict(DEFAULT_CAMERA)
+    camera.update(desc.get("camera", {}))
+
+    if desc.get("builtin") == "random_spheres":
+        return random_spheres(), camera
+    if desc.get("builtin") == "light_box":
+        camera = dict(LIGHT_BOX_CAMERA)
+        camera.update(desc.get("camera", {}))
+        return light_box(), camera
+    if "builtin" in desc:
+        raise ValueError(f"Unknown builtin scene: {desc['builtin']}")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    materials: dict[str, Material] = {name: parse_material(m, base_dir) for name, m in desc.get("materials", {}).items()}
+
+    objects: list[Sphere] = []
+    for obj in desc.get("objects", []):
+        if obj.get("type", "sphere") != "sphere":
+            raise ValueError(f"Unknown object type: {obj['type']}")
+        mat = obj["material"]
+        mat = materials[mat] if isinstance(mat, str) else parse_material(mat, base_dir)
+        objects.append(Sphere(Point(*obj["center"]), obj["radius"], mat))
+
+    world: HittableList = HittableList()
+    world.extend(objects)
+    return world, camera
+
+
+def camera_kwargs(settings: dict) -> dict:
+    """Converts scene file camera settings into keyword arguments for `Camera`."""
+
+    kwargs: dict = dict(settings)
+    for key in ("lookfrom", "lookat", "vup"):
+        if isinstance(kwargs.get(key), (list, tuple)):
+            kwargs[key] = Vector(*kwargs[key])
+    return kwargs
@@ -0,0 +1,185 @@
+"""
+Rendering camera paths (turntables, fly-throughs) as image sequences. The scene and its BVH are built once,
+one pool of workers (processes or threads, by `Camera.backend`) receives them once and stays up for the
+whole sequence, and each frame only sends its camera settings. Scanlines of all frames go through a single
+stream of tasks, handed out `Camera.rows_per_task` at a time, or in bands of `Camera.packet_size` rows
+traced as packets, so workers move on to the next frame while the last rows of the previous one finish, and
+finished frames are written to disk by a separate thread while the next ones render.
+"""
+import math
+import time
+import queue
+import threading
+import multiprocessing
+import multiprocessing.pool
+
+import settings
+from camera import Camera
+from hittable import Hittable
+from hittable_list import HittableList
+from image import Accumulator
+from scene import camera_kwargs
+
+
+class SequenceReport:
+    """Setup, per-frame and write times of a sequence render."""
+
+    def __init__(self, setup_seconds: float) -> None:
+        self.setup_seconds = setup_seconds  # BVH build and worker pool start-up, paid once
+        self.frames: list[dict] = []  # one {"frame", "path", "seconds", "rays"} per frame
+        self.write_seconds = 0.0  # time spent writing images, overlapped with rendering
+        self.total_seconds = 0.0
+
+    @property
+    def amortized_setup_seconds(self) -> float:
+        return self.setup_seconds / len(self.frames) if self.frames else self.setup_seconds
+
+    def as_dict(self) -> dict:
+        return {"setup_seconds": self.setup_seconds, "amortized_setup_seconds": self.amortized_setup_seconds,
+                "write_seconds": self.write_seconds, "total_seconds": self.total_seconds, "frames": self.frames}
+
+    def __str__(self) -> str:
+        lines = [f"{'frame':>5} {'seconds':>8} {'rays':>10}  path"]
+        for f in self.frames:
+            lines.append(f"{f['frame']:>5} {f['seconds']:>8.2f} {f['rays']:>10}  {f['path']}")
+        lines.append(f"setup {self.setup_seconds:.2f}s once, {self.amortized_setup_seconds:.3f}s per frame; "
+                     f"writes {self.write_seconds:.2f}s (overlapped); total {self.total_seconds:.2f}s")
+        return "\n".join(lines) + "\n"
+
+
+def turntable(cam_settings: dict, count: int) -> list[dict]:
+    """
+    Returns the camera settings of `count` frames orbiting `lookat` once about the vertical axis, starting
+    from `lookfrom` and keeping its height and distance.
+    """
+
+    lookfrom, lookat = cam_settings["lookfrom"], cam_settings["lookat"]
+    dx, dz = lookfrom[0] - lookat[0], lookfrom[2] - lookat[2]
+    radius, start = math.hypot(dx, dz), math.atan2(dz, dx)
+    frames = []
+    for k in range(count):
+        angle = start + 2 * math.pi * k / count
+        frames.append({"lookfrom": [lookat[0] + radius * math.cos(angle), lookfrom[1],
+                                    lookat[2] + radius * math.sin(angle)]})
+    return frames
+
+
+def render_sequence(world: Hittable, cam_settings: dict, frames: list[dict], output: str, workers: int = 1,
+                    camera_options: dict = None) -> SequenceReport:
+    """
+    Renders one image per entry of `frames`, each a dict of camera settings (`lookfrom`, `lookat`, `vfov`,
+    `focus_dist`, ...) overriding `cam_settings`, to the path `output % frame_index`. `camera_options` are
+    extra `Camera` keyword arguments shared by all frames (seed, environment map, ...).
+    """
+
+    camera_options = camera_options or {}
+    start = time.perf_counter()
+    cameras = [Camera(**camera_kwargs(dict(cam_settings, **frame)), **camera_options) for frame in frames]
+    if isinstance(world, HittableList):
+        world.build()
+    # the tuned parameters are resolved once here and handed to the workers, like `Camera.pool` does
+    tuned = {name: cameras[0].tuned(name) for name in Camera.TUNED}
+    pool = None
+    if workers > 1:
+        initargs = (world, camera_options, tuned)
+        if tuned["backend"] == "thread":
+            if camera_options.get("irradiance_cache") is not None:
+                raise ValueError("the thread backend cannot share an irradiance cache between threads")
+            pool = multiprocessing.pool.ThreadPool(workers, initializer=_init_sequence_worker, initargs=initargs)
+        else:
+            pool = multiprocessing.Pool(workers, initializer=_init_sequence_worker, initargs=initargs)
+    report = SequenceReport(time.perf_counter() - start)
+
+    # frames are handed to the writer thread as soon as their last row arrives
+    pending: queue.Queue = queue.Queue(maxsize=2)
+    # the first error of the writer thread, raised in this thread; the writer keeps draining the queue after it
+    # so that rendering never blocks on a full queue
+    errors: list[Exception] = []
+
+    def write_frames() -> None:
+        while (item := pending.get()) is not None:
+            if errors:
+                continue
+            path, accum = item
+            write_start = time.perf_counter()
+            try:
+                with open(path, "w") as out:
+                    accum.write_ppm(out)
+            except Exception as e:
+                errors.append(e)
+            report.write_seconds += time.perf_counter() - write_start
+
+    writer = threading.Thread(target=write_frames)
+    writer.start()
+    try:
+        # with packets, each task is a band of `packet_size` rows; otherwise single rows, `rows_per_task` at a time
+        n = max(tuned["packet_size"], 1)
+        tasks = ((k, list(range(j, min(j + n, cameras[k].image_height))), {**cam_settings, **frame})
+                 for k, frame in enumerate(frames) for j in range(0, cameras[k].image_height, n))
+        if pool is None:
+            results = (_render_sequence_rows(task, cameras[task[0]], world) for task in tasks)
+        else:
+            results = pool.imap(_render_sequence_task, tasks, tuned["rows_per_task"] if n == 1 else 1)
+
+        accum, rays, frame_start = None, 0, time.perf_counter()
+        for k, rows, colors, task_rays in results:
+            cam = cameras[k]
+            if accum is None:
+                accum = Accumulator(cam.image_width, cam.image_height, cam.samples_per_pixel)
+            for j, row in zip(rows, colors):
+                accum.set_row(j, row)
+            rays += task_rays
+            if rows[-1] == cam.image_height - 1:
+                now = time.perf_counter()
+                path = output % k
+                report.frames.append({"frame": k, "path": path, "seconds": now - frame_start, "rays": rays})
+                if errors:
+                    raise errors[0]
+                pending.put((path, accum))
+                accum, rays, frame_start = None, 0, now
+    finally:
+        pending.put(None)
+        writer.join()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if errors:
+        raise errors[0]
+
+    report.total_seconds = time.perf_counter() - start
+    return report
+
+
+def _render_sequence_rows(task: tuple, cam: Camera, world: Hittable) -> tuple[int, list[int], list[list], int]:
+    k, rows, _ = task
+    rays = settings.stats.rays
+    if cam.tuned("packet_size") > 1:
+        colors = cam.render_block_rows(rows, world)
+    else:
+        colors = [cam.render_row(j, world) for j in rows]
+    return k, rows, colors, settings.stats.rays - rays
+
+
+# per-worker state of sequence workers: the world, shared camera options and tuned parameters are received
+# once, and the camera of the frame currently being rendered is rebuilt from its settings when the frame
+# changes (per thread, for the thread backend)
+_worker_world: Hittable = None
+_worker_options: dict = None
+_worker_tuned: dict = None
+_worker_frame = threading.local()
+
+def _init_sequence_worker(world: Hittable, camera_options: dict, tuned: dict) -> None:
+    global _worker_world, _worker_options, _worker_tuned
+    settings.init()
+    _worker_world = world
+    _worker_options = camera_options
+    _worker_tuned = tuned
+
+def _render_sequence_task(task: tuple) -> tuple[int, list[int], list[list], int]:
+    k, _, frame_settings = task
+    if getattr(_worker_frame, "index", None) != k:
+        cam = Camera(**camera_kwargs(frame_settings), **_worker_options)
+        for name, value in _worker_tuned.items():
+            setattr(cam, name, value)
+        _worker_frame.index, _worker_frame.camera = k, cam
+    return _render_sequence_rows(task, _worker_frame.camera, _worker_world)
@@ -1,4 +1,24 @@
+import threading
+
+
+class Stats(threading.local):
+    """
+    Traversal and ray counters. Every thread has its own, so render threads sharing a scene never write to
+    the same counter.
+    """
+
+    count = 0  # BVH nodes visited
+    max_depth = 0  # deepest BVH node at which a traversal ended
+    rays = 0  # rays traced
+
+
+# the calling thread's counters
+stats = Stats()
+
+
 def init():
-    global count, max_depth
-    count = 0
-    max_depth = 0
\ No newline at end of file
+    """Resets the calling thread's counters."""
+
+    stats.count = 0
+    stats.max_depth = 0
+    stats.rays = 0
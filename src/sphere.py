@@ -21,33 +21,63 @@ class Sphere(Hittable):
     def bounding_box(self) -> AABB:
         return self.bbox;
 
-    def hit(self, _r: Ray, ray_t: Interval) -> (HitRecord | None):
+    def intersect(self, _r: Ray, t_min: float, t_max: float) -> tuple[float, Hittable] | None:
         """
-        Returns true if hit by the ray any t within an interval, and updates the hit record information
-        accordingly in O(1) time.
-        Calculates the surface normal, whether the sphere was hit from the outside, the point and time (t) 
-        of contact.
+        Returns the time (t) of the nearest intersection with the ray within (`t_min`, `t_max`) in O(1) time,
+        without allocating any vectors.
         """
 
-        oc = _r.origin - self.center
-        a = _r.dir.length_squared()
-        half_b = dot(oc, _r.dir)
-        c = oc.length_squared() - self.radius * self.radius
+        ox, oy, oz = _r.orig
+        d = _r.dir
+        center = self.center
+        ocx, ocy, ocz = ox - center.x, oy - center.y, oz - center.z
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        half_b = ocx * d.x + ocy * d.y + ocz * d.z
+        c = ocx * ocx + ocy * ocy + ocz * ocz - self.radius * self.radius
 
         disc = half_b * half_b - a * c
         if disc < 0:
             return None
         sqrtd = math.sqrt(disc)
 
-        # find nearest root within [ray_tmin, ray_tmax]
+        # find nearest root within (t_min, t_max)
         root = (-half_b - sqrtd) / a
-        if not ray_t.surrounds(root):
+        if not t_min < root < t_max:
             root = (-half_b + sqrtd) / a
-            if not ray_t.surrounds(root):
+            if not t_min < root < t_max:
                 return None
 
-        rec = HitRecord(p=_r.at(root), t=root, mat=self.mat)
+        return root, self
+
+    def hit_record(self, _r: Ray, t: float) -> HitRecord:
+        """
+        Calculates the surface normal, whether the sphere was hit from the outside, the point and time (t)
+        of contact.
+        """
+
+        rec = HitRecord(p=_r.at(t), t=t, mat=self.mat, primitive=self)
         outward_normal: Vector = (rec.p - self.center) / self.radius
         rec.set_face_normal(_r, outward_normal)
 
         return rec
+
+    def surface_uv(self, p: Point) -> tuple[float, float]:
+        """
+        Returns the (u, v) coordinates of point `p` on the sphere: u is the angle around the y axis from -x
+        (through -z, +x and +z), v the angle from the bottom (-y) to the top (+y), both scaled to [0, 1].
+        """
+
+        r = abs(self.radius)
+        return sphere_uv((p.x - self.center.x) / r, (p.y - self.center.y) / r, (p.z - self.center.z) / r)
+
+    @property
+    def uv_scale(self) -> float:
+        return 2 * math.pi * abs(self.radius)
+
+
+def sphere_uv(x: float, y: float, z: float) -> tuple[float, float]:
+    """Returns the (u, v) coordinates of a point (x, y, z) of the unit sphere."""
+
+    theta = math.acos(max(-1.0, min(1.0, -y)))
+    phi = math.atan2(-z, x) + math.pi
+    return phi / (2 * math.pi), theta / math.pi
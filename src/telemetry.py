@@ -0,0 +1,272 @@
+"""
+Live render metrics. A `Telemetry` object is fed one update per finished scanline by `Camera.render_rows`,
+and a background thread publishes a snapshot every `interval` seconds to a JSON status file (replaced
+atomically, so readers never see a partial file) and/or serves it over HTTP or a Unix socket:
+
+    GET /metrics    Prometheus text format
+    GET /status     the JSON status
+
+Publishing never happens on the render path; updates only take a lock and add a few numbers.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import datetime
+import threading
+import socketserver
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def current_rss_bytes() -> int:
+    """Returns the current resident set size of this process in bytes (the peak where it is unavailable)."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class WorkerStats:
+    """Totals reported by one render process."""
+
+    __slots__ = ("rows", "samples", "rays", "seconds", "rss", "last")
+
+    def __init__(self, now: float) -> None:
+        self.rows = 0
+        self.samples = 0
+        self.rays = 0
+        self.seconds = 0.0  # time spent tracing, as measured by the worker
+        self.rss = 0
+        self.last = now
+
+
+class Telemetry:
+    """
+    Collects render progress and publishes it.
+    - `status_path`: JSON status file rewritten every `interval` seconds
+    - `address`: `host:port` (or `:port` for localhost) for an HTTP endpoint, or `unix:/path` for a Unix socket
+    - `window`: length in seconds of the sliding window over which ray and sample rates (and so the ETA) are
+    measured, so that they follow the current speed rather than the average since the start
+    """
+
+    def __init__(self, status_path: str = None, address: str = None, interval: float = 1.0,
+                 window: float = 10.0) -> None:
+        self.status_path = status_path
+        self.address = address
+        self.interval = interval
+        self.window = window
+        self.lock = threading.Lock()
+        self.server: socketserver.BaseServer | None = None
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+        self.reset(0, 0)
+
+    def reset(self, samples_total: int, rows_total: int) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.state = "running"
+            self.started = datetime.datetime.now().isoformat(timespec="seconds")
+            self.start = now
+            self.samples_total = samples_total
+            self.rows_total = rows_total
+            self.rows = 0
+            self.samples = 0
+            self.rays = 0
+            self.last_progress = now
+            # (time, cumulative samples, cumulative rays) of recent updates
+            self.history: deque[tuple[float, int, int]] = deque([(now, 0, 0)])
+            self.workers: dict[str, WorkerStats] = {}
+
+    def begin(self, samples_total: int, rows_total: int) -> None:
+        """Starts measuring a render of `samples_total` samples in `rows_total` scanlines, and starts publishing."""
+
+        self.reset(samples_total, rows_total)
+        if self.address and self.server is None:
+            self.server = make_server(self.address, self)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.publish_loop, daemon=True)
+            self.thread.start()
+
+    def update(self, worker: str, samples: int, rays: int, seconds: float, rss: int) -> None:
+        """Records a finished scanline of `samples` samples and `rays` rays, traced in `seconds` by `worker`."""
+
+        now = time.monotonic()
+        with self.lock:
+            self.rows += 1
+            self.samples += samples
+            self.rays += rays
+            self.last_progress = now
+            self.history.append((now, self.samples, self.rays))
+            while len(self.history) > 2 and self.history[1][0] < now - self.window:
+                self.history.popleft()
+
+            stats = self.workers.get(worker)
+            if stats is None:
+                stats = self.workers[worker] = WorkerStats(now)
+            stats.rows += 1
+            stats.samples += samples
+            stats.rays += rays
+            stats.seconds += seconds
+            stats.rss = rss
+            stats.last = now
+
+    def finish(self) -> None:
+        """Marks the render done and publishes the final status. The endpoint keeps serving it until `close`."""
+
+        with self.lock:
+            self.state = "done"
+        self.stop_publishing()
+        self.publish()
+
+    def close(self) -> None:
+        self.stop_publishing()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stop_publishing(self) -> None:
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def snapshot(self) -> dict:
+        """Returns the current metrics as a JSON-serializable dict."""
+
+        now = time.monotonic()
+        with self.lock:
+            t0, samples0, rays0 = self.history[0]
+            span = now - t0
+            samples_rate = (self.samples - samples0) / span if span > 0 else 0.0
+            rays_rate = (self.rays - rays0) / span if span > 0 else 0.0
+            remaining = self.samples_total - self.samples
+            if self.state == "done" or remaining <= 0:
+                eta = 0.0
+            else:
+                eta = remaining / samples_rate if samples_rate > 0 else None
+
+            workers = {}
+            worker_rss = 0
+            for name, w in self.workers.items():
+                workers[name] = {"rows": w.rows, "samples": w.samples, "rays": w.rays,
+                                 "rays_per_second": w.rays / w.seconds if w.seconds > 0 else 0.0,
+                                 "rss_bytes": w.rss, "seconds_since_update": now - w.last}
+                if name != "main":
+                    worker_rss += w.rss
+
+            return {"state": self.state, "started": self.started, "elapsed_seconds": now - self.start,
+                    "fraction_done": self.samples / self.samples_total if self.samples_total else 0.0,
+                    "rows_done": self.rows, "rows_total": self.rows_total,
+                    "samples_done": self.samples, "samples_total": self.samples_total, "rays": self.rays,
+                    "rays_per_second": rays_rate, "samples_per_second": samples_rate, "eta_seconds": eta,
+                    "seconds_since_progress": now - self.last_progress,
+                    "rss_bytes": current_rss_bytes() + worker_rss, "workers": workers}
+
+    def publish_loop(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.publish()
+
+    def publish(self) -> None:
+        if self.status_path:
+            write_status(self.status_path, self.snapshot())
+
+
+def write_status(path: str, status: dict) -> None:
+    """Replaces the file at `path` with `status` as JSON in a single rename."""
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def prometheus_text(status: dict) -> str:
+    """Formats a `Telemetry.snapshot` in the Prometheus text exposition format."""
+
+    lines = []
+
+    def metric(name: str, kind: str, help: str, samples: list[tuple[str, float]]) -> None:
+        lines.append(f"# HELP pyrt_{name} {help}")
+        lines.append(f"# TYPE pyrt_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"pyrt_{name}{labels} {value}")
+
+    metric("fraction_done", "gauge", "Fraction of the render's samples traced.", [("", status["fraction_done"])])
+    metric("samples_done_total", "counter", "Samples traced.", [("", status["samples_done"])])
+    metric("samples_planned", "gauge", "Samples in the render.", [("", status["samples_total"])])
+    metric("rays_total", "counter", "Rays traced.", [("", status["rays"])])
+    metric("rays_per_second", "gauge", "Rays traced per second over the sliding window.",
+           [("", status["rays_per_second"])])
+    if status["eta_seconds"] is not None:
+        metric("eta_seconds", "gauge", "Estimated seconds until the render is done.", [("", status["eta_seconds"])])
+    metric("seconds_since_progress", "gauge", "Seconds since a scanline last finished.",
+           [("", status["seconds_since_progress"])])
+    metric("rss_bytes", "gauge", "Resident memory of the render and its workers.", [("", status["rss_bytes"])])
+    metric("running", "gauge", "1 while the render is running, 0 once done.",
+           [("", 1 if status["state"] == "running" else 0)])
+
+    workers = status["workers"].items()
+    metric("worker_rays_per_second", "gauge", "Rays traced per second of tracing, per render process.",
+           [(f'{{worker="{name}"}}', w["rays_per_second"]) for name, w in workers])
+    metric("worker_samples_total", "counter", "Samples traced per render process.",
+           [(f'{{worker="{name}"}}', w["samples"]) for name, w in workers])
+    metric("worker_rss_bytes", "gauge", "Resident memory per render process.",
+           [(f'{{worker="{name}"}}', w["rss_bytes"]) for name, w in workers])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        status = self.server.telemetry.snapshot()
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, kind = prometheus_text(status).encode(), "text/plain; version=0.0.4"
+        elif path == "/status":
+            body, kind = json.dumps(status).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def make_server(address: str, telemetry: Telemetry) -> socketserver.BaseServer:
+    """Starts listening on `address` (`host:port`, `:port` or `unix:/path`) for metrics requests."""
+
+    if address.startswith("unix:"):
+        server = UnixHTTPServer(address[len("unix:"):], MetricsHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsHandler)
+    server.telemetry = telemetry
+    return server
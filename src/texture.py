@@ -0,0 +1,364 @@
+"""
+Image textures. Source images are converted once to a tiled, mip-mapped texture file, and rendering reads
+square tiles of it on demand through a least-recently-used `TileCache` with a fixed memory budget shared by
+all textures, so the memory used does not depend on the size or number of textures a scene references.
+Conversion streams the image row by row, so it does not hold the image in memory either.
+
+Texture file layout (little endian):
+
+    header   magic, width, height, tile size, mip levels
+    tiles    for each level from full resolution down to 1x1, tiles in row-major order, each `tile_size`^2
+             RGB texels of one byte per channel (gamma 2 encoded like the rendered images), edge tiles padded
+"""
+import os
+import math
+import struct
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import Iterator
+
+from utils import RGB, Point
+from environment import read_pfm_rows, read_hdr_rows
+
+
+class TileCache:
+    """
+    Least-recently-used cache of texture tiles, holding at most `max_bytes` of texel data. Lookups are
+    serialized by a lock, since render threads share the cache (and the texture files tiles are read from).
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20) -> None:
+        self.max_bytes = max_bytes
+        self.tiles: OrderedDict[tuple, bytes] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return (f"texture cache: {self.hits + self.misses} tile lookups, {self.hit_rate:.1%} hit rate, "
+                f"{self.misses} loads, {self.evictions} evictions, {self.bytes / (1 << 20):.1f} MB held")
+
+    def get(self, texture: 'TiledTexture', level: int, tx: int, ty: int) -> bytes:
+        """Returns the texels of a tile, loading it (and evicting the least recently used tiles) on a miss."""
+
+        key = (texture.path, level, tx, ty)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.hits += 1
+                self.tiles.move_to_end(key)
+                return tile
+
+            self.misses += 1
+            tile = texture.load_tile(level, tx, ty)
+            size = len(tile)
+            while self.tiles and self.bytes + size > self.max_bytes:
+                _, old = self.tiles.popitem(last=False)
+                self.bytes -= len(old)
+                self.evictions += 1
+            self.tiles[key] = tile
+            self.bytes += size
+            return tile
+
+
+# tiles of every texture in this process share one budget
+tile_cache = TileCache()
+
+# linear value of each byte of a texture file
+DECODE = array("f", [(k / 255) ** 2 for k in range(256)])
+
+
+def read_image(path: str) -> tuple[int, int, list[float]]:
+    """
+    Reads a PPM (P3 or P6), PFM or Radiance .hdr image and returns its width, height and linear RGB values
+    in row-major order, top row first. 8-bit images are decoded with the renderer's gamma 2.
+    """
+
+    width, height, rows = read_image_rows(path)
+    data = []
+    for row in rows:
+        data.extend(row)
+    return width, height, data
+
+
+def read_image_rows(path: str) -> tuple[int, int, Iterator]:
+    """
+    Returns the width and height of a PPM (P3 or P6), PFM or Radiance .hdr image and an iterator over its rows
+    of linear RGB values, top row first, each read from the file when reached. See `read_image`.
+    """
+
+    lower = path.lower()
+    if lower.endswith(".pfm"):
+        return read_pfm_rows(path)
+    if lower.endswith(".hdr"):
+        return read_hdr_rows(path)
+
+    with open(path, "rb") as f:
+        kind = f.read(2)
+        if kind not in (b"P3", b"P6"):
+            raise ValueError(f"{path} is not a PPM, PFM or Radiance HDR image")
+        # the header is four whitespace separated tokens, possibly with comments, and the single whitespace
+        # character after the last one
+        tokens = []
+        token = b""
+        while len(tokens) < 3:
+            c = f.read(1)
+            if not c:
+                raise ValueError(f"{path}: truncated PPM header")
+            if c == b"#" and not token:
+                f.readline()
+            elif c.isspace():
+                if token:
+                    tokens.append(int(token))
+                    token = b""
+            else:
+                token += c
+        offset = f.tell()
+    width, height, maxval = tokens
+    linear = [(v / maxval) ** 2 for v in range(maxval + 1)]
+
+    def rows() -> Iterator[array]:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            if kind == b"P6":
+                for _ in range(height):
+                    yield array("d", map(linear.__getitem__, f.read(3 * width)))
+                return
+            values = ppm_values(f)
+            for _ in range(height):
+                yield array("d", (linear[next(values)] for _ in range(3 * width)))
+
+    return width, height, rows()
+
+
+def ppm_values(f, chunk_size: int = 1 << 20) -> Iterator[int]:
+    """Yields the whitespace separated integers of the rest of file `f`, reading it in chunks."""
+
+    rest = b""
+    while chunk := f.read(chunk_size):
+        tokens = (rest + chunk).split()
+        # the last token may continue in the next chunk
+        rest = tokens.pop() if tokens and not chunk[-1:].isspace() else b""
+        yield from map(int, tokens)
+    if rest:
+        yield int(rest)
+
+
+def mip_layout(width: int, height: int, tile_size: int) -> list[tuple[int, int, int]]:
+    """Returns the width, height and file offset of the tiles of each mip level of a texture file."""
+
+    layout = []
+    offset = TiledTexture.HEADER.size
+    tile_bytes = 3 * tile_size * tile_size
+    w, h = width, height
+    while True:
+        layout.append((w, h, offset))
+        if w == 1 and h == 1:
+            return layout
+        offset += -(-w // tile_size) * -(-h // tile_size) * tile_bytes
+        w, h = max(1, w // 2), max(1, h // 2)
+
+
+class MipLevelWriter:
+    """
+    Writes the rows of one mip level of a texture file as they arrive, one band of `tile_size` rows at a
+    time, and hands the rows of the next, half-sized level (2x2 box filtered, repeating the last column of odd
+    widths and the row of a one row high level) to `below`. Only the current band and one pending row are
+    held.
+    """
+
+    def __init__(self, f, width: int, height: int, offset: int, tile_size: int,
+                 below: 'MipLevelWriter | None') -> None:
+        self.f = f
+        self.width, self.height = width, height
+        self.offset = offset
+        self.tile_size = tile_size
+        self.below = below
+        self.band: list = []
+        self.rows = 0  # rows received so far
+        self.pending = None  # even row waiting for the odd row below it
+
+    def add(self, row) -> None:
+        j = self.rows
+        self.rows += 1
+        self.band.append(row)
+        if len(self.band) == self.tile_size or self.rows == self.height:
+            self.write_band(j // self.tile_size)
+            self.band = []
+
+        below = self.below
+        if below is None:
+            return
+        if j % 2 == 1:
+            below.add(self.downsample(self.pending, row))
+            self.pending = None
+        elif self.height == 1:
+            below.add(self.downsample(row, row))
+        elif j + 1 < self.height:
+            self.pending = row
+        # the last row of an odd height level is dropped
+
+    def downsample(self, top, bottom) -> array:
+        w = self.width
+        nw = max(1, w // 2)
+        down = array("d", bytes(8 * 3 * nw))
+        for i in range(nw):
+            i0, i1 = min(2 * i, w - 1), min(2 * i + 1, w - 1)
+            for c in range(3):
+                down[3 * i + c] = 0.25 * (top[3 * i0 + c] + top[3 * i1 + c] + bottom[3 * i0 + c] + bottom[3 * i1 + c])
+        return down
+
+    def write_band(self, band_index: int) -> None:
+        """Encodes the tiles of the current band and writes them, contiguous in the file, in place."""
+
+        t, w = self.tile_size, self.width
+        across = -(-w // t)
+        tiles = bytearray(across * 3 * t * t)
+        for jj, row in enumerate(self.band):
+            for i in range(w):
+                k = 3 * ((i // t) * t * t + jj * t + i % t)
+                for c in range(3):
+                    v = math.sqrt(max(row[3 * i + c], 0.0))
+                    tiles[k + c] = min(int(v * 255 + 0.5), 255)
+        self.f.seek(self.offset + band_index * len(tiles))
+        self.f.write(tiles)
+
+
+def convert_texture(src: str, dst: str, tile_size: int = 64) -> None:
+    """
+    Converts image `src` to the tiled, mip-mapped texture file `dst`. The image is streamed through a chain
+    of `MipLevelWriter`s, one per level, so at most `tile_size` rows of each level are in memory at once
+    (about 2 * 24 * `tile_size` bytes per pixel of width in all), however large the image.
+    """
+
+    width, height, rows = read_image_rows(src)
+    layout = mip_layout(width, height, tile_size)
+
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(TiledTexture.HEADER.pack(TiledTexture.MAGIC, width, height, tile_size, len(layout)))
+        writer = None
+        for w, h, offset in reversed(layout):
+            writer = MipLevelWriter(f, w, h, offset, tile_size, writer)
+        for row in rows:
+            writer.add(row)
+    os.replace(tmp_path, dst)
+
+
+class TiledTexture:
+    """
+    A texture file opened for reading tiles on demand. Only the header is read when opening; texels are
+    read through `tile_cache`.
+    """
+
+    MAGIC = b"PYRTTEX1"
+    HEADER = struct.Struct("<8sIIII")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            magic, self.width, self.height, self.tile_size, self.levels = self.HEADER.unpack(f.read(self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a texture file")
+
+        # size and file offset of the tiles of each mip level
+        layout = mip_layout(self.width, self.height, self.tile_size)[:self.levels]
+        self.level_sizes: list[tuple[int, int]] = [(w, h) for w, h, _ in layout]
+        self.level_offsets: list[int] = [offset for _, _, offset in layout]
+        self.fd: int | None = None  # descriptor tiles are read through, opened on first use
+
+    @classmethod
+    def load(cls, src: str, tile_size: int = 64) -> 'TiledTexture':
+        """
+        Opens the texture file converted from image `src` (`src` + ".tex"), converting it first if it is
+        missing or older than the image. Texture files are opened directly.
+        """
+
+        if src.endswith(".tex"):
+            return cls(src)
+        dst = src + ".tex"
+        if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+            convert_texture(src, dst, tile_size)
+        return cls(dst)
+
+    def __reduce__(self):
+        return (TiledTexture, (self.path,))
+
+    def tiles_across(self, n: int) -> int:
+        return (n + self.tile_size - 1) // self.tile_size
+
+    def load_tile(self, level: int, tx: int, ty: int) -> bytes:
+        """Reads the encoded texels of tile (`tx`, `ty`) of mip `level`."""
+
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        tile_bytes = 3 * self.tile_size * self.tile_size
+        w, _ = self.level_sizes[level]
+        # positioned reads leave the descriptor's offset alone, which worker processes forked after the first
+        # read share with the parent
+        return os.pread(self.fd, tile_bytes, self.level_offsets[level] + (ty * self.tiles_across(w) + tx) * tile_bytes)
+
+    def texel(self, level: int, i: int, j: int) -> tuple[float, float, float]:
+        t = self.tile_size
+        tile = tile_cache.get(self, level, i // t, j // t)
+        k = 3 * ((j % t) * t + (i % t))
+        # tiles stay encoded in the cache, a quarter of the size of floats
+        return DECODE[tile[k]], DECODE[tile[k + 1]], DECODE[tile[k + 2]]
+
+    def sample(self, u: float, v: float, width: float = 0.0) -> RGB:
+        """
+        Returns the bilinearly filtered color at (`u`, `v`) (v = 0 at the bottom of the image, u repeating),
+        from the mip level whose texels are closest to `width`, the size in uv units of the area to filter.
+        """
+
+        level = 0
+        if width > 0.0:
+            level = min(max(int(math.log2(width * max(self.width, self.height))), 0), self.levels - 1)
+        w, h = self.level_sizes[level]
+
+        x = (u % 1.0) * w - 0.5
+        y = (1.0 - min(max(v, 0.0), 1.0)) * h - 0.5
+        i0, j0 = math.floor(x), math.floor(y)
+        fx, fy = x - i0, y - j0
+        i1 = (i0 + 1) % w
+        i0 %= w
+        j0, j1 = min(max(j0, 0), h - 1), min(max(j0 + 1, 0), h - 1)
+
+        r = g = b = 0.0
+        for i, j, weight in ((i0, j0, (1 - fx) * (1 - fy)), (i1, j0, fx * (1 - fy)),
+                             (i0, j1, (1 - fx) * fy), (i1, j1, fx * fy)):
+            tr, tg, tb = self.texel(level, i, j)
+            r += weight * tr
+            g += weight * tg
+            b += weight * tb
+        return RGB(r, g, b)
+
+
+class Texture(ABC):
+    """A color varying over surfaces, looked up by the surface coordinates of a hit."""
+
+    @abstractmethod
+    def value(self, u: float, v: float, p: Point, width: float = 0.0) -> RGB:
+        """Returns the color at surface coordinates (`u`, `v`) and point `p`, filtered over `width` uv units."""
+        pass
+
+
+class ImageTexture(Texture):
+    """Maps a `TiledTexture` over the surface coordinates, scaled by `scale`."""
+
+    def __init__(self, image: TiledTexture, scale: RGB = RGB(1, 1, 1)) -> None:
+        self.image = image
+        self.scale = scale
+
+    def value(self, u: float, v: float, p: Point, width: float = 0.0) -> RGB:
+        c = self.image.sample(u, v, width)
+        return RGB(c.x * self.scale.x, c.y * self.scale.y, c.z * self.scale.z)
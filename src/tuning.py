@@ -0,0 +1,102 @@
+"""
+Host tuning profile: the acceleration and scheduling parameters found fastest on this machine by
+`autotune.py`, saved as JSON and picked up by `BVH_Tree` and `Camera` whenever theirs are left unset.
+
+The profile is read from `PROFILE_PATH` (`~/.pyrt-profile.json`, or the file named by the `PYRT_PROFILE`
+environment variable) once per process. A profile tuned on a machine with a different number of CPUs is
+ignored, since the best worker count and task sizes depend on it.
+"""
+import os
+import sys
+import json
+import platform
+
+
+PROFILE_PATH = os.environ.get("PYRT_PROFILE") or os.path.join(os.path.expanduser("~"), ".pyrt-profile.json")
+
+# values used when neither the caller nor the profile sets a parameter
+DEFAULTS: dict = {
+    "split": "random",  # `BVH_Tree` split strategy
+    "leaf_size": 2,  # most objects in a `BVH_Tree` leaf
+    "packet_size": 0,  # side of the pixel blocks traced as packets, 0 for single rays
+    "rows_per_task": 1,  # scanlines handed to a pool worker at a time
+    "workers": 1,  # render processes or threads
+    "backend": "process",  # "process" or "thread" pool
+}
+
+_profile: dict | None = None  # settings of the loaded profile, read on first use
+
+
+def host() -> dict:
+    """Returns the description of this machine stored with a profile."""
+
+    return {"node": platform.node(), "cpus": os.cpu_count(), "python": platform.python_version()}
+
+
+def load(path: str = None) -> dict:
+    """
+    Returns the settings of the profile at `path` (`PROFILE_PATH` by default), or an empty dict if there is
+    none, it cannot be read, or it was tuned on a machine with a different number of CPUs.
+    """
+
+    path = path or PROFILE_PATH
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"Ignoring unreadable tuning profile {path}: {e}\n")
+        return {}
+    if data.get("host", {}).get("cpus") != os.cpu_count():
+        sys.stderr.write(f"Ignoring tuning profile {path}, tuned on a machine with a different number of CPUs\n")
+        return {}
+    return {name: value for name, value in data.get("settings", {}).items() if name in DEFAULTS}
+
+
+def profile() -> dict:
+    """Returns the settings of the profile at `PROFILE_PATH`, loading it on first use."""
+
+    global _profile
+    if _profile is None:
+        _profile = load()
+    return _profile
+
+
+def use_defaults() -> None:
+    """
+    Ignores the profile from now on in this process, so that harnesses comparing timings against recorded
+    baselines measure the defaults whatever the host was tuned to. Render worker processes follow, however
+    they are started, since `Camera.pool` hands them the parameters resolved here.
+    """
+
+    global _profile
+    _profile = {}
+
+
+def setting(name: str):
+    """Returns the profile's value of parameter `name`, or its default."""
+
+    return profile().get(name, DEFAULTS[name])
+
+
+def save(settings: dict, path: str = None, report: dict = None) -> str:
+    """
+    Writes `settings` as the profile at `path` (`PROFILE_PATH` by default), along with this machine's
+    description and the optional tuning `report`, and returns the path. The file is replaced atomically, so
+    renders starting meanwhile read either the old or the new profile.
+    """
+
+    global _profile
+    path = path or PROFILE_PATH
+    data = {"host": host(), "settings": {name: settings[name] for name in DEFAULTS if name in settings}}
+    if report is not None:
+        data["report"] = report
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+    if path == PROFILE_PATH:
+        _profile = None
+    return path
@@ -219,11 +219,11 @@ def refract(_uv: Vector, _n: Vector, ref_idx_ratio) -> Vector:
 # def linear_to_gamma(linear_component: float) -> float:
 #     return math.sqrt(linear_component)
 
+# range that color components are clamped to before quantization
+_INTENSITY = Interval(0.000, 0.999)
+
 def write_color(out, pixel_color: RGB, samples_per_pixel: int):
     """Writes gamme-transformed RGB values of vector to stream `out`."""
-    
-    if not hasattr(write_color, '_intensity'):
-        write_color._intensity = Interval(0.000, 0.999)
 
     r = pixel_color.x
     g = pixel_color.y
@@ -241,8 +241,8 @@ def write_color(out, pixel_color: RGB, samples_per_pixel: int):
     b = math.sqrt(b)
 
     # write translated [0, 255] value of each color component
-    r_out = int(256 * write_color._intensity.clamp(r))
-    g_out = int(256 * write_color._intensity.clamp(g))
-    b_out = int(256 * write_color._intensity.clamp(b))
+    r_out = int(256 * _INTENSITY.clamp(r))
+    g_out = int(256 * _INTENSITY.clamp(g))
+    b_out = int(256 * _INTENSITY.clamp(b))
 
     out.write(f"{r_out} {g_out} {b_out}\n")
\ No newline at end of file